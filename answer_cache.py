@@ -0,0 +1,134 @@
+"""
+Cache câu trả lời ngôn ngữ tự nhiên (lần gọi Gemini thứ hai của /ask).
+
+Khoá = câu hỏi đã chuẩn hoá + model + hash ổn định của mẫu kết quả đưa vào prompt, nên:
+- cùng câu hỏi trên dữ liệu không đổi → dùng lại câu trả lời, không gọi Gemini
+- dữ liệu thay đổi → hash khác → tự sinh câu trả lời mới
+
+Giới hạn theo số mục, tổng số byte (LRU) và TTL. Chỉ cache câu trả lời thật từ Gemini,
+không cache các câu fallback khi lỗi.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 3600
+# Ước lượng chi phí bộ nhớ cố định của một mục (dict, key, timestamp)
+ENTRY_OVERHEAD_BYTES = 200
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_question(question):
+    question = unicodedata.normalize("NFC", question).lower()
+    return WHITESPACE_PATTERN.sub(" ", question).strip().rstrip("?!.。 ")
+
+
+def hash_results(sample):
+    """
+    Hash ổn định của mẫu kết quả (không phụ thuộc thứ tự key trong từng dòng)
+    """
+    serialized = json.dumps(sample, sort_keys=True, ensure_ascii=False, default=str, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def make_key(question, sample, model_name="", has_more=False):
+    # has_more đổi nội dung câu trả lời ("các kết quả đầu tiên" thay vì toàn bộ) nên nằm trong khoá
+    return hashlib.sha256(
+        f"{model_name}\x00{normalize_question(question)}\x00{hash_results(sample)}\x00{int(has_more)}".encode("utf-8")
+    ).hexdigest()
+
+
+class AnswerCache:
+    """
+    LRU + TTL + giới hạn byte, trong process (mỗi worker một cache)
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 ttl_seconds=DEFAULT_TTL_SECONDS, enabled=True):
+        self._entries = OrderedDict()   # key -> (answer, expires_at, size)
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        self.configure(max_entries, max_bytes, ttl_seconds, enabled)
+
+    def configure(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                  ttl_seconds=DEFAULT_TTL_SECONDS, enabled=True):
+        """
+        Áp dụng cấu hình [answer_cache] (gọi khi khởi động app)
+        """
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.ttl_seconds = ttl_seconds
+            self.enabled = enabled
+            self._evict()
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            answer, expires_at, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return answer
+
+    def set(self, key, answer):
+        if not self.enabled:
+            return
+        size = len(key) + len(answer.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (answer, time.time() + self.ttl_seconds, size)
+            self._bytes += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# Global instance
+answer_cache = AnswerCache()
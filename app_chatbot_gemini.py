@@ -1,293 +1,48 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, send_file
 from flask_cors import CORS
 import logging
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
+import hmac
 import json
-import re
+import os
+import time
+from itertools import chain
 
 from config import load_config
-from gemini_ai import configure_gemini, generate_sql_query, generate_natural_language_response
-from db import get_db_connection
-from schema_utils import load_schema, extract_table_names, validate_tables_in_sql, extract_possible_table_names, filter_schema_by_table_names
-from sql_utils import is_safe_sql
+from gemini_ai import configure_gemini, generate_sql_query, generate_natural_language_response, generate_json_content, match_timesheet_lines
+from db import create_db_router
+from schema_utils import load_schema, extract_table_names, extract_tables_from_sql, validate_tables_in_sql, extract_possible_table_names, filter_schema_by_table_names
+from sql_utils import is_safe_sql, split_trailing_limit, build_page_sql, has_order_by
+from memory_store import create_memory_store
+from answer_cache import answer_cache
+from deadline import Deadline, DeadlineExceeded, TIMEOUT_HEADER
+from result_utils import fetch_result, to_records, dumps, iter_compact_json, RESULT_FORMATS, STREAM_BATCH_SIZE
+from query_handles import create_query_handle_store
+from query_log import (
+    create_query_log, schema_version, QuestionSQLCache, StageTimer,
+    DEFAULT_REPORT_WINDOW, MAX_REPORT_LIMIT, MAX_REPORT_WINDOW
+)
+from profiling import create_request_profiler, DEFAULT_PATHS as PROFILED_PATHS, DEFAULT_ARM_TTL_SECONDS
+from intent_templates import load_intent_matcher
 from token_utils import token_manager
+from report_parser import extract_report_date
+from timesheet_utils import (
+    parse_tasks_from_system, parse_daily_report, match_tasks_with_system_tasks, match_tasks_with_embeddings,
+    iter_bulk_results, split_confident_matches,
+    TaskIndex, TaskEmbeddingCache, MIN_EMBEDDING_SCORE, CONFIDENT_MATCH_SCORE, HYBRID_TOP_K
+)
 
-conversation_memory = {}
 embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Embedding task hệ thống được cache theo (ID, hash nội dung) giữa các request
+task_embedding_cache = TaskEmbeddingCache(embedding_model)
 
 with open("table_keywords.json", "r", encoding="utf-8") as f:
     keyword_table_mapping = json.load(f)
 
 def find_similar_cached_response(user_id, new_question, threshold=0.85):
-    if user_id not in conversation_memory:
-        return None
-    
-    new_embedding = embedding_model.encode(new_question, convert_to_tensor=True)
-    for item in reversed(conversation_memory[user_id][-5:]):  # chỉ check 5 câu gần nhất
-        sim = util.cos_sim(new_embedding, item['embedding'])[0][0].item()
-        if sim > threshold:
-            return item  # Trả lại kết quả cũ đã truy vấn
-    
-    return None
-
-def parse_tasks_from_system(tasks_text):
-    """
-    Parse danh sách task từ hệ thống
-    Format: "ID - ProjectName - TaskName"
-    """
-    tasks = []
-    lines = tasks_text.strip().split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Pattern: "221 - HousingStaff - Mockup register"
-        match = re.match(r'(\d+)\s*-\s*([^-]+)\s*-\s*(.+)', line)
-        if match:
-            task_id, project_name, task_name = match.groups()
-            tasks.append({
-                'id': task_id.strip(),
-                'project_name': project_name.strip(),
-                'task_name': task_name.strip()
-            })
-    
-    return tasks
-
-def parse_daily_report(report_text):
-    """
-    Parse báo cáo hằng ngày để extract thông tin effort
-    Chỉ phân tích phần "Today(Actual - Thực tế)"
-    """
-    # Tìm phần Actual
-    actual_pattern = r'■■\s*Today\(Actual\s*-\s*Thực tế\)\s*■■(.*?)(?=■■|$)'
-    actual_match = re.search(actual_pattern, report_text, re.DOTALL | re.IGNORECASE)
-    
-    if not actual_match:
-        return []
-    
-    actual_section = actual_match.group(1)
-    projects_effort = []
-    
-    # Pattern để tìm project và effort: "■ ProjectName - Xh"
-    project_pattern = r'■\s*([^-]+)\s*-\s*(\d+)h'
-    project_matches = re.findall(project_pattern, actual_section, re.IGNORECASE)
-    
-    for project_name, effort in project_matches:
-        project_name = project_name.strip()
-        effort = int(effort)
-        
-        # Tìm các task trong project này
-        tasks = []
-        # Pattern để tìm task: "+ Task description"
-        task_pattern = r'\+\s*(.+)'
-        task_matches = re.findall(task_pattern, actual_section)
-        
-        # Tìm phần task thuộc về project này
-        project_start = actual_section.find(f"■ {project_name}")
-        if project_start != -1:
-            # Tìm phần kết thúc của project (dòng tiếp theo bắt đầu bằng ■)
-            next_project = re.search(r'\n\s*■\s*[^-]', actual_section[project_start:])
-            if next_project:
-                project_section = actual_section[project_start:project_start + next_project.start()]
-            else:
-                project_section = actual_section[project_start:]
-            
-            # Extract tasks từ phần project
-            task_matches = re.findall(r'\+\s*(.+)', project_section)
-            tasks = [task.strip() for task in task_matches]
-        
-        projects_effort.append({
-            'project_name': project_name,
-            'effort': effort,
-            'tasks': tasks
-        })
-    
-    return projects_effort
-
-def match_tasks_with_system_tasks(daily_efforts, system_tasks):
-    """
-    Match effort từ báo cáo với task trong hệ thống
-    Cải thiện logic để chấp nhận task có ý nghĩa tương tự
-    """
-    results = []
-    undefined_tasks = []
-    
-    for daily_effort in daily_efforts:
-        project_name = daily_effort['project_name']
-        total_effort = daily_effort['effort']
-        daily_tasks = daily_effort['tasks']
-        
-        # Tìm các task trong hệ thống thuộc về project này
-        matching_system_tasks = [
-            task for task in system_tasks 
-            if task['project_name'].lower() == project_name.lower()
-        ]
-        
-        # Nếu không tìm thấy task trong hệ thống theo project name
-        if not matching_system_tasks:
-            # Thử tìm task theo nội dung tương tự trong toàn bộ hệ thống
-            matched_tasks = []
-            unmatched_daily_tasks = []
-            
-            for task_desc in daily_tasks:
-                best_match = None
-                best_score = 0
-                
-                for sys_task in system_tasks:
-                    # Tính điểm tương đồng dựa trên nhiều tiêu chí
-                    score = calculate_similarity_score(task_desc, sys_task['task_name'])
-                    if score > best_score and score >= 0.3:  # Ngưỡng tối thiểu 30%
-                        best_score = score
-                        best_match = sys_task
-                
-                if best_match:
-                    matched_tasks.append({
-                        'daily_task': task_desc,
-                        'system_task': best_match,
-                        'score': best_score
-                    })
-                else:
-                    unmatched_daily_tasks.append(task_desc)
-            
-            # Nếu tìm thấy ít nhất 1 task tương tự, phân bổ effort
-            if matched_tasks:
-                effort_per_matched_task = total_effort / len(matched_tasks)
-                for match in matched_tasks:
-                    results.append(f"{match['system_task']['id']} - {effort_per_matched_task}")
-                
-                # Thêm các task không match vào undefined
-                for task_desc in unmatched_daily_tasks:
-                    undefined_tasks.append({
-                        'project_name': project_name,
-                        'task_name': task_desc,
-                        'effort': total_effort / len(daily_tasks) if daily_tasks else total_effort
-                    })
-            else:
-                # Không tìm thấy task nào tương tự, thêm tất cả vào undefined
-                for task_desc in daily_tasks:
-                    undefined_tasks.append({
-                        'project_name': project_name,
-                        'task_name': task_desc,
-                        'effort': total_effort / len(daily_tasks) if daily_tasks else total_effort
-                    })
-            continue
-        
-        # Nếu có task trong hệ thống theo project name
-        matched_daily_tasks = []
-        unmatched_daily_tasks = []
-        
-        for task_desc in daily_tasks:
-            best_match = None
-            best_score = 0
-            
-            # Ưu tiên tìm trong cùng project trước
-            for sys_task in matching_system_tasks:
-                score = calculate_similarity_score(task_desc, sys_task['task_name'])
-                if score > best_score and score >= 0.3:
-                    best_score = score
-                    best_match = sys_task
-            
-            # Nếu không tìm thấy trong cùng project, tìm trong toàn bộ hệ thống
-            if not best_match:
-                for sys_task in system_tasks:
-                    score = calculate_similarity_score(task_desc, sys_task['task_name'])
-                    if score > best_score and score >= 0.3:
-                        best_score = score
-                        best_match = sys_task
-            
-            if best_match:
-                matched_daily_tasks.append({
-                    'daily_task': task_desc,
-                    'system_task': best_match,
-                    'score': best_score
-                })
-            else:
-                unmatched_daily_tasks.append(task_desc)
-        
-        # Phân bổ effort cho các task đã match
-        if matched_daily_tasks:
-            effort_per_matched_task = total_effort / len(matched_daily_tasks)
-            for match in matched_daily_tasks:
-                results.append(f"{match['system_task']['id']} - {effort_per_matched_task}")
-        
-        # Thêm các task không match vào undefined
-        for task_desc in unmatched_daily_tasks:
-            undefined_tasks.append({
-                'project_name': project_name,
-                'task_name': task_desc,
-                'effort': total_effort / len(daily_tasks) if daily_tasks else total_effort
-            })
-    
-    return results, undefined_tasks
-
-def calculate_similarity_score(daily_task, system_task):
-    """
-    Tính điểm tương đồng giữa task trong báo cáo và task trong hệ thống
-    Trả về điểm từ 0-1, càng cao càng tương tự
-    """
-    daily_lower = daily_task.lower()
-    system_lower = system_task.lower()
-    
-    # 1. Exact match hoặc substring match
-    if daily_lower == system_lower:
-        return 1.0
-    if daily_lower in system_lower or system_lower in daily_lower:
-        return 0.8
-    
-    # 2. Keyword matching
-    daily_words = set(daily_lower.split())
-    system_words = set(system_lower.split())
-    
-    # Loại bỏ các từ không quan trọng
-    stop_words = {'làm', 'viết', 'tạo', 'thực', 'hiện', 'công', 'việc', 'task', 'work', 'do', 'make', 'create'}
-    daily_words = daily_words - stop_words
-    system_words = system_words - stop_words
-    
-    if not daily_words or not system_words:
-        return 0.0
-    
-    # Tính điểm dựa trên số từ chung
-    common_words = daily_words & system_words
-    if common_words:
-        similarity = len(common_words) / max(len(daily_words), len(system_words))
-        return min(similarity * 1.5, 1.0)  # Tăng điểm cho keyword matching
-    
-    # 3. Fuzzy matching cho các từ tương tự
-    # Ví dụ: "mockup" ~ "mock up", "register" ~ "registration"
-    similar_keywords = {
-        'mockup': ['mock', 'up', 'design'],
-        'register': ['registration', 'signup', 'sign'],
-        'meeting': ['meet', 'discussion', 'báo cáo'],
-        'estimate': ['estimation', 'tính toán'],
-        'price': ['pricing', 'giá', 'cost'],
-        'schedule': ['lịch', 'trình', 'plan'],
-        'transfer': ['chuyển', 'move', 'copy']
-    }
-    
-    daily_keywords = set()
-    system_keywords = set()
-    
-    for word in daily_words:
-        for key, similar_list in similar_keywords.items():
-            if word in similar_list or key in word:
-                daily_keywords.add(key)
-                break
-    
-    for word in system_words:
-        for key, similar_list in similar_keywords.items():
-            if word in similar_list or key in word:
-                system_keywords.add(key)
-                break
-    
-    if daily_keywords and system_keywords:
-        common_keywords = daily_keywords & system_keywords
-        if common_keywords:
-            return 0.6  # Điểm cho fuzzy matching
-    
-    return 0.0
-
+    new_embedding = embedding_model.encode(new_question)
+    # chỉ check 5 câu gần nhất, trả lại kết quả cũ đã truy vấn nếu đủ giống
+    return conversation_memory.find_similar(user_id, new_embedding, threshold, window=5)
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -299,14 +54,72 @@ logging.basicConfig(
 )
 
 app = Flask(__name__)
-CORS(app, resources={r"/ask": {"origins": "http://pms.test"}})
+CORS(app, resources={r"/ask(/.*)?": {"origins": "http://pms.test"}})
 config_data = load_config()
 configure_gemini(config_data["GEMINI_API_KEY"])
 DB_CONFIG = config_data["DB"]
+# Truy vấn đọc của chatbot đi qua read replica (nếu có), failover về primary
+db_router = create_db_router(DB_CONFIG, config_data["DB_REPLICAS"], config_data["DB_ROUTING"])
+# Bộ nhớ hội thoại có giới hạn (LRU); backend sqlite để các worker dùng chung
+conversation_memory = create_memory_store(config_data["MEMORY"], embedding_model.get_sentence_embedding_dimension())
+# Handle phân trang cho kết quả /ask (không gọi lại Gemini khi xem trang tiếp theo)
+QUERY_HANDLES_CONFIG = config_data["QUERY_HANDLES"]
+query_handles = create_query_handle_store(QUERY_HANDLES_CONFIG)
+# Thời gian tối đa cho mỗi request /ask (header X-Request-Timeout hoặc mặc định)
+DEADLINE_CONFIG = config_data["DEADLINE"]
+# Cache câu trả lời tự nhiên theo (câu hỏi, hash dữ liệu)
+answer_cache.configure(**config_data["ANSWER_CACHE"])
+# Profile theo yêu cầu (None nếu tắt); bật / tải báo cáo qua /admin/profile
+PROFILING_CONFIG = config_data["PROFILING"]
+request_profiler = create_request_profiler(PROFILING_CONFIG)
+
+if request_profiler is not None:
+    @app.before_request
+    def start_request_profile():
+        g.profile_capture = request_profiler.start(request.method, request.path)
+
+    @app.teardown_request
+    def finish_request_profile(error=None):
+        # teardown chạy sau khi response (kể cả stream) gửi xong
+        capture = g.pop("profile_capture", None)
+        if capture is not None:
+            try:
+                request_profiler.finish(capture, g.pop("profile_status", None))
+            except Exception as e:
+                logging.error(f"Không ghi được báo cáo profile {capture['id']}: {e}")
+
+    @app.after_request
+    def record_profile_status(response):
+        if g.get("profile_capture") is not None:
+            g.profile_status = response.status_code
+        return response
 
 schema_text = load_schema()
 allowed_tables = set(t.lower() for t in extract_table_names(schema_text))
 
+# Template SQL cho các câu hỏi thường gặp (None nếu tắt hoặc không có file)
+INTENTS_CONFIG = config_data["INTENTS"]
+intent_matcher = load_intent_matcher(
+    INTENTS_CONFIG["path"], embedding_model, INTENTS_CONFIG["min_score"], INTENTS_CONFIG["keyword_min_score"], allowed_tables
+) if INTENTS_CONFIG["enabled"] else None
+
+# Nhật ký câu hỏi / SQL (SQLite) + cache câu hỏi -> SQL làm nóng từ các câu hỏi thường gặp của schema hiện tại
+SCHEMA_VERSION = schema_version(schema_text)
+QUERY_LOG_CONFIG = config_data["QUERY_LOG"]
+query_log = create_query_log(QUERY_LOG_CONFIG)
+sql_cache = QuestionSQLCache(embedding_model, QUERY_LOG_CONFIG["max_entries"], QUERY_LOG_CONFIG["similarity"])
+if query_log is not None and QUERY_LOG_CONFIG["warm_top_n"]:
+    warm_start = time.perf_counter()
+    query_log.prune()
+    warm_entries = [
+        entry for entry in query_log.top_questions(SCHEMA_VERSION, QUERY_LOG_CONFIG["warm_top_n"])
+        if set(entry["tables"]) <= allowed_tables
+    ]
+    logging.info(
+        f"SQL cache warmed with {sql_cache.warm(warm_entries)} questions "
+        f"(schema {SCHEMA_VERSION}) in {(time.perf_counter() - warm_start) * 1000:.0f}ms"
+    )
+
 def is_modifying_question(question: str) -> bool:
     # hiện tại modify keywords đang hard code chỉ là một danh sách đơn giản, có thể mở rộng sau này
     # phương pháp mở rộng có thể là sử dụng mô hình AI để phân tích câu hỏi nhưng hiện tại sẽ tốn phí nên chưa triển khai
@@ -316,17 +129,220 @@ def is_modifying_question(question: str) -> bool:
     question_lower = question.lower()
     return any(keyword in question_lower for keyword in modifying_keywords)
 
+def request_deadline():
+    return Deadline.from_header(
+        request.headers.get(TIMEOUT_HEADER), DEADLINE_CONFIG["default_seconds"], DEADLINE_CONFIG["max_seconds"]
+    )
+
+def deadline_exceeded_response(e):
+    logging.warning(f"{e} ({request.path})")
+    return jsonify({
+        "error": "Yêu cầu xử lý quá thời gian cho phép. Vui lòng thử lại hoặc hỏi cụ thể hơn.",
+        "error_type": "deadline_exceeded",
+        "stage": e.stage
+    }), 504
+
+def json_response(payload, status=200):
+    # Serialize nhanh (orjson nếu có), Decimal / datetime đã được chuyển kiểu
+    return Response(dumps(payload), status=status, mimetype="application/json")
+
+def results_payload(columns, rows, result_format, records=None):
+    """
+    "records": {"results": [{...}]} (mặc định, như trước) | "compact": {"columns": [...], "rows": [[...]]}
+    """
+    if result_format == "compact":
+        return {"columns": columns, "rows": rows}
+    return {"results": records if records is not None else to_records(columns, rows)}
+
+def execute_sql(cursor, sql, params=None):
+    if params:
+        cursor.execute(sql, params)
+    else:
+        cursor.execute(sql)
+
+def fetch_page(base_sql, page_size, offset, params=None, timeout=None):
+    """
+    Chạy một trang của câu SQL, lấy dư 1 dòng để biết còn trang sau hay không.
+    Quá timeout (giây) thì query bị KILL và raise DeadlineExceeded
+
+    :return: (columns, rows đã chuyển kiểu, has_more)
+    """
+    page_sql = build_page_sql(base_sql, page_size + 1, offset)
+
+    def query(conn):
+        # Cursor tuple: không dựng một dict cho mỗi dòng
+        cursor = conn.cursor()
+        try:
+            execute_sql(cursor, page_sql, params)
+            return fetch_result(cursor)
+        finally:
+            cursor.close()
+
+    # Mọi truy vấn của /ask chỉ đọc nên đi được qua replica
+    columns, rows = db_router.run(query, read_only=True, timeout=timeout)
+    return columns, rows[:page_size], len(rows) > page_size
+
+def stream_page(handle_id, handle, page_size, offset, deadline):
+    """
+    Stream một trang lớn dạng compact theo từng lô fetchmany, giữ kết nối DB trong lúc stream.
+    Thông tin "page" được ghi ở cuối object sau khi biết số dòng thực tế.
+    Quá deadline giữa chừng thì query bị KILL, stream kết thúc với các dòng đã gửi và "error_type": "deadline_exceeded"
+    """
+    page_sql = build_page_sql(handle["sql"], page_size + 1, offset)
+    state = {"count": 0, "has_more": False, "deadline_exceeded": False}
+
+    with db_router.connection(read_only=True, timeout=deadline.remaining()) as conn:
+        cursor = conn.cursor()
+        try:
+            execute_sql(cursor, page_sql, handle["params"])
+
+            def batches():
+                try:
+                    while state["count"] < page_size:
+                        batch = cursor.fetchmany(min(STREAM_BATCH_SIZE, page_size - state["count"]))
+                        if not batch:
+                            return
+                        state["count"] += len(batch)
+                        yield batch
+                    # Dòng dư (page_size + 1) cho biết còn trang sau
+                    state["has_more"] = bool(cursor.fetchall())
+                except Exception:
+                    if not deadline.expired():
+                        raise
+                    # Header đã gửi, không đổi được sang 504: đóng object và báo client đọc tiếp từ next_offset
+                    logging.warning(f"Stream {handle_id} quá deadline sau {state['count']} dòng")
+                    state["deadline_exceeded"] = True
+                    state["has_more"] = True
+
+            def trailer():
+                next_offset = offset + state["count"]
+                query_handles.advance(handle_id, next_offset)
+                extra = {
+                    "question": handle["question"],
+                    "result_handle": handle_id,
+                    "page": {"offset": offset, "page_size": page_size, "next_offset": next_offset,
+                             "has_more": within_limit(state["has_more"], next_offset, handle["end_offset"]),
+                             "ordered": has_order_by(handle["sql"])}
+                }
+                if state["deadline_exceeded"]:
+                    extra["error_type"] = "deadline_exceeded"
+                return extra
+
+            yield from iter_compact_json(list(cursor.column_names), batches(), trailer)
+        finally:
+            cursor.close()
+
+def guess_tables_from_question(question, keyword_mapping):
+    """
+    Trả về danh sách bảng có thể liên quan đến câu hỏi dựa trên keyword mapping
+    """
+    question_lower = question.lower()
+    matched_tables = set()
+    for keyword, tables in keyword_mapping.items():
+        if keyword in question_lower:
+            matched_tables.update(tables)
+    return list(matched_tables)
+
+def generate_gemini_sql(question, deadline, timer):
+    """
+    Gọi Gemini sinh SQL từ schema rút gọn theo các bảng liên quan đến câu hỏi
+
+    :return: (sql, None) hoặc (None, response lỗi để trả về client)
+    """
+    deadline.check("keyword_matching")
+    ####### generated_sql = generate_sql_query(question, schema_text)
+    # Tìm các bảng có thể liên quan đến câu hỏi
+    relevant_tables = guess_tables_from_question(question, keyword_table_mapping)
+
+    # Nếu không đoán được bảng nào → fallback toàn bộ schema
+    if not relevant_tables:
+        logging.info("Không tìm thấy bảng liên quan, dùng toàn bộ schema")
+        relevant_schema = schema_text
+    else:
+        logging.info(f"Các bảng liên quan đến câu hỏi: {relevant_tables}")
+        relevant_schema = filter_schema_by_table_names(schema_text, relevant_tables)
+
+    try:
+        with timer.stage("sql_generation"):
+            return deadline.run(
+                "sql_generation", generate_sql_query, question, relevant_schema, timeout=deadline.remaining()
+            ), None
+    except DeadlineExceeded:
+        raise
+    except ValueError as ve:
+        # Token limit exceeded
+        logging.error(f"Token limit error: {str(ve)}")
+        return None, (jsonify({
+            "error": "Câu hỏi quá phức tạp hoặc schema quá lớn. Vui lòng thử câu hỏi cụ thể hơn.",
+            "error_type": "token_limit_exceeded",
+            "details": str(ve)
+        }), 400)
+    except Exception as e:
+        # Other API errors
+        logging.error(f"Gemini API error: {str(e)}")
+        return None, (jsonify({
+            "error": "Có lỗi xảy ra khi xử lý câu hỏi. Vui lòng thử lại sau.",
+            "error_type": "api_error"
+        }), 500)
+
+def unsafe_sql_response(sql):
+    """
+    Kiểm tra SQL chỉ đọc và chỉ dùng bảng có trong schema
+
+    :return: None nếu hợp lệ, ngược lại response lỗi 400
+    """
+    if not is_safe_sql(sql):
+        return jsonify({
+            "error": "Chỉ câu hỏi an toàn được phép và chấp nhận câu hỏi SQL an toàn.",
+            "sql_generated": sql
+        }), 400
+
+    is_valid, forbidden = validate_tables_in_sql(sql, allowed_tables)
+    if not is_valid:
+        return jsonify({
+            "error": f"Query references tables not in schema: {', '.join(forbidden)}",
+            "sql_generated": sql
+        }), 400
+    return None
+
+def within_limit(has_more, next_offset, end_offset):
+    """
+    Còn trang sau chỉ khi chưa tới LIMIT tổng của câu SQL (end_offset, None = không giới hạn)
+    """
+    return has_more and (end_offset is None or next_offset < end_offset)
+
+def run_first_page(sql, params, deadline, timer):
+    """
+    Chạy trang đầu của câu SQL. LIMIT của câu SQL (nếu có, vd. "top 5 ...") là giới hạn tổng số dòng:
+    trang đầu không vượt quá nó và các trang sau dừng ở end_offset
+
+    :return: (base_sql, page_size, offset, end_offset, columns, rows, has_more)
+    """
+    base_sql, sql_limit, offset = split_trailing_limit(sql)
+    end_offset = offset + sql_limit if sql_limit is not None else None
+    page_size = min(sql_limit or QUERY_HANDLES_CONFIG["page_size"], QUERY_HANDLES_CONFIG["max_page_size"])
+    with timer.stage("db"):
+        columns, rows, has_more = fetch_page(base_sql, page_size, offset, params, timeout=deadline.remaining())
+    return base_sql, page_size, offset, end_offset, columns, rows, within_limit(has_more, offset + len(rows), end_offset)
+
 @app.route("/ask", methods=["POST"])
 def handle_question():
     data = request.get_json()
     question = data.get("question", "")
     # user_id = data.get("user_id", "default")  # thêm user_id vào request PMS để tách session
+    result_format = data.get("format", "records")
     
     if not question:
         return jsonify({"error": "Missing question"}), 400
+    if result_format not in RESULT_FORMATS:
+        return jsonify({"error": f"format phải là một trong: {', '.join(RESULT_FORMATS)}"}), 400
 
     if is_modifying_question(question):
         return {"error": "Câu hỏi mang tính chỉnh sửa dữ liệu. Không thực hiện."}
+
+    # ⏱️ Mỗi bước bên dưới chỉ được dùng phần thời gian còn lại của deadline
+    deadline = request_deadline()
+    timer = StageTimer()
     
     try:
         # # 🔍 Kiểm tra câu hỏi tương tự
@@ -342,117 +358,202 @@ def handle_question():
         #         "cached": True
         #     })
 
-        # 💡 Không có cache, tiếp tục như hiện tại
-        ####### generated_sql = generate_sql_query(question, schema_text)
-        # keyword -> related tables
-
-        def guess_tables_from_question(question, keyword_mapping):
-            """
-            Trả về danh sách bảng có thể liên quan đến câu hỏi dựa trên keyword mapping
-            """
-            question_lower = question.lower()
-            matched_tables = set()
-            for keyword, tables in keyword_mapping.items():
-                if keyword in question_lower:
-                    matched_tables.update(tables)
-            return list(matched_tables)
-        # Tìm các bảng có thể liên quan đến câu hỏi
-        relevant_tables = guess_tables_from_question(question, keyword_table_mapping)
-
-# Nếu không đoán được bảng nào → fallback toàn bộ schema
-        if not relevant_tables:
-            logging.info("Không tìm thấy bảng liên quan, dùng toàn bộ schema")
-            relevant_schema = schema_text
+        # ⚡ Câu hỏi thường gặp: sinh SQL từ template cục bộ, không gọi Gemini
+        with timer.stage("intent"):
+            intent = intent_matcher.match(question) if intent_matcher else None
+        sql_params = None
+        question_embedding = None
+        if intent:
+            logging.info(f"Intent template '{intent['name']}' (score {intent['score']}), slots: {intent['slots']}")
+            generated_sql, sql_params = intent["sql"], intent["params"]
+            sql_source = "intent"
         else:
-            logging.info(f"Các bảng liên quan đến câu hỏi: {relevant_tables}")
-            relevant_schema = filter_schema_by_table_names(schema_text, relevant_tables)
-
-        # Gọi Gemini sinh SQL từ schema rút gọn
-        try:
-            generated_sql = generate_sql_query(question, relevant_schema)
-        except ValueError as ve:
-            # Token limit exceeded
-            logging.error(f"Token limit error: {str(ve)}")
-            return jsonify({
-                "error": "Câu hỏi quá phức tạp hoặc schema quá lớn. Vui lòng thử câu hỏi cụ thể hơn.",
-                "error_type": "token_limit_exceeded",
-                "details": str(ve)
-            }), 400
-        except Exception as e:
-            # Other API errors
-            logging.error(f"Gemini API error: {str(e)}")
-            return jsonify({
-                "error": "Có lỗi xảy ra khi xử lý câu hỏi. Vui lòng thử lại sau.",
-                "error_type": "api_error"
-            }), 500
-
-        if not is_safe_sql(generated_sql):
-            return jsonify({
-                "error": "Chỉ câu hỏi an toàn được phép và chấp nhận câu hỏi SQL an toàn.",
-                "sql_generated": generated_sql
-            }), 400
-
-        is_valid, forbidden = validate_tables_in_sql(generated_sql, allowed_tables)
-        if not is_valid:
-            return jsonify({
-                "error": f"Query references tables not in schema: {', '.join(forbidden)}",
-                "sql_generated": generated_sql
-            }), 400
+            # ♻️ Câu hỏi (gần) giống câu đã trả lời: dùng lại SQL đã kiểm tra, không gọi Gemini
+            with timer.stage("sql_cache"):
+                cached_sql, question_embedding = sql_cache.lookup(question)
+            if cached_sql:
+                logging.info(f"SQL cache {cached_sql['match']} hit (score {cached_sql['score']}): {cached_sql['question']}")
+                generated_sql = cached_sql["sql"]
+                sql_source = "sql_cache"
+            else:
+                sql_source = "gemini"
+                generated_sql, error_response = generate_gemini_sql(question, deadline, timer)
+                if error_response:
+                    return error_response
 
-        conn = get_db_connection(DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(generated_sql)
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        error_response = unsafe_sql_response(generated_sql)
+        if error_response:
+            return error_response
 
         try:
-            natural_response = generate_natural_language_response(question, results)
+            base_sql, page_size, offset, end_offset, columns, rows, has_more = run_first_page(
+                generated_sql, sql_params, deadline, timer
+            )
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            logging.error(f"Error generating natural response: {str(e)}")
-            # Fallback response if token issues
-            natural_response = f"Tìm thấy {len(results)} kết quả cho câu hỏi của bạn. Dữ liệu có thể xem trong phần 'results'."
+            if sql_source != "intent":
+                raise
+            # Template đoán sai tên cột/bảng: không trả lỗi, để Gemini sinh SQL như bình thường
+            logging.warning(f"SQL của intent template '{intent['name']}' lỗi, chuyển sang Gemini: {e}")
+            intent, sql_params, sql_source = None, None, "gemini"
+            generated_sql, error_response = generate_gemini_sql(question, deadline, timer)
+            if error_response:
+                return error_response
+            error_response = unsafe_sql_response(generated_sql)
+            if error_response:
+                return error_response
+            base_sql, page_size, offset, end_offset, columns, rows, has_more = run_first_page(
+                generated_sql, sql_params, deadline, timer
+            )
+        results = to_records(columns, rows)
+        next_offset = offset + len(rows)
+        result_handle = query_handles.create(
+            question, base_sql, page_size, next_offset, sql_params, end_offset
+        ) if has_more else None
+        ordered = has_order_by(base_sql)
+        if has_more and not ordered:
+            logging.warning("Phân trang câu SQL không có ORDER BY: các trang sau có thể lặp hoặc thiếu dòng")
+
+        # Fallback response if token issues
+        if has_more:
+            fallback_response = (
+                f"Đây là {len(results)} kết quả đầu tiên cho câu hỏi của bạn, vẫn còn kết quả khác. "
+                "Dữ liệu có thể xem trong phần 'results', dùng result_handle để xem trang tiếp theo."
+            )
+        else:
+            fallback_response = f"Tìm thấy {len(results)} kết quả cho câu hỏi của bạn. Dữ liệu có thể xem trong phần 'results'."
+        if deadline.remaining() < DEADLINE_CONFIG["answer_min_seconds"]:
+            # Không đủ thời gian cho lần gọi Gemini thứ hai, vẫn trả rows
+            logging.warning(f"Bỏ bước sinh câu trả lời, chỉ còn {deadline.remaining():.1f}s")
+            natural_response = fallback_response
+        else:
+            try:
+                with timer.stage("answer"):
+                    natural_response = deadline.run(
+                        "answer", generate_natural_language_response, question, results,
+                        timeout=deadline.remaining(), has_more=has_more
+                    )
+            except Exception as e:
+                logging.error(f"Error generating natural response: {str(e)}")
+                natural_response = fallback_response
 
         # # 🧠 Lưu lại kết quả vào bộ nhớ
-        # emb = embedding_model.encode(question, convert_to_tensor=True)
-        # conversation_memory.setdefault(user_id, []).append({
-        #     "question": question,
-        #     "embedding": emb,
-        #     "sql": generated_sql,
-        #     "result": results
-        # })
+        # emb = embedding_model.encode(question)
+        # conversation_memory.add(user_id, question, emb, generated_sql, results)
 
-        return jsonify({
+        # SQL của Gemini đã chạy thành công: cache để câu hỏi lặp lại không phải gọi Gemini
+        sql_tables = extract_tables_from_sql(generated_sql)
+        if sql_source == "gemini":
+            sql_cache.add(question, generated_sql, sql_tables, question_embedding)
+        if query_log is not None:
+            try:
+                query_log.record(question, generated_sql, sql_tables, SCHEMA_VERSION, sql_source,
+                                 timer.timings, timer.total_ms(), len(rows))
+            except Exception as e:
+                logging.error(f"Không ghi được query log: {e}")
+
+        return json_response({
             "question": question,
             "sql_generated": generated_sql,
-            "results": results,
+            **results_payload(columns, rows, result_format, results),
             "response": natural_response,
-            "cached": False
+            "result_handle": result_handle,
+            "page": {"offset": offset, "page_size": page_size, "next_offset": next_offset, "has_more": has_more,
+                     "ordered": ordered},
+            "intent": intent["name"] if intent else None,
+            "sql_source": sql_source,
+            "cached": sql_source == "sql_cache"
         })
 
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
     except Exception as e:
         logging.error(f"Error in /ask endpoint: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/ask/page", methods=["POST"])
+def handle_question_page():
+    """
+    Lấy trang tiếp theo của kết quả /ask theo result_handle, không gọi Gemini.
+
+    Body: {"result_handle": "...", "offset": (tuỳ chọn, mặc định trang kế tiếp), "page_size": (tuỳ chọn),
+           "format": "records" | "compact", "stream": true (stream dạng compact, page_size tối đa max_stream_rows)}
+    """
+    data = request.get_json(silent=True) or {}
+    handle_id = data.get("result_handle")
+    if not handle_id:
+        return jsonify({"error": "Missing result_handle"}), 400
+
+    handle = query_handles.get(handle_id)
+    if handle is None:
+        return jsonify({
+            "error": "Kết quả đã hết hạn hoặc không tồn tại. Vui lòng hỏi lại.",
+            "error_type": "handle_expired"
+        }), 404
+
+    try:
+        offset = int(data.get("offset", handle["next_offset"]))
+        page_size = int(data.get("page_size", handle["page_size"]))
+    except (TypeError, ValueError):
+        return jsonify({"error": "offset và page_size phải là số nguyên"}), 400
+    if offset < 0 or page_size < 1:
+        return jsonify({"error": "offset phải >= 0 và page_size phải >= 1"}), 400
+    result_format = data.get("format", "records")
+    if result_format not in RESULT_FORMATS:
+        return jsonify({"error": f"format phải là một trong: {', '.join(RESULT_FORMATS)}"}), 400
+    end_offset = handle["end_offset"]
+    if end_offset is not None:
+        if offset >= end_offset:
+            return jsonify({"error": f"offset phải nhỏ hơn {end_offset} (LIMIT của câu SQL)"}), 400
+        page_size = min(page_size, end_offset - offset)
+
+    if data.get("stream"):
+        page_size = min(page_size, QUERY_HANDLES_CONFIG["max_stream_rows"])
+        chunks = stream_page(handle_id, handle, page_size, offset, request_deadline())
+        try:
+            # Chạy tới chunk đầu (sau execute) để lỗi / quá deadline lúc chạy query vẫn trả được 504 / 500
+            first = next(chunks)
+        except DeadlineExceeded as e:
+            return deadline_exceeded_response(e)
+        except Exception as e:
+            logging.error(f"Error in /ask/page endpoint: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+        return Response(stream_with_context(chain([first], chunks)), mimetype="application/json")
+
+    page_size = min(page_size, QUERY_HANDLES_CONFIG["max_page_size"])
+    try:
+        columns, rows, has_more = fetch_page(handle["sql"], page_size, offset, handle["params"], timeout=request_deadline().remaining())
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
+    except Exception as e:
+        logging.error(f"Error in /ask/page endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+    next_offset = offset + len(rows)
+    has_more = within_limit(has_more, next_offset, end_offset)
+    query_handles.advance(handle_id, next_offset)
+    return json_response({
+        "question": handle["question"],
+        **results_payload(columns, rows, result_format),
+        "result_handle": handle_id,
+        "page": {"offset": offset, "page_size": page_size, "next_offset": next_offset, "has_more": has_more,
+                 "ordered": has_order_by(handle["sql"])}
+    })
+
 # API RIÊNG CHO SERVER CHATBOT ĐỂ TỐI ƯU HIỆU SUẤT MÔ HÌNH AI
 @app.route("/cache", methods=["GET"])
 def view_cache():
     user_id = request.args.get("user_id", "default")
-    history = conversation_memory.get(user_id, [])
-
-    simplified = [
-        {
-            "question": item["question"],
-            "sql": item["sql"],
-            "num_results": len(item["result"])  # chỉ trả số lượng để tránh log quá nhiều
-        }
-        for item in history
-    ]
+    # chỉ trả số lượng kết quả để tránh log quá nhiều
+    simplified = conversation_memory.history(user_id)
 
     return jsonify({
         "user_id": user_id,
         "cached_questions": simplified,
-        "total_cached": len(simplified)
+        "total_cached": len(simplified),
+        "memory": conversation_memory.stats(),
+        "answer_cache": answer_cache.stats()
     })
 
 
@@ -460,9 +561,111 @@ def view_cache():
 @app.route("/cache/clear", methods=["POST"])
 def clear_cache():
     user_id = request.json.get("user_id", "default")
-    conversation_memory[user_id] = []
+    conversation_memory.clear(user_id)
     return jsonify({"message": f"Cache cleared for user {user_id}."})
 
+@app.route("/db/status", methods=["GET"])
+def db_status():
+    """
+    Trạng thái định tuyến primary / replica của worker hiện tại
+    """
+    return jsonify(db_router.stats())
+
+@app.route("/intent/stats", methods=["GET"])
+def intent_stats():
+    """
+    Tỉ lệ câu hỏi được trả lời bằng template cục bộ (không gọi Gemini) của worker hiện tại
+    """
+    if intent_matcher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **intent_matcher.stats()})
+
+def admin_required(require_profiler=True):
+    """
+    None nếu request có X-Admin-Token hợp lệ (admin_token trong [profiling]), ngược lại response lỗi.
+    Chưa đặt admin_token, hoặc profiling tắt với các endpoint profile, thì endpoint coi như không tồn tại.
+    """
+    if require_profiler and request_profiler is None:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    admin_token = PROFILING_CONFIG["admin_token"]
+    if not admin_token:
+        return jsonify({"error": "Admin endpoints are disabled"}), 404
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), admin_token.encode("utf-8")):
+        return jsonify({"error": "Forbidden"}), 403
+    return None
+
+@app.route("/admin/profile", methods=["GET", "POST", "DELETE"])
+def admin_profile():
+    """
+    GET: trạng thái + danh sách báo cáo. DELETE: tắt.
+    POST: bật profile cho các request tiếp theo.
+    Body: {"requests": 1 (null = không giới hạn đến khi hết TTL), "sample_rate": 1.0,
+           "paths": [...], "memory": false (tracemalloc), "ttl_seconds": 600}
+    """
+    denied = admin_required()
+    if denied:
+        return denied
+
+    if request.method == "DELETE":
+        request_profiler.disarm()
+        return jsonify(request_profiler.status())
+    if request.method == "GET":
+        return jsonify({**request_profiler.status(), "reports": request_profiler.list_reports()})
+
+    data = request.get_json(silent=True) or {}
+    try:
+        requests_count = data.get("requests", 1)
+        requests_count = None if requests_count is None else int(requests_count)
+        sample_rate = float(data.get("sample_rate", 1.0))
+        ttl_seconds = float(data.get("ttl_seconds", DEFAULT_ARM_TTL_SECONDS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "requests, sample_rate và ttl_seconds phải là số"}), 400
+    paths = data.get("paths") or list(PROFILED_PATHS)
+    if (requests_count is not None and requests_count < 1) or not 0 < sample_rate <= 1 or ttl_seconds <= 0:
+        return jsonify({"error": "requests phải >= 1, sample_rate trong (0, 1], ttl_seconds > 0"}), 400
+    unknown = [path for path in paths if path not in PROFILED_PATHS]
+    if unknown:
+        return jsonify({"error": f"Không profile được: {', '.join(unknown)}", "allowed_paths": list(PROFILED_PATHS)}), 400
+
+    state = request_profiler.arm(requests_count, sample_rate, paths, bool(data.get("memory")), ttl_seconds)
+    return jsonify({"armed": True, "state": state})
+
+@app.route("/admin/profile/reports/<capture_id>/<kind>", methods=["GET"])
+def admin_profile_report(capture_id, kind):
+    """
+    Tải báo cáo: kind = folded (flame graph) | alloc (tracemalloc) | meta
+    """
+    denied = admin_required()
+    if denied:
+        return denied
+    path = request_profiler.report_path(capture_id, kind)
+    if path is None:
+        return jsonify({"error": "Report not found"}), 404
+    return send_file(os.path.abspath(path), mimetype="application/json" if kind == "meta" else "text/plain",
+                     as_attachment=kind != "meta", download_name=os.path.basename(path))
+
+@app.route("/query-log/report", methods=["GET"])
+def query_log_report():
+    """
+    Câu hỏi nóng nhất, bước chậm nhất và phần traffic cache được (theo schema hiện tại)
+    Query: ?limit=20&window=10000 (cần header X-Admin-Token)
+    """
+    denied = admin_required(require_profiler=False)
+    if denied:
+        return denied
+    try:
+        limit = int(request.args.get("limit", 20))
+        window = int(request.args.get("window", DEFAULT_REPORT_WINDOW))
+    except ValueError:
+        return jsonify({"error": "limit và window phải là số nguyên"}), 400
+    # Báo cáo đọc cả cửa sổ vào bộ nhớ: giới hạn để một request không quét toàn bộ log
+    limit = min(max(limit, 1), MAX_REPORT_LIMIT)
+    window = min(max(window, 1), MAX_REPORT_WINDOW)
+    if query_log is None:
+        return jsonify({"enabled": False, "sql_cache": sql_cache.stats()})
+    return jsonify({"enabled": True, **query_log.report(SCHEMA_VERSION, limit, window), "sql_cache": sql_cache.stats()})
+
 @app.route("/token/info", methods=["GET"])
 def get_token_info():
     """
@@ -495,11 +698,18 @@ def analyze_timesheet_daily():
         data = request.get_json()
         system_tasks_text = data.get("system_tasks", "")
         daily_report = data.get("daily_report", "")
+        # "lexical" (mặc định): so khớp từ khóa, "embedding": so khớp ngữ nghĩa bằng SentenceTransformer
+        mode = data.get("mode", "lexical")
         
         if not system_tasks_text or not daily_report:
             return jsonify({
                 "error": "Thiếu thông tin system_tasks hoặc daily_report"
             }), 400
+
+        if mode not in ("lexical", "embedding"):
+            return jsonify({
+                "error": f"mode không hợp lệ: {mode}. Chỉ hỗ trợ 'lexical' hoặc 'embedding'"
+            }), 400
         
         # Parse system tasks
         system_tasks = parse_tasks_from_system(system_tasks_text)
@@ -510,11 +720,20 @@ def analyze_timesheet_daily():
         logging.info(f"Parsed {len(daily_efforts)} daily efforts")
         
         # Match tasks
-        results, undefined_tasks = match_tasks_with_system_tasks(daily_efforts, system_tasks)
+        if mode == "embedding":
+            min_score = float(data.get("min_score", MIN_EMBEDDING_SCORE))
+            results, undefined_tasks = match_tasks_with_embeddings(
+                daily_efforts, system_tasks, task_embedding_cache, min_score
+            )
+        else:
+            # Dựng inverted index một lần cho danh sách task hệ thống
+            task_index = TaskIndex(system_tasks)
+            results, undefined_tasks = match_tasks_with_system_tasks(daily_efforts, system_tasks, task_index)
         
         return jsonify({
             "results": results,
             "undefined": undefined_tasks,
+            "mode": mode,
             "summary": {
                 "total_system_tasks": len(system_tasks),
                 "total_daily_efforts": len(daily_efforts),
@@ -527,6 +746,80 @@ def analyze_timesheet_daily():
         logging.error(f"Error in /timesheet-daily endpoint: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/timesheet-daily/bulk", methods=["POST"])
+def analyze_timesheet_daily_bulk():
+    """
+    API xử lý hàng loạt báo cáo hằng ngày với cùng một danh sách task hệ thống.
+
+    Nhận một trong hai dạng:
+    - JSON: {"system_tasks": "...", "reports": [{"id": ..., "daily_report": "..."}, ...], "workers": N}
+    - NDJSON (Content-Type: application/x-ndjson): dòng đầu {"system_tasks": "...", "workers": N},
+      mỗi dòng tiếp theo là một báo cáo {"id": ..., "daily_report": "..."}
+
+    Kết quả trả về dạng NDJSON: mỗi dòng là kết quả của một báo cáo, dòng cuối là {"summary": {...}}.
+    """
+    is_ndjson = request.mimetype in ("application/x-ndjson", "application/jsonl")
+
+    if is_ndjson:
+        lines = (line for line in iter(request.stream.readline, b"") if line.strip())
+        try:
+            header = json.loads(next(lines))
+        except (StopIteration, ValueError):
+            return jsonify({"error": "Dòng đầu tiên phải là JSON chứa system_tasks"}), 400
+
+        def iter_reports():
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield {"error": "Dòng NDJSON không hợp lệ"}
+
+        reports = iter_reports()
+    else:
+        header = request.get_json(silent=True) or {}
+        reports = header.get("reports") or []
+
+    system_tasks_text = header.get("system_tasks", "")
+    if not system_tasks_text:
+        return jsonify({"error": "Thiếu thông tin system_tasks"}), 400
+
+    # Parse và index danh sách task hệ thống đúng một lần cho cả lô
+    system_tasks = parse_tasks_from_system(system_tasks_text)
+    task_index = TaskIndex(system_tasks)
+    workers = header.get("workers")
+    if workers is not None:
+        try:
+            workers = int(workers)
+        except (TypeError, ValueError):
+            return jsonify({"error": "workers phải là số nguyên"}), 400
+        # Không fork nhiều process hơn số CPU
+        workers = min(max(workers, 1), os.cpu_count() or 1)
+    logging.info(f"Bulk timesheet: parsed {len(system_tasks)} system tasks")
+
+    def generate():
+        summary = {
+            "total_system_tasks": len(system_tasks),
+            "total_reports": 0,
+            "failed_reports": 0,
+            "matched_results": 0,
+            "undefined_tasks": 0
+        }
+        try:
+            for item in iter_bulk_results(task_index, reports, workers=workers):
+                summary["total_reports"] += 1
+                if "error" in item:
+                    summary["failed_reports"] += 1
+                else:
+                    summary["matched_results"] += len(item["results"])
+                    summary["undefined_tasks"] += len(item["undefined"])
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logging.error(f"Error in /timesheet-daily/bulk endpoint: {str(e)}")
+            summary["error"] = str(e)
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 @app.route("/timesheet-daily-ai", methods=["POST"])
 def analyze_timesheet_daily_ai():
     """
@@ -536,11 +829,28 @@ def analyze_timesheet_daily_ai():
         data = request.get_json()
         system_tasks_text = data.get("system_tasks", "")
         daily_report = data.get("daily_report", "")
+        # "full" (mặc định): gửi toàn bộ cho Gemini, "hybrid": match cục bộ trước, chỉ hỏi Gemini phần còn lại
+        mode = data.get("mode", "full")
         
         if not system_tasks_text or not daily_report:
             return jsonify({
                 "error": "Thiếu thông tin system_tasks hoặc daily_report"
             }), 400
+
+        if mode == "hybrid":
+            try:
+                top_k = int(data.get("top_k", HYBRID_TOP_K))
+                confident_score = float(data.get("confident_score", CONFIDENT_MATCH_SCORE))
+            except (TypeError, ValueError):
+                top_k, confident_score = 0, -1.0
+            if top_k < 1 or not 0 <= confident_score <= 1:
+                return jsonify({"error": "top_k phải là số nguyên >= 1 và confident_score trong khoảng [0, 1]"}), 400
+
+            hybrid_result = analyze_timesheet_hybrid(system_tasks_text, daily_report, top_k, confident_score)
+            if hybrid_result is not None:
+                return hybrid_result
+            # Parser cục bộ không hiểu định dạng báo cáo → dùng toàn bộ prompt như cũ
+            logging.info("Hybrid timesheet: local parser found no efforts, falling back to full prompt")
         
         # Prompt do user thiết kế
         prompt = f"""
@@ -616,22 +926,24 @@ Only return a valid JSON object as specified. Do not include any extra explanati
 """
 
         
+        # 🔍 Validate prompt trước khi gọi API
+        is_valid, error_msg = token_manager.validate_prompt(prompt)
+        if not is_valid:
+            logging.error(f"Timesheet prompt validation failed: {error_msg}")
+            return jsonify({
+                "error": "Danh sách task hoặc báo cáo quá lớn. Vui lòng thử mode 'hybrid' hoặc rút gọn dữ liệu.",
+                "error_type": "token_limit_exceeded",
+                "details": error_msg
+            }), 400
+
         # Gọi Gemini để sinh kết quả
         try:
-            from gemini_ai import configure_gemini, generate_natural_language_response
-            import google.generativeai as genai
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            response = model.generate_content(prompt)
-            raw = response.text.strip()
-            # Tìm đoạn JSON trong kết quả trả về
-            import re, json
-            json_match = re.search(r'\{.*\}|\[.*\]', raw, re.DOTALL)
-            if json_match:
-                try:
-                    result_json = json.loads(json_match.group(0))
-                    return jsonify(result_json)
-                except Exception:
-                    pass
+            result_json, raw = generate_json_content(prompt)
+            if mode == "hybrid":
+                # Cùng một dạng response với nhánh hybrid, kể cả khi phải dùng prompt đầy đủ
+                return hybrid_response_from_full(result_json, raw, system_tasks_text, daily_report)
+            if result_json is not None:
+                return jsonify(result_json)
             # Nếu không parse được JSON, trả về raw text
             return jsonify({"raw": raw})
         except Exception as e:
@@ -639,6 +951,108 @@ Only return a valid JSON object as specified. Do not include any extra explanati
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _effort_value(effort):
+    try:
+        return float(effort)
+    except (TypeError, ValueError):
+        return None
+
+def hybrid_response_from_full(result_json, raw, system_tasks_text, daily_report):
+    """
+    Chuyển kết quả của prompt đầy đủ ("results" là một chuỗi nhiều dòng, "undifine" với ProjectName / TaskName)
+    sang dạng response của mode hybrid
+    """
+    result_json = result_json if isinstance(result_json, dict) else {}
+    results = []
+    for entry in result_json.get("results") or []:
+        results.extend(line.strip() for line in str(entry).splitlines() if line.strip())
+    undefined_tasks = [
+        {
+            "project_name": item.get("ProjectName", ""),
+            "task_name": item.get("TaskName", ""),
+            "effort": _effort_value(item.get("effort"))
+        }
+        for item in result_json.get("undifine") or [] if isinstance(item, dict)
+    ]
+    response = {
+        "results": results,
+        "undefined": undefined_tasks,
+        "date": result_json.get("date") or extract_report_date(daily_report),
+        "mode": "hybrid",
+        "summary": {
+            "total_system_tasks": len(parse_tasks_from_system(system_tasks_text)),
+            "total_lines": len(results) + len(undefined_tasks),
+            "resolved_locally": 0,
+            "sent_to_ai": len(results) + len(undefined_tasks),
+            "resolved_by_ai": len(results),
+            "undefined_tasks": len(undefined_tasks),
+            "prompt_tokens": None,
+            # Parser cục bộ không đọc được báo cáo, đã gửi toàn bộ báo cáo cho Gemini
+            "fallback": "full_prompt"
+        }
+    }
+    if not result_json:
+        response["raw"] = raw
+    return jsonify(response)
+
+def analyze_timesheet_hybrid(system_tasks_text, daily_report, top_k=HYBRID_TOP_K, confident_score=CONFIDENT_MATCH_SCORE):
+    """
+    Phân tích timesheet theo kiểu cascade:
+    1. Parse và match cục bộ
+    2. Trả ngay các match đủ tin cậy
+    3. Chỉ gửi Gemini các dòng chưa giải quyết kèm top-k task ứng viên
+
+    Trả về None nếu parser cục bộ không đọc được báo cáo.
+    """
+    system_tasks = parse_tasks_from_system(system_tasks_text)
+    daily_efforts = parse_daily_report(daily_report)
+    if not daily_efforts:
+        return None
+
+    task_index = TaskIndex(system_tasks)
+    resolved, unresolved = split_confident_matches(daily_efforts, task_index, confident_score, top_k)
+
+    # Dòng không có ứng viên nào thì hỏi AI cũng vô ích
+    ai_items = [item for item in unresolved if item["candidates"]]
+    try:
+        ai_matches, prompt_tokens = match_timesheet_lines(ai_items, top_k)
+    except ValueError as ve:
+        logging.error(f"Token limit error: {str(ve)}")
+        return jsonify({
+            "error": "Báo cáo có quá nhiều dòng chưa xác định. Vui lòng tách nhỏ báo cáo.",
+            "error_type": "token_limit_exceeded",
+            "details": str(ve)
+        }), 400
+
+    results = [f"{item['task']['id']} - {item['effort']}" for item in resolved]
+    undefined_tasks = []
+    for item in unresolved:
+        task = ai_matches.get(item["line"])
+        if task:
+            results.append(f"{task['id']} - {item['effort']}")
+        else:
+            undefined_tasks.append({
+                "project_name": item["project_name"],
+                "task_name": item["task_name"],
+                "effort": item["effort"]
+            })
+
+    return jsonify({
+        "results": results,
+        "undefined": undefined_tasks,
+        "date": extract_report_date(daily_report),
+        "mode": "hybrid",
+        "summary": {
+            "total_system_tasks": len(system_tasks),
+            "total_lines": len(resolved) + len(unresolved),
+            "resolved_locally": len(resolved),
+            "sent_to_ai": len(ai_items),
+            "resolved_by_ai": len(ai_matches),
+            "undefined_tasks": len(undefined_tasks),
+            "prompt_tokens": prompt_tokens,
+            "fallback": None
+        }
+    })
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
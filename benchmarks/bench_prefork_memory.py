@@ -0,0 +1,190 @@
+"""
+So sánh bộ nhớ mỗi worker và throughput của gunicorn:
+- preload (mặc định): model load một lần ở master rồi fork, các worker chia sẻ trang nhớ (copy-on-write)
+- không preload: mỗi worker tự import app và load một bản model riêng
+
+Đo bằng /proc/<pid>/smaps_rollup (Linux):
+- RSS: tính cả trang dùng chung nên gần như giống nhau ở hai chế độ
+- PSS: trang dùng chung được chia đều cho các process dùng nó
+- USS (Private): phần riêng của worker, đây là phần tăng thêm khi thêm một worker
+
+Throughput đo bằng POST /timesheet-daily (mode=embedding), endpoint chạy SentenceTransformer
+và không gọi Gemini / MySQL.
+
+Cách dùng (từ thư mục gốc, cần config.ini và table_sys.txt):
+    python benchmarks/bench_prefork_memory.py --workers 4 --duration 20
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from timesheet_utils import parse_tasks_from_system, parse_daily_report  # noqa: E402
+
+SAMPLE_PAYLOAD = {
+    "mode": "embedding",
+    # Định dạng thật của danh sách task: "221 - HousingStaff - Mockup register"
+    "system_tasks": "\n".join(
+        f"{200 + i} - {project} - {name} {i}" for i, (project, name) in enumerate(
+            [("HousingStaff", "Mockup register"), ("HousingStaff", "Review code"), ("HousingStaff", "Signup API"),
+             ("PMS", "Fix bug login"), ("Meeting", "Daily meeting"), ("PMS", "Deploy staging")] * 20
+        )
+    ),
+    "daily_report": (
+        "■■ Today(Actual - Thực tế) ■■\n"
+        "■ HousingStaff - 6h\n+ Mockup register\n+ Review code\n"
+        "■ Meeting - 2h\n+ Daily meeting\n"
+        "■■ Dự định ngày tiếp theo ■■\n+ Signup API\n"
+    )
+}
+
+
+def check_payload():
+    """
+    Payload phải parse ra task và effort, nếu không endpoint trả về trước khi encode
+    và phép đo không hề dùng tới model
+    """
+    system_tasks = parse_tasks_from_system(SAMPLE_PAYLOAD["system_tasks"])
+    daily_efforts = parse_daily_report(SAMPLE_PAYLOAD["daily_report"])
+    if not system_tasks or not daily_efforts:
+        raise RuntimeError(
+            f"SAMPLE_PAYLOAD không hợp lệ: {len(system_tasks)} system tasks, {len(daily_efforts)} daily efforts"
+        )
+
+
+def read_memory_kb(pid):
+    """
+    RSS / PSS / USS (kB) của một process từ smaps_rollup
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1])
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    }
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+        return response.status
+
+
+def wait_until_ready(url, workers, master, timeout=300):
+    body = json.dumps(SAMPLE_PAYLOAD).encode("utf-8")
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if master.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            post(url, body)
+            if len(child_pids(master.pid)) >= workers:
+                return
+        except OSError:
+            pass
+        time.sleep(1)
+    raise TimeoutError("gunicorn did not become ready")
+
+
+def measure_throughput(url, duration, concurrency):
+    body = json.dumps(SAMPLE_PAYLOAD).encode("utf-8")
+    counts = {"ok": 0, "error": 0}
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client():
+        while time.time() < stop_at:
+            try:
+                key = "ok" if post(url, body) == 200 else "error"
+            except OSError:
+                key = "error"
+            with lock:
+                counts[key] += 1
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    counts["rps"] = counts["ok"] / duration
+    return counts
+
+
+def run(preload, args):
+    env = dict(
+        os.environ,
+        PMS_PRELOAD="1" if preload else "0",
+        PMS_WORKERS=str(args.workers),
+        PMS_THREADS=str(args.threads),
+        PMS_BIND=f"127.0.0.1:{args.port}",
+        # Không recycle worker trong lúc đo
+        PMS_MAX_REQUESTS="0"
+    )
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{args.port}/timesheet-daily"
+    try:
+        wait_until_ready(url, args.workers, master)
+        throughput = measure_throughput(url, args.duration, args.concurrency)
+        # Đo sau tải để tính cả các trang bị copy-on-write trong lúc chạy
+        workers = [read_memory_kb(pid) for pid in child_pids(master.pid)]
+        master_memory = read_memory_kb(master.pid)
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=60)
+
+    def avg(key):
+        return sum(worker[key] for worker in workers) / len(workers) / 1024
+
+    return {
+        "mode": "preload" if preload else "no preload",
+        "rss": avg("rss"),
+        "pss": avg("pss"),
+        "uss": avg("uss"),
+        "total_pss": (sum(worker["pss"] for worker in workers) + master_memory["pss"]) / 1024,
+        **throughput
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=int, default=20)
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    check_payload()
+    print(f"workers={args.workers} threads={args.threads} concurrency={args.concurrency} duration={args.duration}s")
+    print(f"{'mode':<12} {'RSS/worker':>11} {'PSS/worker':>11} {'USS/worker':>11} {'total PSS':>10} {'req/s':>8} {'errors':>7}")
+    for preload in (True, False):
+        row = run(preload, args)
+        print(
+            f"{row['mode']:<12} {row['rss']:>9.0f}MB {row['pss']:>9.0f}MB {row['uss']:>9.0f}MB "
+            f"{row['total_pss']:>8.0f}MB {row['rps']:>8.1f} {row['error']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
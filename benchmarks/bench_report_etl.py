@@ -0,0 +1,189 @@
+"""
+So sánh tốc độ ETL báo cáo hằng ngày:
+- notebook cleanData (cũ): Series.apply từng dòng với extract_name / get_actual / extract_plan / extract_next_plan
+- parse_report từng dòng: report_parser.parse_report / extract_member bằng Series.apply (kết quả tham chiếu)
+- report_etl.transform_chunk: extract_member + parse_section_texts (1 process)
+- report_etl.iter_transformed: chia chunk và xử lý song song trên nhiều core
+
+Tốc độ được so với notebook; kết quả của ETL được so khớp với parse_report (phải trùng 100% vì cùng parser).
+Độ trùng với notebook chỉ để tham khảo: regex của notebook cắt sai một số dạng báo cáo.
+
+Cách dùng (từ thư mục gốc):
+    python benchmarks/bench_report_etl.py --rows 20000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from report_etl import transform_chunk, iter_transformed, DATE_COLUMN, CONTENT_COLUMN, SECTION_COLUMNS  # noqa: E402
+from report_parser import parse_report, extract_member  # noqa: E402
+
+
+# ---- Bản sao các hàm row-wise của notebook cleanData (baseline) ----
+
+def nb_extract_name(content):
+    content = str(content).strip()
+    match1 = re.search(r"^■\s*([A-ZÀ-Ỹà-ỹ\s]+?)\s*[-–]", content)
+    if match1:
+        return re.sub(r'\d+', '', match1.group(1).strip()).strip()
+    first_line = content.split('\n')[0].strip()
+    if not first_line.startswith('■') and not first_line.startswith('####'):
+        if re.match(r'^[A-ZÀ-Ỹa-zà-ỹ\s]+$', first_line) and len(first_line.split()) >= 2:
+            return first_line.strip()
+    match3 = re.search(r"####\s*\d{4}/\d{2}/\d{2}\s+([A-ZÀ-Ỹà-ỹ\s]+?)(?:\s+\d|$)", content)
+    if match3:
+        return match3.group(1).strip()
+    match4 = re.search(r"^■\s*(?:\d{2}/\d{2}\s+)?([A-ZÀ-Ỹà-ỹ\s]+?)(?:\n|$)", content)
+    if match4:
+        return re.sub(r'\d{2}/\d{2}', '', match4.group(1).strip()).strip()
+    return ""
+
+
+def nb_get_actual(content):
+    if pd.isnull(content):
+        return ''
+    pat = (r'(■{2,}[\s　 ]*Actual[\s　 ]*■{2,}|■■ Today\(Actual - Thực tế\) ■■|Today\(Actual - Thực tế\) ■■)'
+           r'(.*?)(■{2,}[\s　 ]*(?:Next plan|Dự định ngày tiếp theo|Dự định|ISSUE)[\s　 ]*■{0,}|$)')
+    match = re.search(pat, content, flags=re.DOTALL | re.IGNORECASE | re.UNICODE)
+    if match:
+        return re.sub(r'[\r\n]+', '\n', match.group(2)).strip(' \n\r\t:-　 ').strip()
+    pattern = (r'(?:Yesterday|Hôm qua)[^\n]*\n(.*?)(?:\n[-=]{3,}|\n\s*(?:Daily plan|Plan for|Next plan|Today|Tomorrow|'
+               r'Dự định|Kế hoạch)[^\n]*\n|$)')
+    match = re.search(pattern, content, re.DOTALL | re.IGNORECASE)
+    if match:
+        return re.sub(r'[-=]{3,}\s*$', '', match.group(1).strip()).strip()
+    return ""
+
+
+def nb_extract_plan(text):
+    if pd.isna(text):
+        return None
+    plan_patterns = [
+        r'■■■\s*Plan\s*■■■(.*?)(?=■■■|$)',
+        r'■■\s*Plan\s*■■(.*?)(?=■■|$)',
+        r'■■　Today（Plan[^）]*）■■(.*?)(?=■■|$)',
+        r'Today（Plan[^）]*）■■(.*?)(?=■■|$)',
+        r'Plan\s*-\s*Dự\s*định[^■]*■■(.*?)(?=■■|$)',
+        r'■本日の業務\n(.*?)(?=■■|$)',
+    ]
+    for pattern in plan_patterns:
+        match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
+        if match and match.group(1).strip():
+            return match.group(1).strip()
+    return None
+
+
+def nb_extract_next_plan(text):
+    if pd.isna(text):
+        return None
+    patterns = [
+        r'■■■　Next plan.*?■■■(.*?)(?=■■■|$)',
+        r'Next plan.*?■■■(.*?)(?=■■■|$)',
+        r'- Dự định.*?■■■(.*?)(?=■■■|$)',
+        r'■■　Dự định.*?■■(.*?)(?=■■|$)'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
+        if match and match.group(1).strip():
+            return match.group(1).strip()
+    return None
+
+
+def notebook_transform(df):
+    out = pd.DataFrame({"Date Report": pd.to_datetime(df[DATE_COLUMN], errors="coerce")})
+    out["Member"] = df[CONTENT_COLUMN].apply(nb_extract_name)
+    out["Content"] = df[CONTENT_COLUMN]
+    out["Actual"] = df[CONTENT_COLUMN].apply(nb_get_actual)
+    out["Plan"] = df[CONTENT_COLUMN].apply(nb_extract_plan)
+    out["Next Plan"] = df[CONTENT_COLUMN].apply(nb_extract_next_plan)
+    return out
+
+
+# ---- Tham chiếu: parser của API chạy từng dòng (report_parser) ----
+
+def row_wise_transform(df):
+    """
+    Kết quả tham chiếu: parse_report / extract_member gọi trên từng báo cáo bằng Series.apply
+    """
+    contents = df[CONTENT_COLUMN].where(df[CONTENT_COLUMN].notna(), "").astype(str)
+    parsed = contents.apply(parse_report)
+    out = pd.DataFrame({"Date Report": pd.to_datetime(df[DATE_COLUMN], errors="coerce")})
+    out["Member"] = contents.apply(extract_member)
+    out["Content"] = df[CONTENT_COLUMN]
+    for column, section in SECTION_COLUMNS.items():
+        out[column] = parsed.apply(lambda report: report[section]["text"])
+    return out
+
+
+# ---- Dữ liệu giả lập ----
+
+NAMES = ["TRAN VAN DANG", "PHAM LONG DINH", "LÊ NGUYÊN TRANG", "NGUYEN THI HOA"]
+TEMPLATES = [
+    "■ {name} - {date}\n■■ Today（Plan - Dự định）■■\n■ HousingStaff\n+ Mockup register\n"
+    "■■ Today(Actual - Thực tế) ■■\n■ HousingStaff - 6h\n+ Mockup register\n+ Review code\n■ Meeting - 2h\n+ Daily meeting\n"
+    "■■ Dự định ngày tiếp theo ■■\n+ Signup API\n",
+    "#### {date} {name}  8:00 - 17:20\n■■■ Plan ■■■\n+ Fix bug\n■■■　Actual ■■■\n■ PMS - 8h\n+ Fix bug login\n"
+    "■■■　Next plan ■■■\n+ Deploy\n",
+    "{name_title}\nYesterday:\n+ Estimate price\n-----\nToday\n+ Schedule transfer\n",
+]
+
+
+def make_dataset(rows, seed=0):
+    rng = random.Random(seed)
+    records = []
+    for i in range(rows):
+        date = pd.Timestamp("2023-01-01") + pd.Timedelta(days=i // 20)
+        name = rng.choice(NAMES)
+        content = rng.choice(TEMPLATES).format(
+            name=name, name_title=name.title(), date=date.strftime("%Y/%m/%d")
+        ) + "filler line\n" * rng.randint(0, 20)
+        records.append({DATE_COLUMN: date.strftime("%Y-%m-%d"), CONTENT_COLUMN: content})
+    return pd.DataFrame(records)
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.3f}s")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    df = make_dataset(args.rows)
+    print(f"rows={args.rows} chunk_size={args.chunk_size} workers={args.workers}")
+
+    notebook, t_nb = timed("notebook cleanData (Series.apply)", lambda: notebook_transform(df))
+    reference, t_ref = timed("parse_report row-wise (Series.apply)", lambda: row_wise_transform(df))
+    etl, t_etl = timed("transform_chunk (1 process)", lambda: transform_chunk(df))
+    chunks = [df.iloc[i:i + args.chunk_size] for i in range(0, len(df), args.chunk_size)]
+    _, t_par = timed(
+        f"transform_chunk + {args.workers} workers",
+        lambda: pd.concat(list(iter_transformed(iter(chunks), workers=args.workers)))
+    )
+
+    # < 1.00x nghĩa là chậm hơn notebook
+    print(f"speedup vs notebook: 1 process {t_nb / t_etl:.2f}x, parallel {t_nb / t_par:.2f}x")
+    print(f"speedup vs parse_report row-wise: 1 process {t_ref / t_etl:.2f}x, parallel {t_ref / t_par:.2f}x")
+
+    for column in ["Member", "Actual", "Plan", "Next Plan"]:
+        right = etl[column].fillna("")
+        print(f"agreement {column:<10} parse_report {(reference[column].fillna('') == right).mean():.1%}, "
+              f"notebook {(notebook[column].fillna('') == right).mean():.1%}")
+
+
+if __name__ == "__main__":
+    main()
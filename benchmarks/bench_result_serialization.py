@@ -0,0 +1,85 @@
+"""
+So sánh chi phí chuyển kết quả truy vấn thành JSON:
+- cũ: cursor(dictionary=True) → một dict mỗi dòng → jsonify (json chuẩn, default=str)
+- mới: tuple + chuyển kiểu theo cột (result_utils.fetch_result) → dumps (orjson nếu có)
+
+Dữ liệu giả lập giống kết quả MySQL (int, str, Decimal, date, datetime), không cần DB.
+
+Cách dùng (từ thư mục gốc):
+    python benchmarks/bench_result_serialization.py --rows 20000 --repeat 5
+"""
+import argparse
+import datetime
+import decimal
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import result_utils  # noqa: E402
+
+COLUMNS = ["id", "name", "status", "hours", "start_date", "updated_at"]
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.column_names = COLUMNS
+        self._rows = rows
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchmany(self, size):
+        return self._rows[:size]
+
+
+def make_rows(count):
+    base = datetime.datetime(2024, 1, 1, 8, 30)
+    return [
+        (i, f"Task {i}", "done" if i % 3 else "doing", decimal.Decimal(f"{i % 40}.25"),
+         (base + datetime.timedelta(days=i % 365)).date(), base + datetime.timedelta(minutes=i))
+        for i in range(count)
+    ]
+
+
+def old_path(rows):
+    records = [dict(zip(COLUMNS, row)) for row in rows]
+    return json.dumps({"results": records}, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def new_path(rows, result_format):
+    columns, converted = result_utils.fetch_result(FakeCursor(rows))
+    if result_format == "compact":
+        return result_utils.dumps({"columns": columns, "rows": converted})
+    return result_utils.dumps({"results": result_utils.to_records(columns, converted)})
+
+
+def measure(fn, repeat):
+    best, size = None, 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(fn())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    print(f"rows={args.rows} orjson={'yes' if result_utils.orjson else 'no'}")
+    for name, fn in (("dict + json", lambda: old_path(rows)),
+                     ("records (new)", lambda: new_path(rows, "records")),
+                     ("compact (new)", lambda: new_path(rows, "compact"))):
+        ms, size = measure(fn, args.repeat)
+        print(f"{name:15s} {ms:8.1f} ms  {size / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
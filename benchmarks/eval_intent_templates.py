@@ -0,0 +1,103 @@
+"""
+Đánh giá offline lớp intent template trên một tập câu hỏi (JSONL).
+
+Mỗi dòng: {"question": "...", "intent": "tên template" hoặc null (phải fallback về Gemini),
+           "slots": {"project": "...", "person": "..."} (tuỳ chọn)}
+
+Báo cáo:
+- hit rate: tỉ lệ câu hỏi được trả lời bằng template (không gọi Gemini)
+- precision: trong các câu khớp template, tỉ lệ khớp đúng template (và đúng slot nếu có nhãn)
+- recall: trong các câu có nhãn template, tỉ lệ được khớp đúng
+- độ trễ match (p50 / p95)
+
+Cách dùng (từ thư mục gốc):
+    python benchmarks/eval_intent_templates.py benchmarks/intent_corpus.example.jsonl
+    python benchmarks/eval_intent_templates.py corpus.jsonl --embeddings --schema table_sys.txt
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from intent_templates import load_intent_matcher, DEFAULT_MIN_SCORE, DEFAULT_KEYWORD_MIN_SCORE  # noqa: E402
+from schema_utils import load_schema, extract_table_names  # noqa: E402
+
+
+def slots_match(expected, actual):
+    return all(str(actual.get(name, "")).lower() == str(value).lower() for name, value in expected.items())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus")
+    parser.add_argument("--templates", default="intent_templates.json")
+    parser.add_argument("--schema", default=None, help="Kiểm tra bảng trong template theo schema (vd. table_sys.txt)")
+    parser.add_argument("--embeddings", action="store_true", help="Dùng SentenceTransformer như khi chạy server")
+    parser.add_argument("--min-score", type=float, default=DEFAULT_MIN_SCORE)
+    parser.add_argument("--keyword-min-score", type=float, default=DEFAULT_KEYWORD_MIN_SCORE)
+    parser.add_argument("--show-errors", action="store_true")
+    args = parser.parse_args()
+
+    embedding_model = None
+    if args.embeddings:
+        from sentence_transformers import SentenceTransformer
+        embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+    allowed_tables = None
+    if args.schema:
+        allowed_tables = set(t.lower() for t in extract_table_names(load_schema(args.schema)))
+
+    matcher = load_intent_matcher(args.templates, embedding_model, args.min_score, args.keyword_min_score, allowed_tables)
+    if matcher is None:
+        sys.exit(f"Không tìm thấy file template: {args.templates}")
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    latencies = []
+    outcomes = Counter()
+    per_template = Counter()
+    errors = []
+    for item in corpus:
+        start = time.perf_counter()
+        result = matcher.match(item["question"])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        expected = item.get("intent")
+        predicted = result["name"] if result else None
+        correct = predicted == expected and (not result or slots_match(item.get("slots", {}), result["slots"]))
+        if predicted:
+            outcomes["hit"] += 1
+            outcomes["hit_correct" if correct else "hit_wrong"] += 1
+        if expected:
+            outcomes["labelled"] += 1
+            per_template[(expected, "total")] += 1
+            if correct:
+                outcomes["recalled"] += 1
+                per_template[(expected, "correct")] += 1
+        if not correct:
+            errors.append((item["question"], expected, predicted, result["slots"] if result else None))
+
+    latencies.sort()
+    total = len(corpus)
+    print(f"questions: {total}, templates: {len(matcher.templates)}, embeddings: {embedding_model is not None}")
+    print(f"hit rate:  {outcomes['hit'] / total:.1%} ({outcomes['hit']}/{total}) câu không cần gọi Gemini")
+    if outcomes["hit"]:
+        print(f"precision: {outcomes['hit_correct'] / outcomes['hit']:.1%} ({outcomes['hit_wrong']} khớp sai)")
+    if outcomes["labelled"]:
+        print(f"recall:    {outcomes['recalled'] / outcomes['labelled']:.1%} ({outcomes['recalled']}/{outcomes['labelled']})")
+    print(f"latency:   p50 {latencies[len(latencies) // 2]:.2f}ms, p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f}ms")
+
+    for name in sorted({name for name, _ in per_template}):
+        print(f"  {name:<28} {per_template[(name, 'correct')]}/{per_template[(name, 'total')]}")
+
+    if args.show_errors:
+        for question, expected, predicted, slots in errors:
+            print(f"  ✗ {question!r}: expected {expected}, got {predicted} {slots or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,23 @@
 import configparser
 
+def load_replica_configs(config):
+    """
+    Các section [db_replica_*]: host bắt buộc, user / password / database mặc định lấy theo [db]
+    """
+    replicas = []
+    for section in sorted(s for s in config.sections() if s.startswith("db_replica")):
+        replica = {
+            "name": section,
+            "host": config[section]["host"],
+            "user": config.get(section, "user", fallback=config["db"]["user"]),
+            "password": config.get(section, "password", fallback=config["db"]["password"]),
+            "database": config.get(section, "database", fallback=config["db"]["database"])
+        }
+        if config.has_option(section, "port"):
+            replica["port"] = config.getint(section, "port")
+        replicas.append(replica)
+    return replicas
+
 def load_config(file_path="config.ini"):
     config = configparser.ConfigParser()
     config.read(file_path)
@@ -11,7 +29,71 @@ def load_config(file_path="config.ini"):
                 "user": config["db"]["user"],
                 "password": config["db"]["password"],
                 "database": config["db"]["database"]
+            },
+            # Section tuỳ chọn, dùng giá trị mặc định nếu không khai báo
+            "DB_REPLICAS": load_replica_configs(config),
+            "DB_ROUTING": {
+                "pool_size": config.getint("db_routing", "pool_size", fallback=5),
+                "strategy": config.get("db_routing", "strategy", fallback="least_outstanding"),
+                # Bỏ trống = không kiểm tra độ trễ replication
+                "max_replication_lag": config.getint("db_routing", "max_replication_lag", fallback=None),
+                "health_check_interval": config.getint("db_routing", "health_check_interval", fallback=10)
+            },
+            "MEMORY": {
+                "backend": config.get("memory", "backend", fallback="memory"),
+                "path": config.get("memory", "path", fallback="conversation_memory.sqlite"),
+                "max_items": config.getint("memory", "max_items", fallback=5000),
+                "max_items_per_user": config.getint("memory", "max_items_per_user", fallback=20)
+            },
+            "QUERY_HANDLES": {
+                "backend": config.get("query_handles", "backend", fallback="memory"),
+                "path": config.get("query_handles", "path", fallback="query_handles.sqlite"),
+                "ttl_seconds": config.getint("query_handles", "ttl_seconds", fallback=1800),
+                "max_handles": config.getint("query_handles", "max_handles", fallback=10000),
+                "page_size": config.getint("query_handles", "page_size", fallback=20),
+                "max_page_size": config.getint("query_handles", "max_page_size", fallback=200),
+                "max_stream_rows": config.getint("query_handles", "max_stream_rows", fallback=10000)
+            },
+            "INTENTS": {
+                "enabled": config.getboolean("intents", "enabled", fallback=False),
+                "path": config.get("intents", "path", fallback="intent_templates.json"),
+                "min_score": config.getfloat("intents", "min_score", fallback=0.82),
+                "keyword_min_score": config.getfloat("intents", "keyword_min_score", fallback=0.55)
+            },
+            "DEADLINE": {
+                "default_seconds": config.getfloat("deadline", "default_seconds", fallback=30),
+                "max_seconds": config.getfloat("deadline", "max_seconds", fallback=120),
+                # Còn ít hơn số giây này thì bỏ bước sinh câu trả lời, trả rows kèm câu fallback
+                "answer_min_seconds": config.getfloat("deadline", "answer_min_seconds", fallback=3)
+            },
+            "ANSWER_CACHE": {
+                "enabled": config.getboolean("answer_cache", "enabled", fallback=True),
+                "max_entries": config.getint("answer_cache", "max_entries", fallback=2000),
+                "max_bytes": config.getint("answer_cache", "max_bytes", fallback=8 * 1024 * 1024),
+                "ttl_seconds": config.getint("answer_cache", "ttl_seconds", fallback=3600)
+            },
+            "PROFILING": {
+                # Tắt mặc định: không gắn hook nào vào request
+                "enabled": config.getboolean("profiling", "enabled", fallback=False),
+                "admin_token": config.get("profiling", "admin_token", fallback=""),
+                # Thư mục dùng chung giữa các worker (trạng thái bật + báo cáo)
+                "dir": config.get("profiling", "dir", fallback="profiles"),
+                "interval_ms": config.getfloat("profiling", "interval_ms", fallback=5),
+                "check_interval": config.getfloat("profiling", "check_interval", fallback=1.0),
+                "max_reports": config.getint("profiling", "max_reports", fallback=50),
+                "tracemalloc_frames": config.getint("profiling", "tracemalloc_frames", fallback=10),
+                "top_allocations": config.getint("profiling", "top_allocations", fallback=30)
+            },
+            "QUERY_LOG": {
+                "enabled": config.getboolean("query_log", "enabled", fallback=True),
+                "path": config.get("query_log", "path", fallback="query_log.sqlite"),
+                "retention_days": config.getint("query_log", "retention_days", fallback=30),
+                # Số câu hỏi thường gặp nạp vào cache SQL khi khởi động (0 = không làm nóng)
+                "warm_top_n": config.getint("query_log", "warm_top_n", fallback=200),
+                "max_entries": config.getint("query_log", "max_entries", fallback=1000),
+                # Ngưỡng cosine để dùng lại SQL của câu hỏi gần giống (0 = chỉ khớp chính xác)
+                "similarity": config.getfloat("query_log", "similarity", fallback=0)
             }
         }
     except KeyError as e:
-        raise Exception(f"Missing config: {e}")
\ No newline at end of file
+        raise Exception(f"Missing config: {e}")
@@ -1,4 +1,13 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import mysql.connector
+from mysql.connector import errors, pooling
+
+from deadline import DeadlineExceeded
 
 def get_db_connection(config):
     """
@@ -7,3 +16,348 @@ def get_db_connection(config):
     Thiết lập kết nối đến cơ sở dữ liệu MySQL sử dụng cấu hình đã cung cấp.
     """
     return mysql.connector.connect(**config)
+
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_HEALTH_CHECK_INTERVAL = 10
+# Trọng số EWMA cho độ trễ mỗi lần truy vấn
+LATENCY_ALPHA = 0.2
+STRATEGIES = ("least_outstanding", "latency")
+# Lỗi kết nối / server: đánh dấu node không khoẻ và thử node khác.
+# Lỗi SQL (ProgrammingError, ...) thì không, vì node khác cũng sẽ lỗi như vậy.
+CONNECTION_ERRORS = (errors.InterfaceError, errors.OperationalError)
+
+
+class DatabaseRouter:
+    """
+    Định tuyến truy vấn đọc của chatbot sang các read replica, ghi (nếu có) về primary.
+
+    - Mỗi node (primary / replica) có pool kết nối riêng, tạo lazy theo process (an toàn với gunicorn preload)
+    - Chọn replica khoẻ có ít request đang chạy nhất (least_outstanding) hoặc có độ trễ EWMA
+      nhân số request đang chạy thấp nhất (latency)
+    - Health check định kỳ ở thread nền: SELECT 1 + độ trễ replication (SHOW REPLICA STATUS),
+      replica trễ hơn max_replication_lag giây bị loại khỏi vòng định tuyến
+    - Không còn replica khoẻ hoặc replica lỗi kết nối → failover về primary
+    """
+
+    def __init__(self, primary_config, replica_configs=(), pool_size=DEFAULT_POOL_SIZE,
+                 strategy="least_outstanding", max_replication_lag=None,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy} (expected one of {', '.join(STRATEGIES)})")
+        self.pool_size = pool_size
+        self.strategy = strategy
+        self.max_replication_lag = max_replication_lag
+        self.health_check_interval = health_check_interval
+
+        self.primary = self._make_node("primary", "primary", primary_config)
+        self.replicas = [
+            self._make_node(replica_config.get("name", f"replica_{index}"), "replica", replica_config)
+            for index, replica_config in enumerate(replica_configs, start=1)
+        ]
+        self._lock = threading.Lock()
+        self._last_health_check = 0.0
+        self._health_check_running = False
+
+    @staticmethod
+    def _make_node(name, role, config):
+        return {
+            "name": name,
+            "role": role,
+            "config": {key: value for key, value in config.items() if key != "name"},
+            "pool": None,
+            "pid": None,
+            "outstanding": 0,
+            "latency_ms": None,
+            "healthy": True,
+            "lag": None,
+            "last_error": None,
+            "queries": 0,
+            "errors": 0
+        }
+
+    def _pool(self, node):
+        # Không dùng lại pool (socket) được tạo trước khi fork
+        if node["pid"] != os.getpid():
+            node["pool"] = pooling.MySQLConnectionPool(
+                pool_name=f"pms_{node['name']}_{os.getpid()}"[:64],
+                pool_size=self.pool_size,
+                **node["config"]
+            )
+            node["pid"] = os.getpid()
+        return node["pool"]
+
+    def _candidates(self, read_only):
+        """
+        Thứ tự node để thử: các replica khoẻ (tốt nhất trước), cuối cùng là primary
+        """
+        self._maybe_schedule_health_check()
+        if not read_only:
+            return [self.primary]
+        with self._lock:
+            healthy = [node for node in self.replicas if node["healthy"]]
+            if self.strategy == "latency":
+                healthy.sort(key=lambda node: (node["latency_ms"] or 0.0) * (node["outstanding"] + 1))
+            else:
+                healthy.sort(key=lambda node: (node["outstanding"], node["latency_ms"] or 0.0))
+        return healthy + [self.primary]
+
+    def _record(self, node, elapsed_ms=None, error=None):
+        with self._lock:
+            node["outstanding"] -= 1
+            if error is not None:
+                node["errors"] += 1
+                node["last_error"] = str(error)
+                if node["role"] == "replica":
+                    node["healthy"] = False
+                return
+            node["queries"] += 1
+            previous = node["latency_ms"]
+            node["latency_ms"] = elapsed_ms if previous is None else (
+                LATENCY_ALPHA * elapsed_ms + (1 - LATENCY_ALPHA) * previous
+            )
+
+    def _kill_query(self, node, connection_id, state):
+        """
+        Huỷ câu lệnh đang chạy của connection_id bằng KILL QUERY trên một kết nối phụ (không lấy từ pool)
+        """
+        with state["lock"]:
+            if state["done"]:
+                return
+            state["killed"] = True
+            try:
+                side = mysql.connector.connect(**node["config"])
+                try:
+                    cursor = side.cursor()
+                    cursor.execute(f"KILL QUERY {int(connection_id)}")
+                    cursor.close()
+                finally:
+                    side.close()
+                logging.warning(f"DB node {node['name']}: KILL QUERY {connection_id} (quá deadline)")
+            except Exception as e:
+                logging.error(f"DB node {node['name']}: không huỷ được query {connection_id}: {e}")
+
+    @contextmanager
+    def _kill_after(self, node, conn, timeout):
+        """
+        Quá timeout giây thì KILL QUERY câu lệnh đang chạy trên conn; lỗi do bị huỷ được raise thành DeadlineExceeded
+        """
+        if timeout is None:
+            yield
+            return
+        if timeout <= 0:
+            raise DeadlineExceeded("db")
+        state = {"lock": threading.Lock(), "done": False, "killed": False}
+        timer = threading.Timer(timeout, self._kill_query, (node, conn.connection_id, state))
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        except errors.Error:
+            if state["killed"]:
+                raise DeadlineExceeded("db")
+            raise
+        finally:
+            timer.cancel()
+            # Chờ KILL đang chạy (nếu có) xong rồi mới trả kết nối về pool
+            with state["lock"]:
+                state["done"] = True
+
+    def _run_with_timeout(self, node, conn, fn, timeout):
+        with self._kill_after(node, conn, timeout):
+            return fn(conn)
+
+    def run(self, fn, read_only=True, timeout=None):
+        """
+        Chạy fn(conn) trên node được chọn; lỗi kết nối ở replica thì thử node tiếp theo (cuối cùng là primary)
+
+        :param timeout: số giây tối đa cho fn, quá hạn thì KILL QUERY và raise DeadlineExceeded
+        :return: giá trị trả về của fn
+        """
+        deadline_at = None if timeout is None else time.monotonic() + timeout
+        last_error = None
+        for node in self._candidates(read_only):
+            try:
+                conn = self._pool(node).get_connection()
+            except errors.PoolError as e:
+                # Pool của node đang đầy, thử node khác
+                last_error = e
+                continue
+            except CONNECTION_ERRORS as e:
+                self._mark_unhealthy(node, e)
+                last_error = e
+                continue
+
+            with self._lock:
+                node["outstanding"] += 1
+            start = time.perf_counter()
+            try:
+                remaining = None if deadline_at is None else deadline_at - time.monotonic()
+                result = self._run_with_timeout(node, conn, fn, remaining)
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"DB node {node['name']} lỗi kết nối, chuyển node khác: {e}")
+                self._record(node, error=e)
+                last_error = e
+                continue
+            except Exception:
+                self._record(node, (time.perf_counter() - start) * 1000)
+                raise
+            finally:
+                conn.close()  # trả kết nối về pool
+            self._record(node, (time.perf_counter() - start) * 1000)
+            return result
+        raise last_error
+
+    @contextmanager
+    def connection(self, read_only=True, timeout=None):
+        """
+        Giữ một kết nối trong suốt khối with (vd. stream kết quả bằng fetchmany).
+        Chỉ failover khi lấy kết nối; lỗi giữa chừng không thử lại vì dữ liệu có thể đã gửi cho client.
+
+        :param timeout: số giây tối đa cho cả khối with, quá hạn thì KILL QUERY và raise DeadlineExceeded
+        """
+        last_error = None
+        for node in self._candidates(read_only):
+            try:
+                conn = self._pool(node).get_connection()
+                break
+            except errors.PoolError as e:
+                last_error = e
+            except CONNECTION_ERRORS as e:
+                self._mark_unhealthy(node, e)
+                last_error = e
+        else:
+            raise last_error
+
+        with self._lock:
+            node["outstanding"] += 1
+        start = time.perf_counter()
+        try:
+            with self._kill_after(node, conn, timeout):
+                yield conn
+        except CONNECTION_ERRORS as e:
+            self._record(node, error=e)
+            raise
+        except BaseException:
+            self._record(node, (time.perf_counter() - start) * 1000)
+            raise
+        else:
+            self._record(node, (time.perf_counter() - start) * 1000)
+        finally:
+            conn.close()
+
+    def _mark_unhealthy(self, node, error):
+        logging.warning(f"DB node {node['name']} không khoẻ: {error}")
+        with self._lock:
+            node["errors"] += 1
+            node["last_error"] = str(error)
+            if node["role"] == "replica":
+                node["healthy"] = False
+
+    def _maybe_schedule_health_check(self):
+        if not self.replicas:
+            return
+        with self._lock:
+            if self._health_check_running or time.time() - self._last_health_check < self.health_check_interval:
+                return
+            self._health_check_running = True
+        # Thread nền tạo lazy trong từng process, request hiện tại không phải chờ
+        threading.Thread(target=self.check_health, daemon=True).start()
+
+    def _replication_lag(self, conn):
+        """
+        Độ trễ replication (giây); None nếu không đọc được (thiếu quyền / replication dừng)
+        """
+        cursor = conn.cursor(dictionary=True)
+        try:
+            for query, column in (("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+                                  ("SHOW SLAVE STATUS", "Seconds_Behind_Master")):
+                try:
+                    cursor.execute(query)
+                except errors.ProgrammingError:
+                    continue
+                row = cursor.fetchone()
+                cursor.fetchall()
+                if row is None:
+                    # Không phải replica (vd. replica được quản lý kiểu khác) → coi như không trễ
+                    return 0
+                return row.get(column)
+            return None
+        finally:
+            cursor.close()
+
+    def check_health(self):
+        """
+        Kiểm tra từng replica: kết nối + SELECT 1, đo độ trễ replication nếu cấu hình max_replication_lag
+        """
+        try:
+            for node in self.replicas:
+                healthy, lag, error = True, None, None
+                try:
+                    conn = self._pool(node).get_connection()
+                    try:
+                        cursor = conn.cursor()
+                        cursor.execute("SELECT 1")
+                        cursor.fetchall()
+                        cursor.close()
+                        if self.max_replication_lag is not None:
+                            lag = self._replication_lag(conn)
+                            healthy = lag is not None and lag <= self.max_replication_lag
+                            if not healthy:
+                                error = f"replication lag {lag}s > {self.max_replication_lag}s"
+                    finally:
+                        conn.close()
+                except errors.PoolError:
+                    # Pool đầy nghĩa là node vẫn đang phục vụ, giữ nguyên trạng thái
+                    continue
+                except Exception as e:
+                    healthy, error = False, str(e)
+
+                with self._lock:
+                    if healthy != node["healthy"]:
+                        logging.info(f"DB node {node['name']} healthy: {node['healthy']} -> {healthy} {error or ''}")
+                    node["healthy"] = healthy
+                    node["lag"] = lag
+                    if error:
+                        node["last_error"] = error
+        finally:
+            with self._lock:
+                self._last_health_check = time.time()
+                self._health_check_running = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "strategy": self.strategy,
+                "max_replication_lag": self.max_replication_lag,
+                "pid": os.getpid(),
+                "nodes": [
+                    {
+                        "name": node["name"],
+                        "role": node["role"],
+                        "host": node["config"].get("host"),
+                        "healthy": node["healthy"],
+                        "outstanding": node["outstanding"],
+                        "latency_ms": round(node["latency_ms"], 2) if node["latency_ms"] is not None else None,
+                        "lag": node["lag"],
+                        "queries": node["queries"],
+                        "errors": node["errors"],
+                        "last_error": node["last_error"]
+                    }
+                    for node in [self.primary] + self.replicas
+                ]
+            }
+
+
+def create_db_router(primary_config, replica_configs, settings):
+    """
+    Tạo router theo [db], các section [db_replica_*] và [db_routing] trong config.ini
+    """
+    return DatabaseRouter(
+        primary_config,
+        replica_configs,
+        pool_size=settings.get("pool_size", DEFAULT_POOL_SIZE),
+        strategy=settings.get("strategy", "least_outstanding"),
+        max_replication_lag=settings.get("max_replication_lag"),
+        health_check_interval=settings.get("health_check_interval", DEFAULT_HEALTH_CHECK_INTERVAL)
+    )
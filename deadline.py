@@ -0,0 +1,111 @@
+"""
+Deadline cho toàn bộ một request /ask.
+
+Deadline được tạo từ header X-Request-Timeout (giây) hoặc giá trị mặc định, rồi truyền qua từng bước
+(match intent, sinh SQL, chạy SQL, sinh câu trả lời). Mỗi bước chỉ được dùng phần thời gian còn lại:
+- lời gọi Gemini chạy trong thread pool, quá hạn thì request không chờ nữa (kết quả bị bỏ)
+- truy vấn MySQL quá hạn bị huỷ bằng KILL QUERY (xem db.DatabaseRouter.run)
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import ExitStack
+
+TIMEOUT_HEADER = "X-Request-Timeout"
+DEFAULT_TIMEOUT_SECONDS = 30
+MAX_TIMEOUT_SECONDS = 120
+MIN_TIMEOUT_SECONDS = 1
+# Số thread tối đa cho các lời gọi có deadline trong một process
+EXECUTOR_WORKERS = 16
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+# Hook bao quanh mỗi lời gọi trong thread pool (vd. profiler lấy mẫu cả thread đó), xem register_pool_hook
+_pool_hooks = []
+
+
+class DeadlineExceeded(Exception):
+    """
+    Hết thời gian của request tại một bước (stage)
+    """
+
+    def __init__(self, stage, budget=None):
+        self.stage = stage
+        self.budget = budget
+        super().__init__(f"Deadline exceeded during {stage}" + (f" (budget {budget:.1f}s)" if budget else ""))
+
+
+def _get_executor():
+    # Thread không tồn tại qua fork, tạo executor riêng cho từng process
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="deadline")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def register_pool_hook(hook):
+    """
+    Đăng ký hook cho các lời gọi của Deadline.run
+
+    :param hook: hàm không tham số trả về context manager, được vào trong thread pool quanh lời gọi
+    """
+    if hook not in _pool_hooks:
+        _pool_hooks.append(hook)
+
+
+def _run_in_pool(fn, args, kwargs):
+    if not _pool_hooks:
+        return fn(*args, **kwargs)
+    with ExitStack() as stack:
+        for hook in _pool_hooks:
+            stack.enter_context(hook())
+        return fn(*args, **kwargs)
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_header(cls, value, default=DEFAULT_TIMEOUT_SECONDS, maximum=MAX_TIMEOUT_SECONDS):
+        """
+        Deadline từ giá trị header (giây, số thực); header không hợp lệ thì dùng mặc định
+        """
+        try:
+            seconds = float(value) if value else default
+        except ValueError:
+            seconds = default
+        return cls(min(max(seconds, MIN_TIMEOUT_SECONDS), maximum))
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, stage):
+        if self.expired():
+            raise DeadlineExceeded(stage, self.budget)
+
+    def run(self, stage, fn, *args, **kwargs):
+        """
+        Chạy fn trong thread pool, chờ tối đa phần thời gian còn lại.
+        Quá hạn thì bỏ kết quả và raise DeadlineExceeded (thread vẫn chạy nốt ở nền).
+        """
+        self.check(stage)
+        # Chạy trong context của request (contextvars) để các hook theo request vẫn thấy nó
+        future = _get_executor().submit(contextvars.copy_context().run, _run_in_pool, fn, args, kwargs)
+        try:
+            return future.result(timeout=self.remaining())
+        except FutureTimeoutError:
+            future.cancel()
+            raise DeadlineExceeded(stage, self.budget)
+
+    def elapsed(self):
+        return self.budget - self.remaining()
@@ -1,7 +1,9 @@
 import google.generativeai as genai
+import json
 import re
 import logging
 from token_utils import token_manager
+from answer_cache import answer_cache, make_key
 
 def configure_gemini(api_key):
     """
@@ -11,7 +13,13 @@ def configure_gemini(api_key):
     """
     genai.configure(api_key=api_key)
 
-def generate_sql_query(question, schema, model_name="gemini-1.5-flash", max_input_tokens=8000):
+def _request_options(timeout):
+    """
+    Giới hạn thời gian cho một lời gọi Gemini (None = không giới hạn)
+    """
+    return {"timeout": timeout} if timeout else None
+
+def generate_sql_query(question, schema, model_name="gemini-1.5-flash", max_input_tokens=8000, timeout=None):
     """
     Generate SQL query from natural language question using the provided schema.
     
@@ -20,6 +28,7 @@ def generate_sql_query(question, schema, model_name="gemini-1.5-flash", max_inpu
         schema: Database schema text
         model_name: Gemini model name
         max_input_tokens: Maximum input tokens allowed
+        timeout: Số giây tối đa chờ Gemini (phần còn lại của deadline request)
     
     Returns:
         Generated SQL query string
@@ -31,8 +40,8 @@ def generate_sql_query(question, schema, model_name="gemini-1.5-flash", max_inpu
     # 🔍 Token validation và optimization
     logging.info(f"Original schema tokens: {token_manager.count_tokens(schema)}")
     
-    # Truncate schema if needed
-    optimized_schema = token_manager.truncate_schema(schema, question, max_input_tokens - 1000)
+    # Chọn bảng / cột liên quan đến câu hỏi trong giới hạn token
+    optimized_schema = token_manager.pack_schema(schema, question, max_input_tokens - 1000)
     
     prompt = f"""
 You are an expert in SQL and assistant for Property Management System (PMS). Based on the following schema:
@@ -62,6 +71,7 @@ Write a single optimized MySQL SELECT query that answers the following user ques
 4. The question may include pattern matching (e.g., using LIKE with wildcards), filtering, sorting, or joining multiple tables.
 5. Always use proper SQL syntax. When using LIKE, include appropriate wildcards (e.g., % or _) if needed for pattern matching.
 6. When generating SQL query only use atttribute that is in the schema.
+7. When the query can return many rows, add an ORDER BY that ends with a unique column (e.g. the primary key) so results can be paged in a stable order.
 
 USER QUESTION: "{question}"
 
@@ -81,7 +91,7 @@ Only return the SQL query. No explanation, no markdown, no extra text.
     model = genai.GenerativeModel(model_name)
     
     try:
-        response = model.generate_content(prompt)
+        response = model.generate_content(prompt, request_options=_request_options(timeout))
         raw = response.text.strip()
         logging.info(f"Raw model output: {raw}")
         
@@ -94,7 +104,7 @@ Only return the SQL query. No explanation, no markdown, no extra text.
         logging.error(f"Error calling Gemini API: {str(e)}")
         raise e
 
-def generate_natural_language_response(question, results, model_name="gemini-1.5-flash", max_token=150, max_input_tokens=4000):
+def generate_natural_language_response(question, results, model_name="gemini-1.5-flash", max_token=150, max_input_tokens=4000, timeout=None, has_more=False):
     """
     Generate natural language response from SQL results.
     
@@ -104,6 +114,8 @@ def generate_natural_language_response(question, results, model_name="gemini-1.5
         model_name: Gemini model name
         max_token: Maximum output tokens
         max_input_tokens: Maximum input tokens
+        timeout: Số giây tối đa chờ Gemini (phần còn lại của deadline request)
+        has_more: results chỉ là trang đầu, câu truy vấn còn nhiều dòng khác
     
     Returns:
         Natural language response string
@@ -119,11 +131,25 @@ def generate_natural_language_response(question, results, model_name="gemini-1.5
     
     # Giới hạn số lượng kết quả để tránh quá dài
     sample = optimized_results[:10]
+
+    # ♻️ Cùng câu hỏi trên cùng dữ liệu → dùng lại câu trả lời đã sinh
+    cache_key = make_key(question, sample, model_name, has_more)
+    cached_answer = answer_cache.get(cache_key)
+    if cached_answer is not None:
+        logging.info("Answer cache hit, bỏ qua lần gọi Gemini sinh câu trả lời")
+        return cached_answer
     
+    # Chỉ có trang đầu: không để câu trả lời mô tả như toàn bộ kết quả
+    partial_note = (
+        f"Lưu ý: đây chỉ là {len(results)} kết quả đầu tiên, vẫn còn kết quả khác chưa hiển thị. "
+        "Hãy nói rõ điều này, không được coi đây là toàn bộ kết quả hay đưa ra tổng số trên toàn bộ dữ liệu.\n\n"
+    ) if has_more else ""
+
     prompt = (
         f"Bạn là một trợ lý AI thân thiện và chuyên nghiệp. Hãy trả lời câu hỏi của người dùng một cách tự nhiên và dễ hiểu bằng tiếng Việt.\n\n"
         f"Câu hỏi của người dùng: {question}\n\n"
         f"Dữ liệu tìm được: {sample}\n\n"
+        f"{partial_note}"
         "Hãy trả lời theo các nguyên tắc sau:\n"
         "1. Sử dụng ngôn ngữ tự nhiên, thân thiện\n"
         "2. Tổ chức thông tin một cách logic và dễ hiểu\n"
@@ -144,11 +170,107 @@ def generate_natural_language_response(question, results, model_name="gemini-1.5
     
     try:
         model = genai.GenerativeModel(model_name)
-        response = model.generate_content(prompt, generation_config={"max_output_tokens": max_token})
+        response = model.generate_content(
+            prompt, generation_config={"max_output_tokens": max_token}, request_options=_request_options(timeout)
+        )
         result = response.text.strip()
         if not result:
             return "Xin lỗi, tôi gặp một chút vấn đề khi xử lý câu trả lời. Bạn có thể thử lại không?"
+        answer_cache.set(cache_key, result)
         return result
     except Exception as e:
         logging.error(f"Error generating natural response: {str(e)}")
         return "Xin lỗi, có lỗi xảy ra khi tạo câu trả lời. Vui lòng thử lại sau."
+
+def generate_json_content(prompt, model_name="gemini-1.5-flash"):
+    """
+    Gọi Gemini và tách đoạn JSON trong kết quả trả về.
+
+    Returns:
+        (parsed_json hoặc None nếu không parse được, raw_text)
+    """
+    model = genai.GenerativeModel(model_name)
+    response = model.generate_content(prompt)
+    raw = response.text.strip()
+
+    # Tìm đoạn JSON trong kết quả trả về
+    json_match = re.search(r'\{.*\}|\[.*\]', raw, re.DOTALL)
+    if json_match:
+        try:
+            return json.loads(json_match.group(0)), raw
+        except ValueError:
+            pass
+    return None, raw
+
+def _build_timesheet_match_prompt(items, top_k):
+    lines = []
+    for item in items:
+        lines.append(f'LINE {item["line"]}: [{item["project_name"]}] {item["task_name"]}')
+        for task in item["candidates"][:top_k]:
+            lines.append(f'  - {task["id"]} - {task["project_name"]} - {task["task_name"]}')
+        if not item["candidates"]:
+            lines.append("  (no candidates)")
+    items_text = "\n".join(lines)
+
+    return f"""
+You are matching lines of an employee daily report to tasks of a project management system.
+Each LINE below is one task from the report (with its project in brackets), followed by candidate system tasks in the format `ID - ProjectName - TaskName`.
+
+For each LINE, pick the single candidate that describes the same work. Prefer candidates of the same project.
+If none of the candidates fits, use null. Never return an ID that is not listed under that LINE.
+
+{items_text}
+
+Return only a JSON object, no explanation:
+{{"matches": [{{"line": <line number>, "task_id": "<ID or null>"}}, ...]}}
+"""
+
+def match_timesheet_lines(items, top_k=5, model_name="gemini-1.5-flash"):
+    """
+    Dùng Gemini để match các dòng báo cáo chưa giải quyết được với task ứng viên.
+
+    Args:
+        items: List {"line", "project_name", "task_name", "candidates": [system_task, ...]}
+        top_k: Số ứng viên tối đa mỗi dòng; tự giảm dần nếu prompt vượt token limit
+        model_name: Gemini model name
+
+    Returns:
+        (dict line -> system_task đã chọn, số token của prompt)
+
+    Raises:
+        ValueError: If prompt exceeds token limit
+    """
+    if not items:
+        return {}, 0
+
+    error_msg = ""
+    for k in range(max(top_k, 1), 0, -1):
+        prompt = _build_timesheet_match_prompt(items, k)
+        is_valid, error_msg = token_manager.validate_prompt(prompt)
+        if is_valid:
+            break
+        logging.warning(f"Timesheet match prompt too long with top_k={k}: {error_msg}")
+    else:
+        raise ValueError(f"Token limit exceeded: {error_msg}")
+
+    prompt_tokens = token_manager.count_tokens(prompt)
+    logging.info(f"Timesheet match prompt tokens: {prompt_tokens} (top_k={k}, lines={len(items)})")
+
+    parsed, raw = generate_json_content(prompt, model_name)
+    if not isinstance(parsed, dict):
+        logging.warning(f"Could not parse timesheet match output: {raw}")
+        return {}, prompt_tokens
+
+    # Chỉ chấp nhận ID nằm trong danh sách ứng viên đã gửi cho dòng đó
+    by_line = {item["line"]: {task["id"]: task for task in item["candidates"][:k]} for item in items}
+    chosen = {}
+    for match in parsed.get("matches", []):
+        try:
+            line = int(match.get("line"))
+        except (TypeError, ValueError, AttributeError):
+            continue
+        task_id = match.get("task_id")
+        task = by_line.get(line, {}).get(str(task_id)) if task_id is not None else None
+        if task:
+            chosen[line] = task
+    return chosen, prompt_tokens
@@ -0,0 +1,49 @@
+"""
+Cấu hình chạy production bằng gunicorn (pre-fork).
+
+    gunicorn -c gunicorn.conf.py
+
+- preload_app: SentenceTransformer, tiktoken encoder và schema được load một lần ở master
+  trước khi fork, các worker dùng chung vùng nhớ read-only nhờ copy-on-write
+- số worker mặc định theo số CPU, mỗi worker xử lý tối đa `threads` request đồng thời
+- worker được recycle nhẹ nhàng sau max_requests request (có jitter để không restart cùng lúc)
+
+Các giá trị có thể ghi đè bằng biến môi trường PMS_*.
+"""
+import gc
+import multiprocessing
+import os
+
+wsgi_app = "app_chatbot_gemini:app"
+bind = os.environ.get("PMS_BIND", "0.0.0.0:5000")
+
+workers = int(os.environ.get("PMS_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+# Giới hạn số request đồng thời trong một worker
+threads = int(os.environ.get("PMS_THREADS", 4))
+# Số kết nối chờ tối đa trước khi từ chối
+backlog = int(os.environ.get("PMS_BACKLOG", 256))
+
+preload_app = os.environ.get("PMS_PRELOAD", "1") == "1"
+
+max_requests = int(os.environ.get("PMS_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("PMS_MAX_REQUESTS_JITTER", 100))
+graceful_timeout = 30
+# Gemini + MySQL có thể chậm, tránh bị kill giữa chừng
+timeout = int(os.environ.get("PMS_TIMEOUT", 120))
+
+
+def when_ready(server):
+    # Đưa toàn bộ object đã load ở master vào vùng permanent của GC để GC ở worker
+    # không chạm vào (và không làm copy) các trang nhớ dùng chung
+    gc.freeze()
+    server.log.info(f"Master ready (preload={preload_app}), spawning {workers} workers x {threads} threads")
+
+
+def post_fork(server, worker):
+    # Mỗi worker chỉ dùng 1 thread cho torch để N worker không tranh nhau CPU
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
@@ -0,0 +1,375 @@
+"""
+Lớp intent cục bộ: khớp câu hỏi thường gặp với thư viện SQL template có tham số,
+sinh SQL trong vài mili-giây mà không gọi Gemini. Không đủ chắc chắn thì trả None để /ask fallback về Gemini.
+
+- Slot: project, person (tên riêng viết hoa sau "by / của / nhân viên ..."), period (hôm nay, tháng này, tháng 5, từ ... đến ...)
+- Khớp template: luật keyword (mọi nhóm phải có ít nhất một từ) và/hoặc embedding với các câu mẫu
+  (giá trị slot được thay bằng {project} / {person} / {period} trước khi so)
+- Template phải dùng đủ mọi slot tìm thấy trong câu hỏi, tránh trả lời câu hỏi cụ thể hơn bằng template chung
+- Tương tự với từ: câu hỏi còn từ nội dung ngoài slot, keyword, câu mẫu của template và từ đệm chung
+  (vd. "... that are done", "... per project", "... by status") thì không khớp template đó
+- SQL template được kiểm tra is_safe_sql + bảng trong schema khi load, giá trị slot luôn truyền qua tham số cursor
+"""
+import calendar
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from schema_utils import validate_tables_in_sql
+from sql_utils import is_safe_sql
+
+DEFAULT_MIN_SCORE = 0.82
+# Ngưỡng embedding khi luật keyword của template đã khớp
+DEFAULT_KEYWORD_MIN_SCORE = 0.55
+
+SQL_PARAM_PATTERN = re.compile(r"%\((\w+)\)s")
+SLOT_PLACEHOLDER_PATTERN = re.compile(r"\{(?:project|person|period)\}")
+WORD_PATTERN = re.compile(r"\w+")
+SLOT_PARAMS = {
+    "project": {"project"},
+    "person": {"person"},
+    "period": {"date_from", "date_to"},
+}
+
+# Từ kết thúc tên dự án
+STOP_WORDS = {
+    "this", "last", "in", "on", "for", "from", "to", "during", "with", "by", "and", "of", "that", "which", "is", "are",
+    "trong", "tháng", "tuần", "năm", "hôm", "từ", "đến", "của", "là", "có", "bao", "nào", "đã", "mà", "và", "với", "gồm",
+}
+# Từ đệm không đổi nghĩa câu hỏi, được bỏ qua khi kiểm tra từ thừa
+FILLER_WORDS = {
+    "a", "an", "the", "me", "my", "please", "is", "are", "there", "what", "which", "that", "do", "does",
+    "cho", "tôi", "xem", "các", "những", "nào", "là", "gì", "hãy", "giúp", "được", "có",
+}
+PROJECT_PATTERN = re.compile(
+    r"\b(?:project|dự án|du an)\s+(?:\"([^\"]+)\"|'([^']+)'|([^\s?,.!;]+(?:\s+[^\s?,.!;]+){0,4}))",
+    re.IGNORECASE
+)
+PERSON_PATTERN = re.compile(
+    r"\b(?:by|of|for|to|did|does|has|user|member|nhân viên|thành viên|của|cho|bạn|anh|chị)\s+"
+    r"([A-ZÀ-Ỹ][\wÀ-ỹ]*(?:\s+[A-ZÀ-Ỹ][\wÀ-ỹ]*){0,4})"
+)
+ISO_DATE = r"(\d{4}-\d{1,2}-\d{1,2})"
+DATE_RANGE_PATTERN = re.compile(rf"\b(?:from|từ)\s+{ISO_DATE}\s+(?:to|đến|-)\s+{ISO_DATE}", re.IGNORECASE)
+MONTH_PATTERN = re.compile(r"\b(?:tháng|month)\s+(\d{1,2})(?:\s*[/-]\s*|\s+(?:năm|of)\s+)?(\d{4})?\b", re.IGNORECASE)
+RELATIVE_PERIODS = [
+    (re.compile(r"\b(?:today|hôm nay)\b", re.IGNORECASE), "today"),
+    (re.compile(r"\b(?:yesterday|hôm qua)\b", re.IGNORECASE), "yesterday"),
+    (re.compile(r"\b(?:this week|tuần này)\b", re.IGNORECASE), "this_week"),
+    (re.compile(r"\b(?:last week|tuần trước)\b", re.IGNORECASE), "last_week"),
+    (re.compile(r"\b(?:this month|tháng này)\b", re.IGNORECASE), "this_month"),
+    (re.compile(r"\b(?:last month|tháng trước)\b", re.IGNORECASE), "last_month"),
+    (re.compile(r"\b(?:this year|năm nay)\b", re.IGNORECASE), "this_year"),
+]
+
+
+def _like(value):
+    escaped = value.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _month_range(year, month):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1]) + timedelta(days=1)
+
+
+def _relative_range(label, today):
+    if label == "today":
+        return today, today + timedelta(days=1)
+    if label == "yesterday":
+        return today - timedelta(days=1), today
+    if label in ("this_week", "last_week"):
+        monday = today - timedelta(days=today.weekday())
+        if label == "last_week":
+            monday -= timedelta(days=7)
+        return monday, monday + timedelta(days=7)
+    if label == "this_month":
+        return _month_range(today.year, today.month)
+    if label == "last_month":
+        first = today.replace(day=1) - timedelta(days=1)
+        return _month_range(first.year, first.month)
+    return date(today.year, 1, 1), date(today.year + 1, 1, 1)
+
+
+def _stem(word):
+    # Bỏ "s" số nhiều tiếng Anh để "task" / "tasks" là một từ
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def content_words(text):
+    """
+    Tập từ (đã bỏ slot placeholder, chữ thường, bỏ "s" số nhiều) của câu hỏi đã mask hoặc câu mẫu
+    """
+    return {_stem(word) for word in WORD_PATTERN.findall(SLOT_PLACEHOLDER_PATTERN.sub(" ", text.lower()))}
+
+
+def extract_period(question, today=None):
+    """
+    Trả về ({"date_from", "date_to"} dạng yyyy-mm-dd, date_to không bao gồm, span) hoặc (None, None)
+    """
+    today = today or date.today()
+    match = DATE_RANGE_PATTERN.search(question)
+    if match:
+        try:
+            start = datetime.strptime(match.group(1), "%Y-%m-%d").date()
+            end = datetime.strptime(match.group(2), "%Y-%m-%d").date() + timedelta(days=1)
+            return {"date_from": start.isoformat(), "date_to": end.isoformat()}, match.span()
+        except ValueError:
+            pass
+    for pattern, label in RELATIVE_PERIODS:
+        match = pattern.search(question)
+        if match:
+            start, end = _relative_range(label, today)
+            return {"date_from": start.isoformat(), "date_to": end.isoformat()}, match.span()
+    match = MONTH_PATTERN.search(question)
+    if match and 1 <= int(match.group(1)) <= 12:
+        start, end = _month_range(int(match.group(2) or today.year), int(match.group(1)))
+        return {"date_from": start.isoformat(), "date_to": end.isoformat()}, match.span()
+    return None, None
+
+
+def extract_project(question):
+    match = PROJECT_PATTERN.search(question)
+    if not match:
+        return None, None
+    if match.group(1) or match.group(2):
+        group = 1 if match.group(1) else 2
+        return match.group(group).strip(), match.span(group)
+    start, end = match.start(3), None
+    capitalized = match.group(3)[0].isupper()
+    for word in re.finditer(r"\S+", match.group(3)):
+        text = word.group()
+        # Tên viết hoa ("Sun Rise") kết thúc ở từ viết thường đầu tiên
+        if text.lower() in STOP_WORDS or (capitalized and end is not None and not (text[0].isupper() or text[0].isdigit())):
+            break
+        end = start + word.end()
+    if end is None:
+        return None, None
+    return question[start:end], (start, end)
+
+
+def extract_person(question, exclude_span=None):
+    for match in PERSON_PATTERN.finditer(question):
+        span = match.span(1)
+        if exclude_span and span[0] < exclude_span[1] and exclude_span[0] < span[1]:
+            continue
+        # Khoảng À-Ỹ có cả chữ thường, chỉ lấy các từ viết hoa liên tiếp
+        end = None
+        for word in re.finditer(r"\S+", match.group(1)):
+            if not word.group()[0].isupper():
+                break
+            end = span[0] + word.end()
+        if end is None:
+            continue
+        return question[span[0]:end], (span[0], end)
+    return None, None
+
+
+def extract_slots(question, today=None):
+    """
+    Tách slot trong câu hỏi
+
+    :return: (slots, params, masked_question)
+             slots: {"project": "Alpha", "person": "Nguyen Van A", "period": {...}}
+             params: tham số cho cursor.execute (giá trị LIKE đã escape, ngày dạng yyyy-mm-dd)
+             masked_question: câu hỏi với giá trị slot thay bằng {project} / {person} / {period}
+    """
+    slots, params, spans = {}, {}, []
+
+    project, project_span = extract_project(question)
+    if project:
+        slots["project"] = project
+        params["project"] = _like(project)
+        spans.append((project_span, "{project}"))
+
+    period, period_span = extract_period(question, today)
+    if period:
+        slots["period"] = period
+        params.update(period)
+        spans.append((period_span, "{period}"))
+
+    person, person_span = extract_person(question, project_span)
+    if person and not (period_span and person_span[0] < period_span[1] and period_span[0] < person_span[1]):
+        slots["person"] = person
+        params["person"] = _like(person)
+        spans.append((person_span, "{person}"))
+
+    masked = question
+    for (start, end), placeholder in sorted(spans, reverse=True):
+        masked = masked[:start] + placeholder + masked[end:]
+    return slots, params, masked
+
+
+class IntentMatcher:
+    """
+    Thư viện template + thống kê tỉ lệ trúng (theo từng worker)
+    """
+
+    def __init__(self, templates, embedding_model=None, min_score=DEFAULT_MIN_SCORE,
+                 keyword_min_score=DEFAULT_KEYWORD_MIN_SCORE, allowed_tables=None):
+        self.embedding_model = embedding_model
+        self.min_score = min_score
+        self.keyword_min_score = keyword_min_score
+        self.templates = []
+        for template in templates:
+            error = self._validate(template, allowed_tables)
+            if error:
+                logging.warning(f"Bỏ intent template '{template.get('name')}': {error}")
+                continue
+            self.templates.append({
+                "name": template["name"],
+                "sql": template["sql"].strip(),
+                "slots": set(template.get("slots", [])),
+                "keywords": [[keyword.lower() for keyword in group] for group in template.get("keywords", [])],
+                "exclude": [keyword.lower() for keyword in template.get("exclude", [])],
+                "examples": template.get("examples", []),
+                "example_embeddings": None
+            })
+            keyword_text = " ".join(keyword for group in template.get("keywords", []) for keyword in group)
+            self.templates[-1]["vocabulary"] = content_words(" ".join([keyword_text, *template.get("examples", [])]))
+
+        # Encode câu mẫu một lần khi load (trước khi fork nếu chạy gunicorn preload)
+        if self.embedding_model is not None:
+            for template in self.templates:
+                if template["examples"]:
+                    template["example_embeddings"] = self._encode(template["examples"])
+
+        self._lock = threading.Lock()
+        self._stats = {"total": 0, "hits": 0, "by_template": {}, "total_ms": 0.0}
+        logging.info(f"IntentMatcher loaded {len(self.templates)} templates")
+
+    @staticmethod
+    def _validate(template, allowed_tables):
+        if not template.get("name") or not template.get("sql"):
+            return "thiếu name hoặc sql"
+        if not template.get("keywords") and not template.get("examples"):
+            return "cần keywords hoặc examples"
+        sql = template["sql"]
+        if not is_safe_sql(sql) or ";" in sql.strip().rstrip(";"):
+            return "SQL không an toàn"
+        unknown_slots = set(template.get("slots", [])) - set(SLOT_PARAMS)
+        if unknown_slots:
+            return f"slot không hỗ trợ: {', '.join(sorted(unknown_slots))}"
+        provided = set().union(*(SLOT_PARAMS[slot] for slot in template.get("slots", [])))
+        missing = set(SQL_PARAM_PATTERN.findall(sql)) - provided
+        if missing:
+            return f"tham số không có slot tương ứng: {', '.join(sorted(missing))}"
+        if allowed_tables is not None:
+            is_valid, forbidden = validate_tables_in_sql(sql, allowed_tables)
+            if not is_valid:
+                return f"bảng không có trong schema: {', '.join(sorted(forbidden))}"
+        return None
+
+    def _encode(self, texts):
+        embeddings = np.asarray(self.embedding_model.encode(texts), dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _keywords_match(template, lowered):
+        if any(keyword in lowered for keyword in template["exclude"]):
+            return False
+        if not template["keywords"]:
+            return None
+        return all(any(keyword in lowered for keyword in group) for group in template["keywords"])
+
+    @staticmethod
+    def _extra_words(template, words):
+        """
+        Từ nội dung trong câu hỏi mà template không dùng (điều kiện, nhóm theo... template sẽ bỏ qua)
+        """
+        return words - template["vocabulary"] - FILLER_WORDS
+
+    def match(self, question, today=None):
+        """
+        Tìm template khớp chắc chắn với câu hỏi
+
+        :return: {"name", "sql", "params", "slots", "score"} hoặc None nếu nên fallback về Gemini
+        """
+        start = time.perf_counter()
+        slots, params, masked = extract_slots(question, today)
+        lowered = masked.lower()
+        words = content_words(masked)
+
+        # Template phải có đủ slot cần thiết và dùng hết slot, hết từ nội dung của câu hỏi
+        candidates = []
+        for template in self.templates:
+            if template["slots"] != set(slots):
+                continue
+            keywords_ok = self._keywords_match(template, lowered)
+            if keywords_ok is False or self._extra_words(template, words):
+                continue
+            candidates.append((template, keywords_ok))
+
+        best = None
+        if candidates:
+            query_embedding = None
+            if self.embedding_model is not None and any(t["example_embeddings"] is not None for t, _ in candidates):
+                query_embedding = self._encode([masked])[0]
+
+            for template, keywords_ok in candidates:
+                if query_embedding is not None and template["example_embeddings"] is not None:
+                    score = float(np.max(template["example_embeddings"] @ query_embedding))
+                    threshold = self.keyword_min_score if keywords_ok else self.min_score
+                elif keywords_ok:
+                    # Không có embedding: chỉ dựa vào luật keyword
+                    score, threshold = 1.0, 1.0
+                else:
+                    continue
+                if score < threshold:
+                    continue
+                rank = (score, len(template["keywords"]))
+                if best is None or rank > best[0]:
+                    best = (rank, template, score)
+
+        result = None
+        if best is not None:
+            _, template, score = best
+            result = {
+                "name": template["name"],
+                "sql": template["sql"],
+                "params": {name: params[name] for name in SQL_PARAM_PATTERN.findall(template["sql"])},
+                "slots": slots,
+                "score": round(score, 4)
+            }
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats["total"] += 1
+            self._stats["total_ms"] += elapsed_ms
+            if result:
+                self._stats["hits"] += 1
+                self._stats["by_template"][result["name"]] = self._stats["by_template"].get(result["name"], 0) + 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            total = self._stats["total"]
+            return {
+                "templates": len(self.templates),
+                "total": total,
+                "hits": self._stats["hits"],
+                "misses": total - self._stats["hits"],
+                "hit_rate": round(self._stats["hits"] / total, 4) if total else 0.0,
+                "avg_match_ms": round(self._stats["total_ms"] / total, 3) if total else 0.0,
+                "by_template": dict(self._stats["by_template"]),
+                "pid": os.getpid()
+            }
+
+
+def load_intent_matcher(path, embedding_model=None, min_score=DEFAULT_MIN_SCORE,
+                        keyword_min_score=DEFAULT_KEYWORD_MIN_SCORE, allowed_tables=None):
+    """
+    Load thư viện template từ file JSON ({"templates": [...]}), trả về None nếu không có file
+    """
+    if not os.path.exists(path):
+        logging.info(f"Không có file intent templates ({path}), mọi câu hỏi dùng Gemini")
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        templates = json.load(f)["templates"]
+    return IntentMatcher(templates, embedding_model, min_score, keyword_min_score, allowed_tables)
@@ -0,0 +1,291 @@
+"""
+Bộ nhớ hội thoại (cache câu hỏi tương tự) có giới hạn kích thước.
+
+- Giới hạn số mục theo từng user và toàn cục, loại bỏ theo LRU
+- Embedding lưu dạng float16 trong một mảng NumPy cấp phát sẵn (không tạo tensor cho từng mục)
+- Kết quả truy vấn được nén (zlib + JSON) thay vì giữ nguyên list các dòng
+- Backend SQLite tuỳ chọn để mọi worker cùng thấy chung lịch sử
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MAX_ITEMS_PER_USER = 20
+DEFAULT_MAX_ITEMS = 5000
+# Chỉ so với N câu gần nhất của user
+DEFAULT_SEARCH_WINDOW = 5
+
+
+def compress_results(results):
+    return zlib.compress(json.dumps(results, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def decompress_results(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ConversationMemory:
+    """
+    Backend trong process: mỗi worker có bộ nhớ riêng
+    """
+
+    backend = "memory"
+
+    def __init__(self, dim, max_items=DEFAULT_MAX_ITEMS, max_items_per_user=DEFAULT_MAX_ITEMS_PER_USER):
+        self.dim = dim
+        self.max_items = max_items
+        self.max_items_per_user = max_items_per_user
+
+        self._embeddings = np.zeros((max_items, dim), dtype=np.float16)
+        self._free_slots = list(range(max_items - 1, -1, -1))
+        self._entries = OrderedDict()   # entry_id -> record, thứ tự LRU toàn cục
+        self._by_user = {}              # user_id -> OrderedDict(entry_id -> None), thứ tự LRU của user
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _evict(self, entry_id):
+        record = self._entries.pop(entry_id)
+        user_entries = self._by_user[record["user_id"]]
+        del user_entries[entry_id]
+        if not user_entries:
+            del self._by_user[record["user_id"]]
+        self._free_slots.append(record["slot"])
+
+    def add(self, user_id, question, embedding, sql, results):
+        with self._lock:
+            user_entries = self._by_user.setdefault(user_id, OrderedDict())
+            while len(user_entries) >= self.max_items_per_user:
+                self._evict(next(iter(user_entries)))
+            if not self._free_slots:
+                self._evict(next(iter(self._entries)))
+            # Có thể vừa bị xoá khi evict mục cuối cùng của user
+            user_entries = self._by_user.setdefault(user_id, user_entries)
+
+            slot = self._free_slots.pop()
+            self._embeddings[slot] = _normalize(embedding)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "user_id": user_id,
+                "question": question,
+                "sql": sql,
+                "slot": slot,
+                "result_blob": compress_results(results),
+                "num_results": len(results),
+                "created_at": time.time()
+            }
+            user_entries[entry_id] = None
+
+    def find_similar(self, user_id, embedding, threshold, window=DEFAULT_SEARCH_WINDOW):
+        """
+        Tìm câu hỏi tương tự trong `window` câu gần nhất của user.
+
+        Returns:
+            {"question", "sql", "result", "similarity"} hoặc None
+        """
+        with self._lock:
+            user_entries = self._by_user.get(user_id)
+            if not user_entries:
+                return None
+            entry_ids = list(user_entries)[-window:]
+            slots = [self._entries[entry_id]["slot"] for entry_id in entry_ids]
+            similarities = self._embeddings[slots].astype(np.float32) @ _normalize(embedding)
+
+            best = int(np.argmax(similarities))
+            if similarities[best] <= threshold:
+                return None
+
+            entry_id = entry_ids[best]
+            self._entries.move_to_end(entry_id)
+            user_entries.move_to_end(entry_id)
+            record = self._entries[entry_id]
+            return {
+                "question": record["question"],
+                "sql": record["sql"],
+                "result": decompress_results(record["result_blob"]),
+                "similarity": float(similarities[best])
+            }
+
+    def history(self, user_id):
+        with self._lock:
+            return [
+                {
+                    "question": self._entries[entry_id]["question"],
+                    "sql": self._entries[entry_id]["sql"],
+                    "num_results": self._entries[entry_id]["num_results"]
+                }
+                for entry_id in self._by_user.get(user_id, ())
+            ]
+
+    def clear(self, user_id=None):
+        with self._lock:
+            entry_ids = list(self._entries) if user_id is None else list(self._by_user.get(user_id, ()))
+            for entry_id in entry_ids:
+                self._evict(entry_id)
+
+    def stats(self):
+        with self._lock:
+            result_bytes = sum(len(record["result_blob"]) for record in self._entries.values())
+            text_bytes = sum(len(record["question"]) + len(record["sql"]) for record in self._entries.values())
+            return {
+                "backend": self.backend,
+                "entries": len(self._entries),
+                "users": len(self._by_user),
+                "max_items": self.max_items,
+                "max_items_per_user": self.max_items_per_user,
+                "embedding_bytes": int(self._embeddings.nbytes),
+                "result_bytes": result_bytes,
+                "text_bytes": text_bytes,
+                "total_bytes": int(self._embeddings.nbytes) + result_bytes + text_bytes
+            }
+
+
+class SQLiteConversationMemory:
+    """
+    Backend SQLite: các worker dùng chung một file nên cùng thấy lịch sử và /cache/clear có hiệu lực toàn cục
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, dim, max_items=DEFAULT_MAX_ITEMS, max_items_per_user=DEFAULT_MAX_ITEMS_PER_USER):
+        self.path = path
+        self.dim = dim
+        self.max_items = max_items
+        self.max_items_per_user = max_items_per_user
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connection = None
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversation_memory (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id     TEXT NOT NULL,
+                question    TEXT NOT NULL,
+                sql         TEXT NOT NULL,
+                embedding   BLOB NOT NULL,
+                result_blob BLOB NOT NULL,
+                num_results INTEGER NOT NULL,
+                last_used   REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_memory_user ON conversation_memory (user_id, last_used);
+            CREATE INDEX IF NOT EXISTS idx_memory_lru ON conversation_memory (last_used);
+        """)
+
+    @property
+    def _conn(self):
+        # Không dùng lại kết nối SQLite qua fork (gunicorn preload): mỗi process tự mở kết nối riêng
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def add(self, user_id, question, embedding, sql, results):
+        embedding_blob = _normalize(embedding).astype(np.float16).tobytes()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO conversation_memory "
+                "(user_id, question, sql, embedding, result_blob, num_results, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, question, sql, embedding_blob, compress_results(results), len(results), time.time())
+            )
+            # LRU theo user, sau đó theo toàn cục
+            self._conn.execute(
+                "DELETE FROM conversation_memory WHERE user_id = ? AND id NOT IN ("
+                "SELECT id FROM conversation_memory WHERE user_id = ? ORDER BY last_used DESC LIMIT ?)",
+                (user_id, user_id, self.max_items_per_user)
+            )
+            self._conn.execute(
+                "DELETE FROM conversation_memory WHERE id NOT IN ("
+                "SELECT id FROM conversation_memory ORDER BY last_used DESC LIMIT ?)",
+                (self.max_items,)
+            )
+
+    def find_similar(self, user_id, embedding, threshold, window=DEFAULT_SEARCH_WINDOW):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, question, sql, embedding FROM conversation_memory "
+                "WHERE user_id = ? ORDER BY last_used DESC LIMIT ?",
+                (user_id, window)
+            ).fetchall()
+            if not rows:
+                return None
+
+            matrix = np.frombuffer(b"".join(row[3] for row in rows), dtype=np.float16).reshape(len(rows), -1)
+            similarities = matrix.astype(np.float32) @ _normalize(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] <= threshold:
+                return None
+
+            entry_id, question, sql, _ = rows[best]
+            with self._conn:
+                self._conn.execute("UPDATE conversation_memory SET last_used = ? WHERE id = ?", (time.time(), entry_id))
+            (result_blob,) = self._conn.execute(
+                "SELECT result_blob FROM conversation_memory WHERE id = ?", (entry_id,)
+            ).fetchone()
+            return {
+                "question": question,
+                "sql": sql,
+                "result": decompress_results(result_blob),
+                "similarity": float(similarities[best])
+            }
+
+    def history(self, user_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT question, sql, num_results FROM conversation_memory WHERE user_id = ? ORDER BY last_used",
+                (user_id,)
+            ).fetchall()
+        return [{"question": question, "sql": sql, "num_results": num_results} for question, sql, num_results in rows]
+
+    def clear(self, user_id=None):
+        with self._lock, self._conn:
+            if user_id is None:
+                self._conn.execute("DELETE FROM conversation_memory")
+            else:
+                self._conn.execute("DELETE FROM conversation_memory WHERE user_id = ?", (user_id,))
+
+    def stats(self):
+        with self._lock:
+            entries, users, embedding_bytes, result_bytes, text_bytes = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT user_id), COALESCE(SUM(LENGTH(embedding)), 0), "
+                "COALESCE(SUM(LENGTH(result_blob)), 0), COALESCE(SUM(LENGTH(question) + LENGTH(sql)), 0) "
+                "FROM conversation_memory"
+            ).fetchone()
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "backend": self.backend,
+            "path": self.path,
+            "entries": entries,
+            "users": users,
+            "max_items": self.max_items,
+            "max_items_per_user": self.max_items_per_user,
+            "embedding_bytes": embedding_bytes,
+            "result_bytes": result_bytes,
+            "text_bytes": text_bytes,
+            "total_bytes": embedding_bytes + result_bytes + text_bytes,
+            "file_bytes": page_count * page_size
+        }
+
+
+def create_memory_store(settings, dim):
+    """
+    Tạo bộ nhớ hội thoại theo cấu hình [memory] trong config.ini
+    """
+    max_items = settings.get("max_items", DEFAULT_MAX_ITEMS)
+    max_items_per_user = settings.get("max_items_per_user", DEFAULT_MAX_ITEMS_PER_USER)
+    if settings.get("backend") == "sqlite":
+        return SQLiteConversationMemory(settings["path"], dim, max_items, max_items_per_user)
+    return ConversationMemory(dim, max_items, max_items_per_user)
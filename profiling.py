@@ -0,0 +1,390 @@
+"""
+Profile theo yêu cầu cho request đang chạy thật (không cần deploy lại).
+
+Admin "bật" profile cho N request tiếp theo và/hoặc một tỉ lệ request (sample_rate) của một số endpoint.
+Request được chọn sẽ:
+- có một thread lấy mẫu stack của thread xử lý request (sys._current_frames) mỗi interval_ms,
+  kết quả dạng folded stack (dùng cho flamegraph.pl / speedscope)
+- (tuỳ chọn) chụp tracemalloc lúc bắt đầu và kết thúc, báo cáo các dòng cấp phát tăng nhiều nhất
+
+Trạng thái "đang bật" nằm trong một file ở thư mục dùng chung, nên lệnh bật ở một worker gunicorn
+có hiệu lực cho mọi worker. Khi không bật, mỗi request chỉ tốn một phép so sánh thời gian;
+file trạng thái chỉ được stat lại mỗi check_interval giây.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from deadline import register_pool_hook
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá trong process (chạy 1 process)
+    fcntl = None
+
+DEFAULT_PATHS = ("/ask", "/ask/page", "/timesheet-daily", "/timesheet-daily/bulk", "/timesheet-daily-ai")
+DEFAULT_INTERVAL_MS = 5
+DEFAULT_CHECK_INTERVAL = 1.0
+DEFAULT_MAX_REPORTS = 50
+DEFAULT_ARM_TTL_SECONDS = 600
+DEFAULT_TRACEMALLOC_FRAMES = 10
+DEFAULT_TOP_ALLOCATIONS = 30
+
+STATE_FILE = "armed.json"
+LOCK_FILE = "armed.lock"
+REPORT_KINDS = {"folded": ".folded", "alloc": ".alloc.txt", "meta": ".json"}
+CAPTURE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Sampler của request đang được profile (theo context, đi theo request sang thread pool của deadline)
+_active_sampler = contextvars.ContextVar("profile_sampler", default=None)
+
+
+@contextmanager
+def track_current_thread():
+    """
+    Nếu request hiện tại đang được profile, lấy mẫu cả thread đang chạy khối with
+    (vd. lời gọi Gemini trong thread pool của deadline.run)
+    """
+    sampler = _active_sampler.get()
+    if sampler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    sampler.thread_ids.add(thread_id)
+    try:
+        yield
+    finally:
+        sampler.thread_ids.discard(thread_id)
+
+
+class StackSampler(threading.Thread):
+    """
+    Lấy mẫu stack của thread xử lý request (và các thread nó giao việc) theo chu kỳ,
+    gộp thành folded stack -> số mẫu
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.thread_ids = {thread_id}
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    def __init__(self, directory, interval_ms=DEFAULT_INTERVAL_MS, check_interval=DEFAULT_CHECK_INTERVAL,
+                 max_reports=DEFAULT_MAX_REPORTS, tracemalloc_frames=DEFAULT_TRACEMALLOC_FRAMES,
+                 top_allocations=DEFAULT_TOP_ALLOCATIONS):
+        self.directory = directory
+        self.reports_dir = os.path.join(directory, "reports")
+        self.state_path = os.path.join(directory, STATE_FILE)
+        self.lock_path = os.path.join(directory, LOCK_FILE)
+        self.interval_ms = interval_ms
+        self.check_interval = check_interval
+        self.max_reports = max_reports
+        self.tracemalloc_frames = tracemalloc_frames
+        self.top_allocations = top_allocations
+        os.makedirs(self.reports_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Cache trạng thái trong process: (mtime của file, nội dung), chỉ stat lại sau check_interval
+        self._state = None
+        self._state_mtime = None
+        self._next_check = 0.0
+        self._tracemalloc_users = 0
+        # tracemalloc do profiler bật (không tắt tracemalloc đã chạy sẵn, vd. PYTHONTRACEMALLOC)
+        self._started_tracemalloc = False
+
+    # ---- trạng thái dùng chung giữa các worker ----
+
+    def _locked(self):
+        return _FileLock(self.lock_path, self._lock)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_state(self, state):
+        if state is None:
+            try:
+                os.remove(self.state_path)
+            except FileNotFoundError:
+                pass
+            return
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _current_state(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return self._state
+        self._next_check = now + self.check_interval
+        try:
+            mtime = os.stat(self.state_path).st_mtime_ns
+        except FileNotFoundError:
+            self._state, self._state_mtime = None, None
+            return None
+        if mtime != self._state_mtime:
+            self._state, self._state_mtime = self._read_state(), mtime
+        return self._state
+
+    def arm(self, requests=1, sample_rate=1.0, paths=DEFAULT_PATHS, memory=False,
+            ttl_seconds=DEFAULT_ARM_TTL_SECONDS):
+        """
+        Bật profile cho `requests` request tiếp theo (None = không giới hạn số lượng đến khi hết TTL),
+        mỗi request khớp `paths` được chọn với xác suất sample_rate
+        """
+        state = {
+            "id": secrets.token_hex(4),
+            "remaining": requests,
+            "sample_rate": sample_rate,
+            "paths": list(paths),
+            "memory": memory,
+            "expires_at": time.time() + ttl_seconds,
+            "armed_at": time.time()
+        }
+        with self._locked():
+            self._write_state(state)
+        self._next_check = 0.0
+        return state
+
+    def disarm(self):
+        with self._locked():
+            self._write_state(None)
+        self._next_check = 0.0
+
+    def status(self):
+        state = self._read_state()
+        if state is not None and state["expires_at"] <= time.time():
+            state = None
+        return {"armed": state is not None, "state": state, "directory": self.directory}
+
+    def _claim(self, path):
+        """
+        Quyết định request có được profile hay không; giảm bộ đếm dùng chung nếu có
+        """
+        state = self._current_state()
+        if state is None or path not in state["paths"]:
+            return None
+        if state["expires_at"] <= time.time():
+            return None
+        if random.random() >= state["sample_rate"]:
+            return None
+        if state["remaining"] is None:
+            return state
+        with self._locked():
+            # Đọc lại dưới khoá: worker khác có thể vừa dùng hết lượt
+            state = self._read_state()
+            if state is None or state["expires_at"] <= time.time():
+                return None
+            if state["remaining"] is None:
+                return state
+            if state["remaining"] <= 0:
+                return None
+            state["remaining"] -= 1
+            self._write_state(state if state["remaining"] > 0 else None)
+        self._next_check = 0.0
+        return state
+
+    # ---- profile một request ----
+
+    def start(self, method, path):
+        """
+        Gọi đầu request; trả về capture (dict) nếu request này được profile, ngược lại None
+        """
+        state = self._claim(path)
+        if state is None:
+            return None
+        capture = {
+            "id": f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{secrets.token_hex(3)}",
+            "arm_id": state["id"],
+            "method": method,
+            "path": path,
+            "pid": os.getpid(),
+            "started_at": time.time(),
+            "start": time.perf_counter(),
+            "snapshot": None
+        }
+        if state["memory"]:
+            with self._lock:
+                if self._tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start(self.tracemalloc_frames)
+                    self._started_tracemalloc = True
+                self._tracemalloc_users += 1
+            capture["snapshot"] = tracemalloc.take_snapshot()
+        capture["sampler"] = StackSampler(threading.get_ident(), self.interval_ms / 1000)
+        capture["sampler"].start()
+        _active_sampler.set(capture["sampler"])
+        logging.info(f"Profiling {method} {path} (capture {capture['id']})")
+        return capture
+
+    def finish(self, capture, status_code=None):
+        """
+        Gọi cuối request: dừng lấy mẫu, ghi báo cáo vào thư mục reports
+        """
+        sampler = capture["sampler"]
+        sampler.stop()
+        _active_sampler.set(None)
+        duration_ms = (time.perf_counter() - capture["start"]) * 1000
+        base = os.path.join(self.reports_dir, capture["id"])
+        with open(base + REPORT_KINDS["folded"], "w", encoding="utf-8") as f:
+            f.write(sampler.folded())
+
+        has_alloc = capture["snapshot"] is not None
+        if has_alloc:
+            end_snapshot = tracemalloc.take_snapshot()
+            with self._lock:
+                self._tracemalloc_users -= 1
+                if self._tracemalloc_users == 0 and self._started_tracemalloc:
+                    tracemalloc.stop()
+                    self._started_tracemalloc = False
+            with open(base + REPORT_KINDS["alloc"], "w", encoding="utf-8") as f:
+                f.write(self._allocation_report(capture["snapshot"], end_snapshot))
+
+        meta = {
+            "id": capture["id"],
+            "arm_id": capture["arm_id"],
+            "method": capture["method"],
+            "path": capture["path"],
+            "pid": capture["pid"],
+            "status_code": status_code,
+            "started_at": capture["started_at"],
+            "duration_ms": round(duration_ms, 2),
+            "samples": sampler.samples,
+            "interval_ms": self.interval_ms,
+            "reports": ["folded", "alloc"] if has_alloc else ["folded"]
+        }
+        with open(base + REPORT_KINDS["meta"], "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self._prune_reports()
+        return meta
+
+    def _allocation_report(self, start_snapshot, end_snapshot):
+        ignore = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+        diffs = end_snapshot.filter_traces(ignore).compare_to(start_snapshot.filter_traces(ignore), "traceback")
+        lines = [
+            "# Cấp phát tăng thêm trong lúc xử lý request (toàn process, gồm cả thread khác đang chạy)",
+            f"# tổng tăng: {sum(diff.size_diff for diff in diffs) / 1024:.1f} KiB",
+            ""
+        ]
+        for diff in diffs[:self.top_allocations]:
+            lines.append(f"{diff.size_diff / 1024:+.1f} KiB ({diff.count_diff:+d} blocks), hiện tại {diff.size / 1024:.1f} KiB")
+            lines.extend(f"    {line}" for line in diff.traceback.format(most_recent_first=True))
+        return "\n".join(lines) + "\n"
+
+    # ---- báo cáo ----
+
+    def list_reports(self):
+        reports = []
+        for name in os.listdir(self.reports_dir):
+            if not name.endswith(REPORT_KINDS["meta"]):
+                continue
+            try:
+                with open(os.path.join(self.reports_dir, name), "r", encoding="utf-8") as f:
+                    reports.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(reports, key=lambda meta: meta["started_at"], reverse=True)
+
+    def report_path(self, capture_id, kind):
+        """
+        Đường dẫn file báo cáo; None nếu id / loại không hợp lệ hoặc file không tồn tại
+        """
+        if kind not in REPORT_KINDS or not CAPTURE_ID_PATTERN.match(capture_id):
+            return None
+        path = os.path.join(self.reports_dir, capture_id + REPORT_KINDS[kind])
+        return path if os.path.isfile(path) else None
+
+    def _prune_reports(self):
+        for meta in self.list_reports()[self.max_reports:]:
+            for suffix in REPORT_KINDS.values():
+                try:
+                    os.remove(os.path.join(self.reports_dir, meta["id"] + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+class _FileLock:
+    """
+    Khoá trong process + flock trên file (giữa các worker gunicorn)
+    """
+
+    def __init__(self, path, thread_lock):
+        self.path = path
+        self.thread_lock = thread_lock
+        self._file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self.thread_lock.release()
+
+
+def create_request_profiler(settings):
+    """
+    Tạo profiler theo [profiling] trong config.ini; None nếu chưa bật (không gắn hook nào vào request)
+    """
+    if not settings.get("enabled"):
+        return None
+    if not settings.get("admin_token"):
+        raise ValueError("[profiling] admin_token is required when profiling is enabled")
+    # Lấy mẫu cả thread pool của deadline.run khi request đang được profile
+    register_pool_hook(track_current_thread)
+    return RequestProfiler(
+        settings["dir"],
+        interval_ms=settings.get("interval_ms", DEFAULT_INTERVAL_MS),
+        check_interval=settings.get("check_interval", DEFAULT_CHECK_INTERVAL),
+        max_reports=settings.get("max_reports", DEFAULT_MAX_REPORTS),
+        tracemalloc_frames=settings.get("tracemalloc_frames", DEFAULT_TRACEMALLOC_FRAMES),
+        top_allocations=settings.get("top_allocations", DEFAULT_TOP_ALLOCATIONS)
+    )
@@ -0,0 +1,216 @@
+"""
+Handle kết quả truy vấn phía server cho phân trang.
+
+/ask lưu câu SQL đã được kiểm tra (is_safe_sql + validate_tables_in_sql) dưới một handle ngẫu nhiên,
+/ask/page dùng handle đó để lấy các trang tiếp theo bằng LIMIT/OFFSET mà không gọi lại Gemini.
+Client không bao giờ gửi SQL, chỉ gửi handle. Handle hết hạn sau TTL kể từ lần dùng cuối.
+
+- QueryHandleStore: lưu trong process (chỉ dùng khi chạy 1 worker)
+- SQLiteQueryHandleStore: các worker gunicorn dùng chung một file
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL_SECONDS = 1800
+DEFAULT_MAX_HANDLES = 10000
+# Cột thêm sau phiên bản đầu của bảng query_handles (migrate bằng ALTER TABLE)
+ADDED_COLUMNS = {"params": "TEXT", "end_offset": "INTEGER"}
+
+
+def new_handle_id():
+    return secrets.token_urlsafe(16)
+
+
+class QueryHandleStore:
+    """
+    Backend trong process, giới hạn số handle (LRU) và hết hạn theo TTL
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, max_handles=DEFAULT_MAX_HANDLES):
+        self.ttl_seconds = ttl_seconds
+        self.max_handles = max_handles
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purge_expired(self, now):
+        while self._handles:
+            handle_id, record = next(iter(self._handles.items()))
+            if record["expires_at"] > now:
+                break
+            del self._handles[handle_id]
+
+    def create(self, question, sql, page_size, next_offset, params=None, end_offset=None):
+        """
+        Lưu câu SQL (đã bỏ LIMIT cuối), tham số của nó và vị trí trang tiếp theo, trả về handle.
+        end_offset: vị trí dừng theo LIMIT cuối của câu SQL gốc (None = không giới hạn)
+        """
+        now = time.time()
+        handle_id = new_handle_id()
+        with self._lock:
+            self._purge_expired(now)
+            while len(self._handles) >= self.max_handles:
+                self._handles.popitem(last=False)
+            self._handles[handle_id] = {
+                "question": question,
+                "sql": sql,
+                "params": params,
+                "page_size": page_size,
+                "next_offset": next_offset,
+                "end_offset": end_offset,
+                "expires_at": now + self.ttl_seconds
+            }
+        return handle_id
+
+    def get(self, handle_id):
+        """
+        Trả về bản sao thông tin handle (và gia hạn TTL) hoặc None nếu không tồn tại / đã hết hạn
+        """
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            record = self._handles.get(handle_id)
+            if record is None:
+                return None
+            record["expires_at"] = now + self.ttl_seconds
+            # Thứ tự OrderedDict = thứ tự hết hạn
+            self._handles.move_to_end(handle_id)
+            return dict(record)
+
+    def advance(self, handle_id, next_offset):
+        with self._lock:
+            record = self._handles.get(handle_id)
+            if record is not None:
+                record["next_offset"] = next_offset
+
+    def stats(self):
+        with self._lock:
+            self._purge_expired(time.time())
+            return {
+                "backend": self.backend,
+                "handles": len(self._handles),
+                "max_handles": self.max_handles,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+
+class SQLiteQueryHandleStore:
+    """
+    Backend SQLite: trang tiếp theo có thể được xử lý bởi worker khác với worker đã tạo handle
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS, max_handles=DEFAULT_MAX_HANDLES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_handles = max_handles
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connection = None
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS query_handles (
+                handle_id   TEXT PRIMARY KEY,
+                question    TEXT NOT NULL,
+                sql         TEXT NOT NULL,
+                params      TEXT,
+                page_size   INTEGER NOT NULL,
+                next_offset INTEGER NOT NULL,
+                end_offset  INTEGER,
+                expires_at  REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_query_handles_expiry ON query_handles (expires_at);
+        """)
+        # File handle tạo từ bản cũ chưa có các cột thêm sau
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(query_handles)")}
+        with self._conn:
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE query_handles ADD COLUMN {column} {column_type}")
+
+    @property
+    def _conn(self):
+        # Không dùng lại kết nối SQLite qua fork (gunicorn preload): mỗi process tự mở kết nối riêng
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def create(self, question, sql, page_size, next_offset, params=None, end_offset=None):
+        now = time.time()
+        handle_id = new_handle_id()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM query_handles WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "INSERT INTO query_handles "
+                "(handle_id, question, sql, params, page_size, next_offset, end_offset, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (handle_id, question, sql, json.dumps(params) if params else None, page_size, next_offset,
+                 end_offset, now + self.ttl_seconds)
+            )
+            self._conn.execute(
+                "DELETE FROM query_handles WHERE handle_id NOT IN ("
+                "SELECT handle_id FROM query_handles ORDER BY expires_at DESC LIMIT ?)",
+                (self.max_handles,)
+            )
+        return handle_id
+
+    def get(self, handle_id):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT question, sql, params, page_size, next_offset, end_offset FROM query_handles "
+                "WHERE handle_id = ? AND expires_at > ?",
+                (handle_id, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE query_handles SET expires_at = ? WHERE handle_id = ?", (now + self.ttl_seconds, handle_id)
+            )
+        question, sql, params, page_size, next_offset, end_offset = row
+        return {
+            "question": question,
+            "sql": sql,
+            "params": json.loads(params) if params else None,
+            "page_size": page_size,
+            "next_offset": next_offset,
+            "end_offset": end_offset
+        }
+
+    def advance(self, handle_id, next_offset):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE query_handles SET next_offset = ? WHERE handle_id = ?", (next_offset, handle_id)
+            )
+
+    def stats(self):
+        with self._lock:
+            (handles,) = self._conn.execute(
+                "SELECT COUNT(*) FROM query_handles WHERE expires_at > ?", (time.time(),)
+            ).fetchone()
+        return {
+            "backend": self.backend,
+            "path": self.path,
+            "handles": handles,
+            "max_handles": self.max_handles,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+
+def create_query_handle_store(settings):
+    """
+    Tạo kho handle theo cấu hình [query_handles] trong config.ini
+    """
+    ttl_seconds = settings.get("ttl_seconds", DEFAULT_TTL_SECONDS)
+    max_handles = settings.get("max_handles", DEFAULT_MAX_HANDLES)
+    if settings.get("backend") == "sqlite":
+        return SQLiteQueryHandleStore(settings["path"], ttl_seconds, max_handles)
+    return QueryHandleStore(ttl_seconds, max_handles)
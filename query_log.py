@@ -0,0 +1,365 @@
+"""
+Nhật ký câu hỏi / SQL của /ask và cache câu hỏi -> SQL được làm nóng khi khởi động.
+
+- QueryLog: SQLite chỉ ghi thêm, mỗi request /ask thành công một dòng
+  (câu hỏi đã chuẩn hoá, bảng, SQL đã kiểm tra, phiên bản schema, thời gian từng bước)
+- QuestionSQLCache: câu hỏi -> SQL trong process. Khi khởi động, top-N câu hỏi thường gặp nhất
+  của phiên bản schema hiện tại được nạp lại (embedding tính sẵn một lần), nên sau mỗi lần deploy
+  các câu hỏi phổ biến không phải chờ Gemini sinh SQL
+- Báo cáo: câu hỏi nóng nhất, bước chậm nhất, phần traffic có thể phục vụ từ cache
+
+SQL do template intent sinh ra không được cache (đã chạy cục bộ, có tham số theo từng câu hỏi).
+Câu hỏi có khoảng thời gian ("tháng này", "tuần trước"...) cũng không được cache: SQL chứa ngày
+đã tính theo hôm nay, sang ngày khác dùng lại sẽ sai.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from answer_cache import normalize_question
+from intent_templates import extract_slots
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_WARM_TOP_N = 200
+DEFAULT_MAX_ENTRIES = 1000
+# 0 = chỉ dùng lại SQL của câu hỏi trùng khớp (sau chuẩn hoá)
+DEFAULT_SIMILARITY = 0
+DEFAULT_REPORT_WINDOW = 10000
+MAX_REPORT_LIMIT = 100
+MAX_REPORT_WINDOW = 100000
+
+NUMBER_PATTERN = re.compile(r"\d+")
+WORD_PATTERN = re.compile(r"\w+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def schema_version(schema_text):
+    """
+    Hash ngắn của schema (bỏ khác biệt khoảng trắng): SQL trong log chỉ dùng lại với đúng schema đã sinh ra nó
+    """
+    normalized = WHITESPACE_PATTERN.sub(" ", schema_text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+class StageTimer:
+    """
+    Đo thời gian (ms) từng bước của một request
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(self.timings.get(name, 0.0) + (time.perf_counter() - start) * 1000, 2)
+
+    def total_ms(self):
+        return round((time.perf_counter() - self._start) * 1000, 2)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class QueryLog:
+    """
+    Nhật ký SQLite chỉ ghi thêm, các worker gunicorn dùng chung một file
+    """
+
+    def __init__(self, path, retention_days=DEFAULT_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connection = None
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS query_log (
+                id             INTEGER PRIMARY KEY,
+                created_at     REAL NOT NULL,
+                question       TEXT NOT NULL,
+                normalized     TEXT NOT NULL,
+                tables         TEXT NOT NULL,
+                sql            TEXT NOT NULL,
+                schema_version TEXT NOT NULL,
+                source         TEXT NOT NULL,
+                timings        TEXT NOT NULL,
+                total_ms       REAL NOT NULL,
+                row_count      INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_query_log_question ON query_log (schema_version, normalized);
+            CREATE INDEX IF NOT EXISTS idx_query_log_created ON query_log (created_at);
+        """)
+
+    @property
+    def _conn(self):
+        # Không dùng lại kết nối SQLite qua fork (gunicorn preload): mỗi process tự mở kết nối riêng
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # Mất vài dòng log cuối khi mất điện chấp nhận được, đổi lại không fsync mỗi request
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def record(self, question, sql, tables, version, source, timings, total_ms, row_count):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO query_log (created_at, question, normalized, tables, sql, schema_version, source, "
+                "timings, total_ms, row_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), question, normalize_question(question), json.dumps(sorted(tables)), sql, version,
+                 source, json.dumps(timings), total_ms, row_count)
+            )
+
+    def prune(self):
+        """
+        Xoá các dòng cũ hơn retention_days (gọi khi khởi động), trả về số dòng đã xoá
+        """
+        if not self.retention_days:
+            return 0
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM query_log WHERE created_at < ?", (time.time() - self.retention_days * 86400,)
+            )
+        return cursor.rowcount
+
+    def top_questions(self, version, limit):
+        """
+        Các câu hỏi (đã chuẩn hoá) có SQL cache được, nhiều lượt nhất trước, kèm SQL của lượt gần nhất
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT q.normalized, q.hits, q.avg_ms, l.question, l.sql, l.tables FROM ("
+                "  SELECT normalized, COUNT(*) AS hits, AVG(total_ms) AS avg_ms, MAX(id) AS last_id FROM query_log"
+                "  WHERE schema_version = ? AND source != 'intent' GROUP BY normalized"
+                "  ORDER BY hits DESC, last_id DESC LIMIT ?"
+                ") q JOIN query_log l ON l.id = q.last_id ORDER BY q.hits DESC, q.last_id DESC",
+                (version, limit)
+            ).fetchall()
+        return [
+            {"normalized": normalized, "hits": hits, "avg_ms": round(avg_ms, 2), "question": question,
+             "sql": sql, "tables": json.loads(tables)}
+            for normalized, hits, avg_ms, question, sql, tables in rows
+        ]
+
+    def report(self, version, limit=20, window=DEFAULT_REPORT_WINDOW):
+        """
+        Báo cáo trên `window` request gần nhất của phiên bản schema hiện tại
+        """
+        with self._lock:
+            (total_entries,) = self._conn.execute("SELECT COUNT(*) FROM query_log").fetchone()
+            rows = self._conn.execute(
+                "SELECT normalized, source, timings, total_ms FROM query_log WHERE schema_version = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (version, window)
+            ).fetchall()
+
+        stage_values = {}
+        sources = {}
+        seen = set()
+        uncacheable = set()
+        eligible = 0
+        # Duyệt theo thứ tự thời gian: câu hỏi lặp lại (không phải intent, không có khoảng thời gian)
+        # là traffic cache được
+        for normalized, source, timings, total_ms in reversed(rows):
+            sources[source] = sources.get(source, 0) + 1
+            for stage, ms in json.loads(timings).items():
+                stage_values.setdefault(stage, []).append(ms)
+            stage_values.setdefault("total", []).append(total_ms)
+            if source == "intent" or normalized in uncacheable:
+                continue
+            if normalized in seen:
+                eligible += 1
+            elif _signature(normalized) is None:
+                uncacheable.add(normalized)
+                continue
+            seen.add(normalized)
+
+        stages = sorted(
+            (
+                {"stage": stage, "count": len(values), "avg_ms": round(sum(values) / len(values), 2),
+                 "p95_ms": round(_percentile(values, 0.95), 2), "max_ms": round(max(values), 2)}
+                for stage, values in stage_values.items()
+            ),
+            key=lambda item: item["avg_ms"],
+            reverse=True
+        )
+        requests = len(rows)
+        return {
+            "schema_version": version,
+            "total_entries": total_entries,
+            "window": requests,
+            "hottest_questions": self.top_questions(version, limit),
+            "slowest_stages": stages,
+            "traffic": {
+                "by_source": sources,
+                "cache_eligible": eligible,
+                "cache_eligible_rate": round(eligible / requests, 4) if requests else 0.0,
+                "served_from_sql_cache_rate": round(sources.get("sql_cache", 0) / requests, 4) if requests else 0.0
+            }
+        }
+
+
+def _signature(question):
+    """
+    Phần phải trùng khớp tuyệt đối khi dùng lại SQL của một câu hỏi khác:
+    slot (dự án, người), các con số và tập từ còn lại sau khi bỏ slot
+
+    :return: None nếu câu hỏi có khoảng thời gian (không cache được)
+    """
+    slots, _, masked = extract_slots(question)
+    if "period" in slots:
+        return None
+    return (json.dumps(slots, sort_keys=True), tuple(NUMBER_PATTERN.findall(question)),
+            frozenset(WORD_PATTERN.findall(normalize_question(masked))))
+
+
+class QuestionSQLCache:
+    """
+    Câu hỏi -> SQL đã kiểm tra, LRU trong process.
+    Tra theo câu hỏi chuẩn hoá; nếu có embedding model và similarity > 0 thì thêm câu gần giống
+    (cosine >= similarity, cùng slot / con số / tập từ ngoài slot)
+    """
+
+    def __init__(self, embedding_model=None, max_entries=DEFAULT_MAX_ENTRIES, similarity=DEFAULT_SIMILARITY):
+        self.embedding_model = embedding_model if similarity else None
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._entries = OrderedDict()   # normalized -> {"question", "sql", "tables", "signature", "embedding"}
+        self._matrix = None             # embedding của các mục theo thứ tự _entries, tạo lại khi cache đổi
+        self._keys = None
+        self._lock = threading.Lock()
+        self._stats = {"exact": 0, "similar": 0, "misses": 0, "warmed": 0}
+
+    def _encode(self, texts):
+        embeddings = np.asarray(self.embedding_model.encode(texts), dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+    def _put(self, question, sql, tables, embedding, signature):
+        key = normalize_question(question)
+        self._entries.pop(key, None)
+        self._entries[key] = {
+            "question": question,
+            "sql": sql,
+            "tables": sorted(tables),
+            "signature": signature,
+            "embedding": embedding
+        }
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def warm(self, entries):
+        """
+        Nạp các mục từ QueryLog.top_questions (nhiều lượt nhất trước), encode embedding theo một lô
+        """
+        cacheable, signatures = [], []
+        for entry in entries:
+            signature = _signature(entry["question"])
+            if signature is not None:
+                cacheable.append(entry)
+                signatures.append(signature)
+        entries = cacheable[:self.max_entries]
+        embeddings = self._encode([entry["question"] for entry in entries]) if self.embedding_model and entries else None
+        with self._lock:
+            # Nạp ngược để câu hỏi nhiều lượt nhất nằm cuối LRU (bị loại sau cùng)
+            for index in range(len(entries) - 1, -1, -1):
+                entry = entries[index]
+                self._put(entry["question"], entry["sql"], entry["tables"],
+                          embeddings[index] if embeddings is not None else None, signatures[index])
+            self._stats["warmed"] += len(entries)
+        return len(entries)
+
+    def lookup(self, question):
+        """
+        :return: (hit, embedding) với hit = {"sql", "tables", "question", "match", "score"} hoặc None;
+                 embedding (có thể None) được truyền lại cho add() để không encode lại
+        """
+        signature = _signature(question)
+        if signature is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None, None
+
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["signature"] == signature:
+                self._entries.move_to_end(key)
+                self._stats["exact"] += 1
+                return {"sql": entry["sql"], "tables": entry["tables"], "question": entry["question"],
+                        "match": "exact", "score": 1.0}, None
+            has_entries = bool(self._entries)
+
+        if self.embedding_model is None or not has_entries:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None, None
+
+        embedding = self._encode([question])[0]
+        with self._lock:
+            if self._matrix is None:
+                self._keys = [k for k, e in self._entries.items() if e["embedding"] is not None]
+                self._matrix = np.stack([self._entries[k]["embedding"] for k in self._keys]) if self._keys else None
+            if self._matrix is not None:
+                scores = self._matrix @ embedding
+                for index in np.argsort(-scores):
+                    if scores[index] < self.similarity:
+                        break
+                    entry = self._entries.get(self._keys[index])
+                    if entry is not None and entry["signature"] == signature:
+                        self._entries.move_to_end(self._keys[index])
+                        self._stats["similar"] += 1
+                        return {"sql": entry["sql"], "tables": entry["tables"], "question": entry["question"],
+                                "match": "similar", "score": round(float(scores[index]), 4)}, embedding
+            self._stats["misses"] += 1
+        return None, embedding
+
+    def add(self, question, sql, tables, embedding=None):
+        """
+        :return: False nếu câu hỏi không cache được (có khoảng thời gian)
+        """
+        signature = _signature(question)
+        if signature is None:
+            return False
+        if embedding is None and self.embedding_model is not None:
+            embedding = self._encode([question])[0]
+        with self._lock:
+            self._put(question, sql, tables, embedding, signature)
+        return True
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["exact"] + self._stats["similar"] + self._stats["misses"]
+            hits = self._stats["exact"] + self._stats["similar"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity": self.similarity,
+                **self._stats,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "pid": os.getpid()
+            }
+
+
+def create_query_log(settings):
+    """
+    Tạo nhật ký theo [query_log] trong config.ini; None nếu tắt
+    """
+    if not settings.get("enabled"):
+        return None
+    return QueryLog(settings["path"], settings.get("retention_days", DEFAULT_RETENTION_DAYS))
@@ -0,0 +1,242 @@
+"""
+ETL hàng loạt cho file export báo cáo hằng ngày (data_daily_reports.xlsx).
+
+Dùng cùng parser với API (report_parser), thay cho các hàm regex riêng trong notebook cleanData:
+- đọc file theo chunk (openpyxl read-only / pandas chunksize) nên xử lý được export nhiều năm
+- Actual / Plan / Next Plan lấy từ report_parser.parse_section_texts (cùng kết quả với parse_report),
+  Member bằng report_parser.extract_member
+- các chunk được xử lý song song trên nhiều core
+- chạy incremental: chỉ xử lý các ngày chưa có trong output
+
+Cách dùng:
+    python report_etl.py data_daily_reports.xlsx --output daily_reports_clean.csv
+    python report_etl.py data_daily_reports.xlsx --output daily_reports.sqlite   # ReportStore
+"""
+import argparse
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from report_parser import parse_section_texts, extract_member
+
+DATE_COLUMN = "Date Report (mm/dd/yyyy)"
+CONTENT_COLUMN = "Content"
+OUTPUT_COLUMNS = ["Date Report", "Member", "Content", "Actual", "Plan", "Next Plan"]
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Cột output -> section của report_parser.parse_report
+SECTION_COLUMNS = {"Actual": "actual", "Plan": "plan", "Next Plan": "next_plan"}
+
+
+def extract_members(contents):
+    """
+    Cột Member bằng report_parser.extract_member (nhanh hơn ghép nhiều Series.str.extract:
+    .str của pandas cũng lặp từng dòng, mỗi pattern một lượt)
+    """
+    return contents.map(extract_member)
+
+
+def extract_sections(contents):
+    """
+    Các cột Actual / Plan / Next Plan cho cả Series bằng report_parser.parse_section_texts
+    (cùng kết quả với parse_report, chỉ dòng ứng viên header mới chạy regex từng dòng)
+
+    :return: dict cột -> Series (None nếu báo cáo không có section đó)
+    """
+    parsed = [parse_section_texts(content) for content in contents]
+    return {
+        column: pd.Series([report[section] for report in parsed], index=contents.index, dtype="object")
+        for column, section in SECTION_COLUMNS.items()
+    }
+
+
+def transform_chunk(chunk, skip_dates=None):
+    """
+    Làm sạch một chunk dữ liệu thô.
+
+    :param chunk: DataFrame có cột DATE_COLUMN và CONTENT_COLUMN
+    :param skip_dates: tập ngày (yyyy-mm-dd) đã xử lý, các dòng thuộc ngày này bị bỏ qua
+    :return: DataFrame với các cột OUTPUT_COLUMNS
+    """
+    dates = pd.to_datetime(chunk[DATE_COLUMN], errors="coerce")
+    if skip_dates:
+        # Dòng không đọc được ngày đã được ghi ở lần chạy đầu tiên
+        keep = dates.notna() & ~dates.dt.strftime("%Y-%m-%d").isin(skip_dates)
+        chunk, dates = chunk[keep], dates[keep]
+
+    contents = chunk[CONTENT_COLUMN].where(chunk[CONTENT_COLUMN].notna(), "").astype(str)
+
+    return pd.DataFrame({
+        "Date Report": dates,
+        "Member": extract_members(contents),
+        "Content": chunk[CONTENT_COLUMN],
+        **extract_sections(contents),
+    }, columns=OUTPUT_COLUMNS)
+
+
+def iter_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Đọc file export theo từng chunk DataFrame mà không nạp toàn bộ file vào bộ nhớ.
+    Hỗ trợ .xlsx (openpyxl read-only) và .csv.
+    """
+    if path.lower().endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=header)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header)
+    finally:
+        workbook.close()
+
+
+_worker_skip_dates = None
+
+
+def _init_worker(skip_dates):
+    global _worker_skip_dates
+    _worker_skip_dates = skip_dates
+
+
+def _transform_in_worker(chunk):
+    return transform_chunk(chunk, _worker_skip_dates)
+
+
+def iter_transformed(chunks, workers=None, skip_dates=None):
+    """
+    Xử lý các chunk song song, trả kết quả theo đúng thứ tự đọc.
+    Chỉ giữ tối đa 2 chunk / worker đang xử lý để bộ nhớ không tăng theo kích thước file.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for chunk in chunks:
+            yield transform_chunk(chunk, skip_dates)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(skip_dates,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_transform_in_worker, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+STORE_EXTENSIONS = (".sqlite", ".db")
+
+
+def _state_path(output_path):
+    return output_path + ".state.json"
+
+
+class CsvSink:
+    """
+    Ghi nối tiếp ra file CSV; danh sách ngày đã xử lý lưu ở file <output>.state.json
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.write_header = not os.path.exists(path)
+        self.new_dates = set()
+
+    def processed_dates(self):
+        try:
+            with open(_state_path(self.path), "r", encoding="utf-8") as f:
+                return set(json.load(f).get("processed_dates", []))
+        except FileNotFoundError:
+            return set()
+
+    def write(self, frame):
+        frame = frame.assign(**{"Date Report": frame["Date Report"].dt.strftime("%Y-%m-%d")})
+        frame.to_csv(self.path, mode="a", header=self.write_header, index=False, encoding="utf-8")
+        self.write_header = False
+        self.new_dates.update(frame["Date Report"].dropna())
+        return len(frame)
+
+    def close(self):
+        # Chỉ ghi state sau khi toàn bộ dữ liệu đã được ghi ra output
+        dates = self.processed_dates() | self.new_dates
+        with open(_state_path(self.path), "w", encoding="utf-8") as f:
+            json.dump({"processed_dates": sorted(dates)}, f)
+
+
+def open_sink(output_path, full_refresh=False):
+    """
+    Output .sqlite/.db ghi vào ReportStore (index theo member/ngày), còn lại ghi CSV
+    """
+    if full_refresh:
+        for path in (output_path, _state_path(output_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    if output_path.lower().endswith(STORE_EXTENSIONS):
+        from report_store import ReportStore
+        return ReportStore(output_path)
+    return CsvSink(output_path)
+
+
+def run_etl(source_path, output_path, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, full_refresh=False):
+    """
+    Chạy ETL từ file export sang output đã làm sạch (CSV ghi nối tiếp hoặc ReportStore SQLite).
+
+    Returns:
+        Dict thống kê {"rows_written", "new_dates", "skipped_dates"}
+    """
+    sink = open_sink(output_path, full_refresh)
+    processed_dates = sink.processed_dates()
+    new_dates = set()
+    rows_written = 0
+
+    try:
+        for cleaned in iter_transformed(iter_chunks(source_path, chunk_size), workers, processed_dates):
+            if cleaned.empty:
+                continue
+            rows_written += sink.write(cleaned)
+            new_dates.update(cleaned["Date Report"].dropna().dt.strftime("%Y-%m-%d"))
+    finally:
+        sink.close()
+
+    logging.info(f"ETL done: {rows_written} rows, {len(new_dates)} new dates")
+    return {
+        "rows_written": rows_written,
+        "new_dates": len(new_dates),
+        "skipped_dates": len(processed_dates)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ETL báo cáo hằng ngày")
+    parser.add_argument("source", help="File export (.xlsx hoặc .csv)")
+    parser.add_argument("--output", default="daily_reports_clean.csv",
+                        help="File output: .csv hoặc .sqlite/.db (ReportStore)")
+    parser.add_argument("--workers", type=int, default=None, help="Số process (mặc định: số CPU)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--full-refresh", action="store_true", help="Xử lý lại toàn bộ thay vì incremental")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    stats = run_etl(args.source, args.output, args.workers, args.chunk_size, args.full_refresh)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Parser dùng chung cho báo cáo hằng ngày (API /timesheet-daily và notebook cleanData).
+
+Báo cáo được đọc từng dòng một lần duy nhất bằng một state machine:
+dòng header (■■ Actual ■■, Today(Actual - Thực tế), Next plan, Dự định, ■本日の業務, ISSUE...)
+chuyển trạng thái sang section tương ứng, các dòng còn lại được gom vào section hiện tại
+và tách thành record project ("■ ProjectName - 4h") / task ("+ Task description").
+"""
+import re
+from functools import lru_cache
+
+SECTIONS = ("actual", "plan", "next_plan", "issue")
+
+_WS = r"[\s　 ]"
+
+# Dòng header có khung ■■ ... ■■ (hoặc kết thúc bằng ■■)
+BOXED_HEADER_PATTERN = re.compile(r"■{2,}")
+# Header không có khung
+PLAIN_HEADER_PATTERN = re.compile(
+    rf"^{_WS}*(?:■本日の業務|(?:Yesterday|Hôm qua|Daily plan|Plan for|Tomorrow|Kế hoạch)\b"
+    rf"|(?:Next plan|Dự định ngày tiếp theo){_WS}*[:：]?{_WS}*$)",
+    re.IGNORECASE
+)
+# Dòng phân cách: toàn ■ hoặc - = _
+SEPARATOR_PATTERN = re.compile(rf"^{_WS}*(?:■{{3,}}|[-=_]{{3,}}){_WS}*$")
+
+# Phân loại header theo thứ tự ưu tiên (pattern, section, là fallback)
+HEADER_RULES = (
+    (re.compile(r"issue", re.IGNORECASE), "issue", False),
+    (re.compile(r"next\s*plan|tomorrow", re.IGNORECASE), "next_plan", False),
+    (re.compile(r"actual|thực\s*tế", re.IGNORECASE), "actual", False),
+    (re.compile(r"yesterday|hôm qua", re.IGNORECASE), "actual", True),
+    (re.compile(rf"(?:^|■){_WS}*(?:Today{_WS}*[（(]{_WS}*)?plan{_WS}*-{_WS}*dự{_WS}*định", re.IGNORECASE), "plan", False),
+    (re.compile(r"dự\s*định", re.IGNORECASE), "next_plan", False),
+    (re.compile(r"plan|kế\s*hoạch|本日の業務", re.IGNORECASE), "plan", False),
+)
+
+# "■ ProjectName - 4h" / "■ ProjectName - 2.5h"
+PROJECT_PATTERN = re.compile(r"^\s*■\s*([^-■]+?)\s*-\s*(\d+(?:\.\d+)?)\s*h", re.IGNORECASE)
+# "■ ProjectName" (không có effort)
+PROJECT_NO_EFFORT_PATTERN = re.compile(r"^\s*■\s*([^■]+?)\s*$")
+# "+ Task description"
+TASK_PATTERN = re.compile(r"^\s*\+\s*(.+)")
+
+REPORT_DATE_PATTERN = re.compile(r"(\d{4})[/-](\d{1,2})[/-](\d{1,2})")
+
+_NAME_CHARS = "A-ZÀ-Ỹà-ỹ"
+# ■ TRAN VAN DANG - 2025/05/15
+MEMBER_DASH_PATTERN = re.compile(rf"^■\s*([{_NAME_CHARS}\s]+?)\s*[-–]")
+# Hồ Huỳnh Lâm (dòng đầu tiên, không có ■)
+MEMBER_FIRST_LINE_PATTERN = re.compile(rf"^[{_NAME_CHARS}a-z\s]+$")
+# #### 2025/05/15 TRAN VAN SU  8:00 - 17:20
+MEMBER_HASH_PATTERN = re.compile(rf"####\s*\d{{4}}/\d{{2}}/\d{{2}}\s+([{_NAME_CHARS}\s]+?)(?:\s+\d|$)")
+# ■ 05/15 PHAM LONG DINH hoặc ■ LÊ NGUYÊN TRANG
+MEMBER_PLAIN_PATTERN = re.compile(rf"^■\s*(?:\d{{2}}/\d{{2}}\s+)?([{_NAME_CHARS}\s]+?)(?:\n|$)")
+DIGITS_PATTERN = re.compile(r"\d+")
+SHORT_DATE_PATTERN = re.compile(r"\d{2}/\d{2}")
+
+_STRIP_CHARS = " \n\r\t:-　 "
+
+# Dòng có thể là header / dòng phân cách (tập cha của classify_header + SEPARATOR_PATTERN), tìm trên cả báo cáo
+# trong một lần quét để các dòng nội dung không phải chạy regex từng dòng
+BOUNDARY_CANDIDATE_PATTERN = re.compile(
+    r"^(?:[^\n]*■[^\n]*"
+    r"|[^\S\n]*(?:Yesterday|Hôm qua|Daily plan|Plan for|Tomorrow|Kế hoạch|Next plan|Dự định ngày tiếp theo)[^\n]*"
+    r"|[^\S\n]*[-=_]{3,}[^\S\n]*)$",
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+# Header của cùng một mẫu báo cáo lặp lại rất nhiều (ETL hàng chục nghìn báo cáo)
+@lru_cache(maxsize=4096)
+def classify_header(line):
+    """
+    Xác định dòng có phải header section không.
+
+    Returns:
+        (section, is_fallback, phần nội dung còn lại trên cùng dòng) hoặc None.
+        Dòng có khung ■■ nhưng không nhận ra section trả về section None (kết thúc section hiện tại).
+    """
+    boxed = BOXED_HEADER_PATTERN.search(line)
+    if not boxed and not PLAIN_HEADER_PATTERN.match(line):
+        return None
+
+    for pattern, section, is_fallback in HEADER_RULES:
+        if pattern.search(line):
+            # Nội dung nằm sau khung ■■ cuối cùng của header (nếu có)
+            rest = line.rsplit("■", 1)[-1] if boxed else ""
+            if not boxed and "本日の業務" in line:
+                rest = line.split("本日の業務", 1)[-1]
+            return section, is_fallback, rest.strip(_STRIP_CHARS)
+    return (None, False, "") if boxed else None
+
+
+def _new_section():
+    return {"lines": [], "projects": [], "tasks": []}
+
+
+def _parse_effort(value):
+    return float(value) if "." in value else int(value)
+
+
+def parse_report(report_text):
+    """
+    Parse toàn bộ báo cáo trong một lượt duyệt tuyến tính.
+
+    Returns:
+        {
+            "actual" | "plan" | "next_plan" | "issue": {
+                "text": nội dung section (None nếu không có),
+                "projects": [{"project_name", "effort", "tasks"}],
+                "tasks": task không thuộc project nào
+            }
+        }
+    """
+    primary = {}
+    fallback = {}
+    current = None
+
+    if isinstance(report_text, str):
+        for line in report_text.splitlines():
+            header = classify_header(line)
+            if header:
+                section, is_fallback, rest = header
+                if section is None:
+                    current = None
+                    continue
+                target = fallback if is_fallback else primary
+                # Section lặp lại: giữ lần xuất hiện đầu tiên
+                if section in target:
+                    current = None
+                else:
+                    current = target[section] = _new_section()
+                    if rest:
+                        line = rest
+                    else:
+                        continue
+            elif SEPARATOR_PATTERN.match(line):
+                current = None
+                continue
+
+            if current is None:
+                continue
+
+            current["lines"].append(line)
+
+            project_match = PROJECT_PATTERN.match(line)
+            if project_match:
+                current["projects"].append({
+                    "project_name": project_match.group(1).strip(),
+                    "effort": _parse_effort(project_match.group(2)),
+                    "tasks": []
+                })
+                continue
+
+            task_match = TASK_PATTERN.match(line)
+            if task_match:
+                task = task_match.group(1).strip()
+                if current["projects"]:
+                    current["projects"][-1]["tasks"].append(task)
+                else:
+                    current["tasks"].append(task)
+                continue
+
+            no_effort_match = PROJECT_NO_EFFORT_PATTERN.match(line)
+            if no_effort_match:
+                current["projects"].append({
+                    "project_name": no_effort_match.group(1).strip(),
+                    "effort": None,
+                    "tasks": []
+                })
+
+    result = {}
+    for section in SECTIONS:
+        data = primary.get(section)
+        if not (data and data["lines"]) and section in fallback:
+            data = fallback[section]
+        data = data or _new_section()
+        text = "\n".join(line for line in data["lines"] if line.strip()).strip(_STRIP_CHARS)
+        result[section] = {
+            "text": text or None,
+            "projects": data["projects"],
+            "tasks": data["tasks"]
+        }
+    return result
+
+
+def _section_text(lines):
+    return "\n".join(line for line in lines if line.strip()).strip(_STRIP_CHARS) or None
+
+
+def parse_section_texts(report_text):
+    """
+    Chỉ lấy text của từng section, cùng kết quả với parse_report(report_text)[section]["text"]
+    nhưng không tách project / task. Chỉ các dòng ứng viên header mới qua classify_header,
+    phần nội dung giữa hai header được cắt nguyên khối (dùng cho ETL nhiều báo cáo).
+
+    Returns:
+        {"actual" | "plan" | "next_plan" | "issue": text hoặc None}
+    """
+    primary = {}
+    fallback = {}
+    current = None
+
+    if isinstance(report_text, str):
+        text = "\n".join(report_text.splitlines())
+        position = 0
+        for candidate in BOUNDARY_CANDIDATE_PATTERN.finditer(text):
+            if current is not None and candidate.start() > position:
+                current.extend(text[position:candidate.start() - 1].split("\n"))
+            position = candidate.end() + 1
+            line = candidate.group()
+
+            header = classify_header(line)
+            if header:
+                section, is_fallback, rest = header
+                if section is None:
+                    current = None
+                    continue
+                target = fallback if is_fallback else primary
+                # Section lặp lại: giữ lần xuất hiện đầu tiên
+                if section in target:
+                    current = None
+                else:
+                    current = target[section] = []
+                    if rest:
+                        current.append(rest)
+            elif SEPARATOR_PATTERN.match(line):
+                current = None
+            elif current is not None:
+                current.append(line)
+        if current is not None and position <= len(text):
+            current.extend(text[position:].split("\n"))
+
+    result = {}
+    for section in SECTIONS:
+        lines = primary.get(section)
+        if not lines and section in fallback:
+            lines = fallback[section]
+        result[section] = _section_text(lines or [])
+    return result
+
+
+def extract_section(report_text, section):
+    """
+    Lấy nội dung text của một section ("actual", "plan", "next_plan", "issue")
+    """
+    return parse_report(report_text)[section]["text"]
+
+
+def extract_efforts(report_text):
+    """
+    Lấy danh sách effort theo project trong phần Actual:
+    [{"project_name", "effort", "tasks"}], chỉ gồm project có ghi effort
+    """
+    projects = parse_report(report_text)["actual"]["projects"]
+    return [project for project in projects if project["effort"] is not None]
+
+
+def extract_member(report_text):
+    """
+    Lấy tên thành viên từ nội dung báo cáo
+    """
+    content = str(report_text).strip()
+
+    match = MEMBER_DASH_PATTERN.search(content)
+    if match:
+        return DIGITS_PATTERN.sub("", match.group(1)).strip()
+
+    first_line = content.split("\n", 1)[0].strip()
+    if not first_line.startswith("■") and not first_line.startswith("####"):
+        if MEMBER_FIRST_LINE_PATTERN.match(first_line) and len(first_line.split()) >= 2:
+            return first_line
+
+    match = MEMBER_HASH_PATTERN.search(content)
+    if match:
+        return match.group(1).strip()
+
+    match = MEMBER_PLAIN_PATTERN.search(content)
+    if match:
+        return SHORT_DATE_PATTERN.sub("", match.group(1)).strip()
+
+    return ""
+
+
+def extract_report_date(report_text):
+    """
+    Lấy ngày hợp lệ đầu tiên trong báo cáo, chuẩn hoá về yyyy-mm-dd (hoặc "" nếu không có)
+    """
+    for year, month, day in REPORT_DATE_PATTERN.findall(report_text or ""):
+        if 1 <= int(month) <= 12 and 1 <= int(day) <= 31:
+            return f"{year}-{int(month):02d}-{int(day):02d}"
+    return ""
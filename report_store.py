@@ -0,0 +1,127 @@
+"""
+Kho lưu báo cáo hằng ngày đã làm sạch (SQLite), khoá theo (member, ngày báo cáo).
+
+Dữ liệu được đánh index theo (năm, tháng, member) nên các thống kê cuối tháng chỉ đọc
+đúng các dòng của tháng đó và đúng các cột cần thiết, thay vì lọc lại toàn bộ DataFrame
+hoặc parse lại file Excel.
+"""
+import logging
+import sqlite3
+
+import pandas as pd
+
+# Cột DataFrame (theo report_etl) -> cột trong bảng
+COLUMN_MAP = {
+    "Date Report": "report_date",
+    "Member": "member",
+    "Content": "content",
+    "Actual": "actual",
+    "Plan": "plan",
+    "Next Plan": "next_plan",
+}
+SECTION_COLUMNS = ("Content", "Actual", "Plan", "Next Plan")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    member      TEXT NOT NULL,
+    report_date TEXT NOT NULL,
+    year        INTEGER NOT NULL,
+    month       INTEGER NOT NULL,
+    content     TEXT,
+    actual      TEXT,
+    plan        TEXT,
+    next_plan   TEXT,
+    PRIMARY KEY (member, report_date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_reports_month ON reports (year, month, member);
+CREATE INDEX IF NOT EXISTS idx_reports_date ON reports (report_date);
+"""
+
+
+class ReportStore:
+    """
+    Lưu và truy vấn báo cáo theo tháng / thành viên
+    """
+
+    def __init__(self, path="daily_reports.sqlite"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def processed_dates(self):
+        """
+        Tập ngày (yyyy-mm-dd) đã có trong kho, dùng cho ETL incremental
+        """
+        return {row[0] for row in self.conn.execute("SELECT DISTINCT report_date FROM reports")}
+
+    def write(self, frame):
+        """
+        Ghi (upsert) một DataFrame theo định dạng output của report_etl.
+        Báo cáo không xác định được member bị bỏ qua (khoá là member + ngày, ghi vào sẽ đè lên nhau)
+        """
+        frame = frame.dropna(subset=["Date Report"])
+        members = frame["Member"].fillna("").astype(str).str.strip()
+        unknown = members == ""
+        if unknown.any():
+            logging.warning(f"ReportStore: bỏ qua {int(unknown.sum())} báo cáo không xác định được member")
+            frame, members = frame[~unknown], members[~unknown]
+        if frame.empty:
+            return 0
+
+        dates = pd.to_datetime(frame["Date Report"])
+        rows = zip(
+            members,
+            dates.dt.strftime("%Y-%m-%d"),
+            dates.dt.year,
+            dates.dt.month,
+            *(frame[column].astype(object).where(frame[column].notna(), None) for column in SECTION_COLUMNS)
+        )
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO reports "
+                "(member, report_date, year, month, content, actual, plan, next_plan) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((member, day, int(year), int(month), *sections) for member, day, year, month, *sections in rows)
+            )
+        return len(frame)
+
+    def monthly_report_counts(self, year, month):
+        """
+        Số ngày có báo cáo của từng thành viên trong tháng
+
+        :return: DataFrame cột ["Member", "Total days report"]
+        """
+        return pd.read_sql_query(
+            "SELECT member AS \"Member\", COUNT(*) AS \"Total days report\" FROM reports "
+            "WHERE year = ? AND month = ? GROUP BY member ORDER BY member",
+            self.conn,
+            params=(year, month)
+        )
+
+    def monthly_summary(self, year, month, sections=SECTION_COLUMNS, member=None):
+        """
+        Báo cáo trong tháng, chỉ đọc các cột section cần thiết
+
+        :param sections: các cột cần lấy trong SECTION_COLUMNS
+        :param member: lọc theo một thành viên (tuỳ chọn)
+        :return: DataFrame cột ["Date Report", "Member", *sections], sắp theo member, ngày
+        """
+        unknown = set(sections) - set(SECTION_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown section columns: {', '.join(sorted(unknown))}")
+
+        selected = ", ".join(f'{COLUMN_MAP[column]} AS "{column}"' for column in sections)
+        query = (
+            f'SELECT report_date AS "Date Report", member AS "Member"{", " + selected if selected else ""} '
+            "FROM reports WHERE year = ? AND month = ?"
+        )
+        params = [year, month]
+        if member is not None:
+            query += " AND member = ?"
+            params.append(member)
+        query += " ORDER BY member, report_date"
+        return pd.read_sql_query(query, self.conn, params=params)
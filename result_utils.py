@@ -0,0 +1,150 @@
+"""
+Chuyển kết quả MySQL thành JSON với chi phí thấp.
+
+- Fetch tuple + một danh sách cột thay vì cursor(dictionary=True) (một dict cho mỗi dòng)
+- Chọn hàm chuyển kiểu cho từng cột một lần (Decimal, datetime, date, time, bytes, set),
+  sau đó chuyển trong một lượt, chỉ ở các cột cần chuyển
+- Serialize bằng orjson nếu có cài, không thì json chuẩn với separators gọn
+- Dạng gọn {"columns": [...], "rows": [[...]]} và serialize theo từng lô để stream
+"""
+import datetime
+import decimal
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson là tuỳ chọn
+    orjson = None
+
+RESULT_FORMATS = ("records", "compact")
+STREAM_BATCH_SIZE = 500
+
+
+def _convert_decimal(value):
+    return None if value is None else float(value)
+
+
+def _convert_isoformat(value):
+    return None if value is None else value.isoformat()
+
+
+def _convert_str(value):
+    return None if value is None else str(value)
+
+
+def _convert_bytes(value):
+    return None if value is None else bytes(value).decode("utf-8", errors="replace")
+
+
+def _convert_set(value):
+    return None if value is None else sorted(value)
+
+
+def _converter_for(value):
+    if isinstance(value, decimal.Decimal):
+        return _convert_decimal
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return _convert_isoformat
+    if isinstance(value, datetime.timedelta):
+        # Cột TIME của MySQL trả về timedelta
+        return _convert_str
+    if isinstance(value, (bytes, bytearray)):
+        return _convert_bytes
+    if isinstance(value, set):
+        return _convert_set
+    return None
+
+
+def build_converters(rows, column_count):
+    """
+    Chọn hàm chuyển kiểu cho từng cột theo giá trị khác None đầu tiên của cột
+
+    :return: [(index cột, hàm chuyển)] chỉ gồm các cột cần chuyển
+    """
+    converters = {}
+    pending = set(range(column_count))
+    for row in rows:
+        for index in list(pending):
+            value = row[index]
+            if value is not None:
+                pending.discard(index)
+                converter = _converter_for(value)
+                if converter:
+                    converters[index] = converter
+        if not pending:
+            break
+    return sorted(converters.items())
+
+
+def convert_rows(rows, converters):
+    """
+    Chuyển kiểu trong một lượt; không có cột nào cần chuyển thì chỉ đổi tuple -> list
+    """
+    if not converters:
+        return [list(row) for row in rows]
+    converted = []
+    for row in rows:
+        row = list(row)
+        for index, converter in converters:
+            row[index] = converter(row[index])
+        converted.append(row)
+    return converted
+
+
+def fetch_result(cursor, limit=None):
+    """
+    Lấy kết quả từ cursor thường (không dictionary)
+
+    :return: (columns, rows) với rows là list các list đã chuyển kiểu, sẵn sàng serialize
+    """
+    columns = list(cursor.column_names)
+    rows = cursor.fetchall() if limit is None else cursor.fetchmany(limit)
+    return columns, convert_rows(rows, build_converters(rows, len(columns)))
+
+
+def to_records(columns, rows):
+    """
+    Dạng cũ của "results": một dict cho mỗi dòng
+    """
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def _default(value):
+    converter = _converter_for(value)
+    return converter(value) if converter else str(value)
+
+
+def dumps(obj):
+    """
+    Serialize thành bytes JSON (UTF-8), giá trị lạ được chuyển như fetch_result
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def iter_compact_json(columns, batches, trailer=None):
+    """
+    Stream {"columns": [...], "rows": [[...], ...], ...trailer} theo từng lô, không dựng toàn bộ payload trong bộ nhớ
+
+    :param batches: iterable các lô dòng thô (tuple) từ cursor.fetchmany
+    :param trailer: hàm trả về dict các key thêm vào cuối object (gọi sau khi stream hết dòng)
+    """
+    yield b'{"columns":' + dumps(columns) + b',"rows":['
+    converters = None
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        if converters is None:
+            converters = build_converters(batch, len(columns))
+        body = dumps(convert_rows(batch, converters))[1:-1]
+        if not body:
+            continue
+        yield body if first else b"," + body
+        first = False
+    yield b"]"
+    extra = trailer() if trailer else {}
+    for key, value in extra.items():
+        yield b"," + dumps(key) + b":" + dumps(value)
+    yield b"}"
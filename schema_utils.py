@@ -67,3 +67,50 @@ def extract_possible_table_names(question, all_tables):
     """
     lower_question = question.lower()
     return [table for table in all_tables if table.lower() in lower_question]
+
+TABLE_HEADER_PATTERN = re.compile(r"^Table\s+([a-zA-Z0-9_]+)")
+COLUMN_LINE_PATTERN = re.compile(r"^\s*[-*]?\s*[`\"']?([A-Za-z_][A-Za-z0-9_]*)[`\"']?(?:[\s:,(]|$)")
+KEY_COLUMN_PATTERN = re.compile(r"\bpk\b|primary\s+key|\bref\s*:|references|foreign\s+key", re.IGNORECASE)
+REF_TARGET_PATTERN = re.compile(r"(?:\bref\s*:\s*[<>-]\s*|references\s+)[`\"']?([A-Za-z0-9_]+)", re.IGNORECASE)
+NON_COLUMN_WORDS = {"indexes", "note", "ref", "table", "enum"}
+
+def parse_schema_tables(schema_text):
+    """
+    Tách schema thành từng bảng và từng cột để có thể lọc ở mức cột.
+
+    Hỗ trợ dạng "Table name {" ... "}" (mỗi dòng một cột) và dạng không có ngoặc.
+    Các dòng không phải cột (ngoặc, Indexes, Note, ...) được giữ nguyên.
+
+    :return: (preamble, [{"name", "lines": [{"text", "column", "is_key", "refs"}]}])
+             với "column" = None nếu dòng không phải cột
+    """
+    preamble = []
+    tables = []
+    depth = 0
+    for line in schema_text.splitlines():
+        header = TABLE_HEADER_PATTERN.match(line)
+        if header:
+            tables.append({"name": header.group(1), "header": line, "lines": []})
+            depth = line.count("{") - line.count("}")
+            continue
+        if not tables:
+            preamble.append(line)
+            continue
+
+        column = None
+        match = COLUMN_LINE_PATTERN.match(line)
+        # Chỉ dòng ở cấp 1 (ngay trong ngoặc của bảng, hoặc bảng không dùng ngoặc) mới là cột
+        if match and depth <= 1 and "{" not in line and match.group(1).lower() not in NON_COLUMN_WORDS:
+            column = match.group(1)
+        depth += line.count("{") - line.count("}")
+
+        tables[-1]["lines"].append({
+            "text": line,
+            "column": column,
+            "is_key": bool(column) and (
+                column.lower() == "id" or column.lower().endswith("_id") or bool(KEY_COLUMN_PATTERN.search(line))
+            ),
+            "refs": REF_TARGET_PATTERN.findall(line) if column else []
+        })
+
+    return "\n".join(preamble).strip(), tables
@@ -9,3 +9,39 @@ Kiểm tra câu SQL có phải là câu lệnh SELECT an toàn
 """
 def is_safe_sql(sql):
     return re.match(r"(?i)^\s*SELECT\s+", sql.strip()) is not None
+
+
+# LIMIT ở cuối câu: "LIMIT n", "LIMIT n OFFSET m" hoặc "LIMIT m, n"
+TRAILING_LIMIT_PATTERN = re.compile(
+    r"\s+LIMIT\s+(\d+)(?:\s*,\s*(\d+)|\s+OFFSET\s+(\d+))?\s*;?\s*$", re.IGNORECASE
+)
+
+"""
+Tách LIMIT/OFFSET ở cuối câu SQL để phân trang lại trên câu truy vấn gốc.
+Trả về (sql không có LIMIT, limit hoặc None, offset)
+"""
+def split_trailing_limit(sql):
+    sql = sql.strip().rstrip(";").rstrip()
+    match = TRAILING_LIMIT_PATTERN.search(sql)
+    if not match:
+        return sql, None, 0
+    base_sql = sql[:match.start()]
+    first, comma_count, offset = match.groups()
+    if comma_count is not None:
+        return base_sql, int(comma_count), int(first)
+    return base_sql, int(first), int(offset or 0)
+
+"""
+Thêm LIMIT/OFFSET cho một trang (giá trị ép kiểu int nên an toàn khi ghép chuỗi)
+"""
+def build_page_sql(base_sql, limit, offset):
+    return f"{base_sql} LIMIT {int(limit)} OFFSET {int(offset)}"
+
+ORDER_BY_PATTERN = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+
+"""
+Câu SQL có ORDER BY hay không. Không có ORDER BY thì LIMIT/OFFSET không đảm bảo thứ tự
+giữa các trang (có thể lặp hoặc bỏ sót dòng)
+"""
+def has_order_by(sql):
+    return ORDER_BY_PATTERN.search(sql) is not None
@@ -0,0 +1,614 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from report_parser import extract_efforts
+
+# Ngưỡng điểm tối thiểu để coi là match (30%)
+MIN_SIMILARITY_SCORE = 0.3
+
+# Các từ không quan trọng khi so khớp task
+STOP_WORDS = frozenset({'làm', 'viết', 'tạo', 'thực', 'hiện', 'công', 'việc', 'task', 'work', 'do', 'make', 'create'})
+
+# Các từ khóa tương tự: "mockup" ~ "mock up", "register" ~ "registration"
+SIMILAR_KEYWORDS = {
+    'mockup': ['mock', 'up', 'design'],
+    'register': ['registration', 'signup', 'sign'],
+    'meeting': ['meet', 'discussion', 'báo cáo'],
+    'estimate': ['estimation', 'tính toán'],
+    'price': ['pricing', 'giá', 'cost'],
+    'schedule': ['lịch', 'trình', 'plan'],
+    'transfer': ['chuyển', 'move', 'copy']
+}
+
+# Ngưỡng cosine tối thiểu khi so khớp bằng embedding
+MIN_EMBEDDING_SCORE = 0.5
+
+# Từ ngưỡng này kết quả so khớp cục bộ đủ tin cậy, không cần hỏi Gemini
+CONFIDENT_MATCH_SCORE = 0.8
+# Số task ứng viên tối đa gửi kèm mỗi dòng chưa giải quyết
+HYBRID_TOP_K = 5
+
+SYSTEM_TASK_PATTERN = re.compile(r'(\d+)\s*-\s*([^-]+)\s*-\s*(.+)')
+
+# Tham số BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def parse_tasks_from_system(tasks_text):
+    """
+    Parse danh sách task từ hệ thống
+    Format: "ID - ProjectName - TaskName"
+    """
+    tasks = []
+    lines = tasks_text.strip().split('\n')
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        # Pattern: "221 - HousingStaff - Mockup register"
+        match = SYSTEM_TASK_PATTERN.match(line)
+        if match:
+            task_id, project_name, task_name = match.groups()
+            tasks.append({
+                'id': task_id.strip(),
+                'project_name': project_name.strip(),
+                'task_name': task_name.strip()
+            })
+
+    return tasks
+
+
+def parse_daily_report(report_text):
+    """
+    Parse báo cáo hằng ngày để extract thông tin effort
+    Chỉ phân tích phần Actual (mọi định dạng header mà report_parser hỗ trợ)
+    """
+    return extract_efforts(report_text)
+
+
+@lru_cache(maxsize=4096)
+def _similar_keyword(word):
+    """
+    Trả về từ khóa gốc trong SIMILAR_KEYWORDS mà word thuộc về (hoặc None)
+    """
+    for key, similar_list in SIMILAR_KEYWORDS.items():
+        if word in similar_list or key in word:
+            return key
+    return None
+
+
+def _analyze(text):
+    """
+    Tiền xử lý text một lần: (lowercase, tập từ sau khi bỏ stop words, tập từ khóa tương tự)
+    """
+    lower = text.lower()
+    words = frozenset(lower.split()) - STOP_WORDS
+    keywords = frozenset(k for k in map(_similar_keyword, words) if k)
+    return lower, words, keywords
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _score_analyzed(daily, system):
+    """
+    Tính điểm tương đồng từ dữ liệu đã tiền xử lý, cùng quy tắc với calculate_similarity_score
+    """
+    daily_lower, daily_words, daily_keywords = daily
+    system_lower, system_words, system_keywords = system
+
+    # 1. Exact match hoặc substring match
+    if daily_lower == system_lower:
+        return 1.0
+    if daily_lower in system_lower or system_lower in daily_lower:
+        return 0.8
+
+    if not daily_words or not system_words:
+        return 0.0
+
+    # 2. Keyword matching
+    common_words = daily_words & system_words
+    if common_words:
+        similarity = len(common_words) / max(len(daily_words), len(system_words))
+        return min(similarity * 1.5, 1.0)  # Tăng điểm cho keyword matching
+
+    # 3. Fuzzy matching cho các từ tương tự
+    if daily_keywords & system_keywords:
+        return 0.6
+
+    return 0.0
+
+
+def calculate_similarity_score(daily_task, system_task):
+    """
+    Tính điểm tương đồng giữa task trong báo cáo và task trong hệ thống
+    Trả về điểm từ 0-1, càng cao càng tương tự
+    """
+    return _score_analyzed(_analyze(daily_task), _analyze(system_task))
+
+
+class TaskIndex:
+    """
+    Inverted index cho danh sách task hệ thống.
+
+    Task được tiền xử lý một lần (token, từ khóa tương tự), sau đó mỗi task trong
+    báo cáo chỉ được so với các task xuất hiện trong postings list của nó thay vì
+    toàn bộ hệ thống. Ứng viên được xếp hạng theo điểm tương đồng (giữ ngưỡng 0.3),
+    hoà điểm thì phân định bằng BM25.
+    """
+
+    def __init__(self, system_tasks):
+        self.tasks = list(system_tasks)
+        self.analyzed = [_analyze(task['task_name']) for task in self.tasks]
+
+        self.postings = defaultdict(list)       # term -> [task index]
+        self.by_text = defaultdict(list)        # lowercase task name -> [task index]
+        self.trigrams = defaultdict(set)        # trigram ký tự -> {task index}, cho substring match
+        self.by_project = defaultdict(set)      # lowercase project name -> {task index}
+        self.doc_terms = []
+        self.doc_lengths = []
+
+        for idx, (task, (lower, words, keywords)) in enumerate(zip(self.tasks, self.analyzed)):
+            terms = self._terms(words, keywords)
+            for term in terms:
+                self.postings[term].append(idx)
+            self.by_text[lower].append(idx)
+            for gram in _trigrams(lower):
+                self.trigrams[gram].add(idx)
+            self.by_project[task['project_name'].lower()].add(idx)
+            self.doc_terms.append(frozenset(terms))
+            self.doc_lengths.append(len(terms))
+
+        self.text_lengths = sorted({len(text) for text in self.by_text})
+        total = len(self.tasks)
+        self.avg_doc_length = (sum(self.doc_lengths) / total) if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(ids) + 0.5) / (len(ids) + 0.5))
+            for term, ids in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.tasks)
+
+    @staticmethod
+    def _terms(words, keywords):
+        # Từ khóa tương tự được đánh tiền tố để không trùng với từ thường
+        return set(words) | {f"~{key}" for key in keywords}
+
+    def _substring_candidates(self, lower):
+        """
+        Task có tên là substring của lower hoặc chứa lower (kể cả khi cắt ngang từ)
+        """
+        found = set()
+        # Tên task hệ thống nằm trong câu báo cáo: tra từng đoạn con có độ dài phù hợp
+        for length in self.text_lengths:
+            if length > len(lower):
+                break
+            for start in range(len(lower) - length + 1):
+                found.update(self.by_text.get(lower[start:start + length], ()))
+
+        # Câu báo cáo nằm trong tên task hệ thống: giao các trigram
+        grams = _trigrams(lower)
+        if grams:
+            postings = sorted((self.trigrams.get(gram, set()) for gram in grams), key=len)
+            found.update(set.intersection(*postings) if postings[0] else ())
+        elif lower:
+            # Chuỗi quá ngắn để có trigram, hiếm gặp nên quét tuần tự
+            found.update(idx for idx, analyzed in enumerate(self.analyzed) if lower in analyzed[0])
+        return found
+
+    def _bm25(self, query_terms, idx):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[idx] / (self.avg_doc_length or 1))
+        score = 0.0
+        for term in query_terms & self.doc_terms[idx]:
+            # Mỗi term chỉ xuất hiện một lần trong tập → tf = 1
+            score += self.idf[term] * (BM25_K1 + 1) / (1 + norm)
+        return score
+
+    def _scored(self, task_desc):
+        """
+        Lấy các task ứng viên từ postings list và chấm điểm tương đồng.
+
+        Returns:
+            (query_terms, list (score, task_index) của các ứng viên đạt ngưỡng)
+        """
+        query = _analyze(task_desc)
+        lower, words, keywords = query
+        query_terms = self._terms(words, keywords)
+
+        candidate_ids = set()
+        for term in query_terms:
+            candidate_ids.update(self.postings.get(term, ()))
+        # Exact/substring match không cần chung token
+        candidate_ids.update(self._substring_candidates(lower))
+
+        scored = []
+        analyzed = self.analyzed
+        for idx in candidate_ids:
+            score = _score_analyzed(query, analyzed[idx])
+            if score >= MIN_SIMILARITY_SCORE:
+                scored.append((score, idx))
+        return query_terms, scored
+
+    def candidates(self, task_desc, limit=None):
+        """
+        Xếp hạng các task ứng viên cho một dòng báo cáo.
+
+        Returns:
+            List (score, bm25, task_index) sắp xếp giảm dần, chỉ gồm ứng viên đạt ngưỡng
+        """
+        query_terms, scored = self._scored(task_desc)
+        ranked = [(score, self._bm25(query_terms, idx), idx) for score, idx in scored]
+        # Điểm cao hơn trước, hoà thì BM25 cao hơn, sau đó giữ thứ tự gốc của task
+        ranked.sort(key=lambda item: (-item[0], -item[1], item[2]))
+        return ranked[:limit] if limit else ranked
+
+    def best_match(self, task_desc, project_name=None):
+        """
+        Tìm task hệ thống phù hợp nhất, ưu tiên task cùng project.
+
+        Returns:
+            (system_task, score) hoặc (None, 0)
+        """
+        query_terms, scored = self._scored(task_desc)
+        if not scored:
+            return None, 0
+
+        if project_name:
+            project_ids = self.by_project.get(project_name.lower())
+            if project_ids:
+                in_project = [item for item in scored if item[1] in project_ids]
+                if in_project:
+                    scored = in_project
+
+        # BM25 chỉ cần tính cho các ứng viên hoà điểm cao nhất
+        best_score = max(score for score, _ in scored)
+        tied = [idx for score, idx in scored if score == best_score]
+        if len(tied) == 1:
+            return self.tasks[tied[0]], best_score
+        best_idx = max(tied, key=lambda idx: (self._bm25(query_terms, idx), -idx))
+        return self.tasks[best_idx], best_score
+
+
+class TaskEmbeddingCache:
+    """
+    Cache embedding của task hệ thống theo (task ID, hash nội dung).
+
+    Task không đổi nội dung sẽ không bao giờ bị encode lại; task mới hoặc đã sửa
+    được encode chung một batch. Embedding được chuẩn hoá nên cosine = tích vô hướng.
+    """
+
+    def __init__(self, model, max_entries=50000, batch_size=64):
+        self.model = model
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self._cache = OrderedDict()  # (task_id, text_hash) -> np.ndarray float32
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(task):
+        text_hash = hashlib.sha1(task['task_name'].encode('utf-8')).hexdigest()
+        return task['id'], text_hash
+
+    def encode(self, texts):
+        """
+        Encode một batch text, trả về ma trận float32 đã chuẩn hoá (len(texts), dim)
+        """
+        embeddings = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def encode_tasks(self, system_tasks):
+        """
+        Lấy ma trận embedding cho danh sách task, chỉ encode các task chưa có trong cache
+        """
+        keys = [self._key(task) for task in system_tasks]
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        vectors = {}
+        missing = {}
+        with self._lock:
+            for key, task in zip(keys, system_tasks):
+                vector = self._cache.get(key)
+                if vector is None:
+                    missing[key] = task['task_name']
+                else:
+                    self._cache.move_to_end(key)
+                    vectors[key] = vector
+
+        if missing:
+            encoded = self.encode(missing.values())
+            with self._lock:
+                for key, vector in zip(missing, encoded):
+                    vectors[key] = vector
+                    self._cache[key] = vector
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+        return np.vstack([vectors[key] for key in keys])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached_tasks": len(self._cache),
+                "max_entries": self.max_entries
+            }
+
+
+def _allocate_efforts(daily_efforts, matches):
+    """
+    Phân bổ effort theo kết quả match.
+
+    :param matches: list song song với daily_efforts, mỗi phần tử là list (system_task, score)
+                    song song với daily_effort['tasks']
+    """
+    results = []
+    undefined_tasks = []
+
+    for daily_effort, task_matches in zip(daily_efforts, matches):
+        project_name = daily_effort['project_name']
+        total_effort = daily_effort['effort']
+        daily_tasks = daily_effort['tasks']
+
+        matched_daily_tasks = []
+        unmatched_daily_tasks = []
+
+        for task_desc, (best_match, best_score) in zip(daily_tasks, task_matches):
+            if best_match:
+                matched_daily_tasks.append({
+                    'daily_task': task_desc,
+                    'system_task': best_match,
+                    'score': best_score
+                })
+            else:
+                unmatched_daily_tasks.append(task_desc)
+
+        # Phân bổ effort cho các task đã match
+        if matched_daily_tasks:
+            effort_per_matched_task = total_effort / len(matched_daily_tasks)
+            for match in matched_daily_tasks:
+                results.append(f"{match['system_task']['id']} - {effort_per_matched_task}")
+
+        # Thêm các task không match vào undefined
+        for task_desc in unmatched_daily_tasks:
+            undefined_tasks.append({
+                'project_name': project_name,
+                'task_name': task_desc,
+                'effort': total_effort / len(daily_tasks) if daily_tasks else total_effort
+            })
+
+    return results, undefined_tasks
+
+
+def match_tasks_with_system_tasks(daily_efforts, system_tasks, task_index=None):
+    """
+    Match effort từ báo cáo với task trong hệ thống
+    Cải thiện logic để chấp nhận task có ý nghĩa tương tự
+
+    :param task_index: TaskIndex dựng sẵn từ system_tasks (tự dựng nếu không truyền)
+    """
+    if task_index is None:
+        task_index = TaskIndex(system_tasks)
+
+    # Ưu tiên tìm trong cùng project trước, sau đó trong toàn bộ hệ thống
+    matches = [
+        [task_index.best_match(task_desc, daily_effort['project_name']) for task_desc in daily_effort['tasks']]
+        for daily_effort in daily_efforts
+    ]
+    return _allocate_efforts(daily_efforts, matches)
+
+
+def match_tasks_with_embeddings(daily_efforts, system_tasks, embedding_cache, min_score=MIN_EMBEDDING_SCORE):
+    """
+    Match effort từ báo cáo với task hệ thống bằng độ tương đồng embedding.
+
+    Toàn bộ ma trận tương đồng (task báo cáo × task hệ thống) được tính bằng một
+    phép nhân ma trận. Vẫn ưu tiên task cùng project nếu đạt min_score.
+    """
+    daily_texts = [task_desc for daily_effort in daily_efforts for task_desc in daily_effort['tasks']]
+    if not daily_texts or not system_tasks:
+        return _allocate_efforts(daily_efforts, [[(None, 0)] * len(e['tasks']) for e in daily_efforts])
+
+    system_matrix = embedding_cache.encode_tasks(system_tasks)
+    daily_matrix = embedding_cache.encode(daily_texts)
+    similarities = daily_matrix @ system_matrix.T  # (n_daily, n_system)
+
+    # Mask task cùng project cho từng dòng
+    system_projects = np.array([task['project_name'].lower() for task in system_tasks])
+    daily_projects = np.array([
+        daily_effort['project_name'].lower()
+        for daily_effort in daily_efforts for _ in daily_effort['tasks']
+    ])
+    same_project = daily_projects[:, None] == system_projects[None, :]
+
+    rows = np.arange(len(daily_texts))
+    project_best = np.where(same_project, similarities, -np.inf).argmax(axis=1)
+    project_scores = similarities[rows, project_best]
+    project_ok = same_project[rows, project_best] & (project_scores >= min_score)
+
+    global_best = similarities.argmax(axis=1)
+    best = np.where(project_ok, project_best, global_best)
+    best_scores = similarities[rows, best]
+
+    flat_matches = [
+        (system_tasks[idx], float(score)) if score >= min_score else (None, 0)
+        for idx, score in zip(best.tolist(), best_scores.tolist())
+    ]
+
+    matches = []
+    offset = 0
+    for daily_effort in daily_efforts:
+        count = len(daily_effort['tasks'])
+        matches.append(flat_matches[offset:offset + count])
+        offset += count
+
+    return _allocate_efforts(daily_efforts, matches)
+
+
+def split_confident_matches(daily_efforts, task_index, confident_score=CONFIDENT_MATCH_SCORE, top_k=HYBRID_TOP_K):
+    """
+    Tách các dòng báo cáo thành phần đã match chắc chắn (cục bộ) và phần cần hỏi thêm AI.
+
+    Effort của project được chia đều cho các task trong project.
+
+    Returns:
+        (resolved, unresolved)
+        resolved: list {"task": system_task, "effort", "score"}
+        unresolved: list {"line", "project_name", "task_name", "effort", "candidates": [system_task]}
+    """
+    resolved = []
+    unresolved = []
+    line = 0
+
+    for daily_effort in daily_efforts:
+        project_name = daily_effort['project_name']
+        daily_tasks = daily_effort['tasks'] or ['']
+        effort = daily_effort['effort'] / len(daily_tasks)
+
+        for task_desc in daily_tasks:
+            line += 1
+            best_match, best_score = task_index.best_match(task_desc, project_name) if task_desc else (None, 0)
+            if best_match and best_score >= confident_score:
+                resolved.append({"task": best_match, "effort": effort, "score": best_score})
+                continue
+
+            candidates = []
+            if task_desc:
+                ranked = task_index.candidates(task_desc)
+                project_ids = task_index.by_project.get(project_name.lower(), set())
+                # Ứng viên cùng project được xếp trước
+                ranked.sort(key=lambda item: item[2] not in project_ids)
+                chosen = [idx for _, _, idx in ranked[:top_k]]
+                # Diễn đạt khác hẳn (không chung từ khóa): bổ sung task cùng project để AI chọn
+                for idx in sorted(project_ids):
+                    if len(chosen) >= top_k:
+                        break
+                    if idx not in chosen:
+                        chosen.append(idx)
+                candidates = [task_index.tasks[idx] for idx in chosen]
+            unresolved.append({
+                "line": line,
+                "project_name": project_name,
+                "task_name": task_desc,
+                "effort": effort,
+                "candidates": candidates
+            })
+
+    return resolved, unresolved
+
+
+# ---- Xử lý hàng loạt báo cáo (bulk) ----
+
+# Số báo cáo gửi sang worker trong một lần để giảm chi phí IPC
+BULK_CHUNK_SIZE = 16
+# Dưới ngưỡng này xử lý ngay trong process hiện tại, không dựng process pool
+BULK_INLINE_THRESHOLD = 32
+
+_bulk_task_index = None
+
+
+def _init_bulk_worker(task_index):
+    """
+    Khởi tạo worker: nhận TaskIndex đã dựng sẵn một lần duy nhất
+    """
+    global _bulk_task_index
+    _bulk_task_index = task_index
+
+
+def _process_report(report, task_index):
+    report_id = report.get("id")
+    daily_report = report.get("daily_report", "")
+    if report.get("error"):
+        return {"id": report_id, "error": report["error"]}
+    if not daily_report:
+        return {"id": report_id, "error": "Thiếu daily_report"}
+
+    try:
+        daily_efforts = parse_daily_report(daily_report)
+        results, undefined_tasks = match_tasks_with_system_tasks(daily_efforts, task_index.tasks, task_index)
+    except Exception as e:
+        return {"id": report_id, "error": str(e)}
+
+    return {
+        "id": report_id,
+        "results": results,
+        "undefined": undefined_tasks,
+        "summary": {
+            "total_daily_efforts": len(daily_efforts),
+            "matched_results": len(results),
+            "undefined_tasks": len(undefined_tasks)
+        }
+    }
+
+
+def _process_report_chunk(reports):
+    return [_process_report(report, _bulk_task_index) for report in reports]
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_bulk_results(task_index, reports, workers=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Parse và match nhiều báo cáo với cùng một TaskIndex, trả về lần lượt từng kết quả.
+
+    Báo cáo được đọc lười từ iterable `reports` (mỗi phần tử {"id", "daily_report"}) và
+    chỉ giữ tối đa 2 chunk / worker đang xử lý, nên bộ nhớ không tăng theo kích thước input.
+    Kết quả giữ nguyên thứ tự input.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunked(reports, chunk_size)
+
+    # Gom các chunk đầu tiên: input nhỏ thì xử lý luôn, khỏi tốn chi phí dựng pool
+    head = []
+    head_size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        head_size += len(chunk)
+        if head_size >= BULK_INLINE_THRESHOLD:
+            break
+    else:
+        for chunk in head:
+            for report in chunk:
+                yield _process_report(report, task_index)
+        return
+
+    def all_chunks():
+        yield from head
+        yield from chunks
+
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_bulk_worker, initargs=(task_index,)) as pool:
+        pending = deque()
+        for chunk in all_chunks():
+            pending.append(pool.submit(_process_report_chunk, chunk))
+            if len(pending) >= max_in_flight:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
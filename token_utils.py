@@ -3,6 +3,31 @@ import logging
 import re
 from typing import Tuple, Optional
 
+from schema_utils import parse_schema_tables
+
+# Cột ít giá trị cho việc sinh SQL, chỉ giữ khi câu hỏi nhắc đến
+LOW_VALUE_COLUMNS = {"created_at", "updated_at", "deleted_at", "created_by", "updated_by", "deleted_by"}
+# Cột nhạy cảm đã bị cấm trong BUSINESS RULES của prompt, luôn bỏ
+SENSITIVE_COLUMNS = {"password", "ssn", "bank_account", "internal_notes"}
+# Từ chung chung trong tên bảng / cột, không dùng để chấm điểm
+GENERIC_NAME_TERMS = {"id", "at", "by", "is", "of"}
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def _terms(words):
+    """
+    Tập từ (chữ thường) kèm dạng số ít đơn giản: projects -> project
+    """
+    terms = set()
+    for word in words:
+        word = word.lower()
+        if word in GENERIC_NAME_TERMS:
+            continue
+        terms.add(word)
+        if len(word) > 3 and word.endswith("s"):
+            terms.add(word[:-1])
+    return terms
+
 class TokenManager:
     """
     Quản lý token cho Gemini API calls
@@ -98,6 +123,136 @@ class TokenManager:
         
         return truncated_schema
     
+    def pack_schema(self, schema: str, question: str, max_tokens: int = None) -> str:
+        """
+        Rút gọn schema theo mức độ liên quan đến câu hỏi, ở mức bảng và cột
+
+        - Luôn bỏ cột nhạy cảm; bỏ created_at/updated_at/... trừ khi câu hỏi nhắc đến
+        - Luôn giữ khóa chính / khóa ngoại của bảng được chọn để JOIN được
+        - Nếu vẫn vượt budget: chấm điểm bảng (tên bảng / cột xuất hiện trong câu hỏi, bảng được
+          bảng liên quan tham chiếu) rồi lấp budget theo thứ tự: khóa + cột được nhắc của bảng liên quan,
+          các cột còn lại của bảng liên quan, rồi đến các bảng khác
+
+        Args:
+            schema: Schema text
+            question: User question
+            max_tokens: Max tokens cho schema (default: MAX_INPUT_TOKENS - question_tokens - prompt_overhead)
+
+        Returns:
+            Schema đã được rút gọn, các bảng giữ nguyên thứ tự trong file
+        """
+        if max_tokens is None:
+            question_tokens = self.count_tokens(question)
+            prompt_overhead = 1000  # Estimate for prompt template
+            max_tokens = self.MAX_INPUT_TOKENS - question_tokens - prompt_overhead
+
+        preamble, tables = parse_schema_tables(schema)
+        if not tables:
+            return self.truncate_schema(schema, question, max_tokens)
+
+        question_terms = _terms(WORD_PATTERN.findall(question))
+        table_scores = []
+        required = []   # index dòng bắt buộc (khung bảng, khóa, cột được nhắc) theo bảng
+        optional = []   # index cột còn lại theo bảng
+        for table in tables:
+            score = 3 * len(_terms(table["name"].split("_")) & question_terms)
+            table_required, table_optional = [], []
+            for index, line in enumerate(table["lines"]):
+                column = line["column"]
+                if column is None:
+                    table_required.append(index)
+                    continue
+                name = column.lower()
+                mentioned = bool(_terms(name.split("_")) & question_terms)
+                if name in SENSITIVE_COLUMNS or (name in LOW_VALUE_COLUMNS and not mentioned):
+                    continue
+                if mentioned:
+                    score += 1
+                if line["is_key"] or mentioned:
+                    table_required.append(index)
+                else:
+                    table_optional.append(index)
+            table_scores.append(score)
+            required.append(table_required)
+            optional.append(table_optional)
+
+        def build(selected):
+            blocks = [preamble] if preamble else []
+            for table_index, table in enumerate(tables):
+                if table_index in selected:
+                    kept = selected[table_index]
+                    lines = [table["header"]] + [line["text"] for i, line in enumerate(table["lines"]) if i in kept]
+                    blocks.append("\n".join(lines).strip())
+            return "\n\n".join(blocks)
+
+        full = {i: set(required[i]) | set(optional[i]) for i in range(len(tables))}
+        pruned_schema = build(full)
+        pruned_tokens = self.count_tokens(pruned_schema)
+        if pruned_tokens <= max_tokens:
+            logging.info(f"Schema tokens after column pruning: {pruned_tokens} (limit {max_tokens})")
+            return pruned_schema
+
+        logging.warning(f"Schema too long ({pruned_tokens} tokens). Packing by relevance to {max_tokens} tokens.")
+
+        # Bảng được bảng liên quan tham chiếu (qua ref hoặc cột xxx_id) được cộng điểm để giữ đường JOIN
+        by_name = {table["name"].lower(): i for i, table in enumerate(tables)}
+        for table_index, table in enumerate(tables):
+            if table_scores[table_index] <= 0:
+                continue
+            for line in table["lines"]:
+                if not line["is_key"] or line["column"] is None:
+                    continue
+                targets = [ref.lower() for ref in line["refs"]]
+                if line["column"].lower().endswith("_id"):
+                    stem = line["column"].lower()[:-3]
+                    targets += [stem, stem + "s", stem + "es"]
+                for target in targets:
+                    target_index = by_name.get(target)
+                    if target_index is not None and table_scores[target_index] == 0:
+                        table_scores[target_index] = 0.5
+
+        ranked = sorted(range(len(tables)), key=lambda i: -table_scores[i])
+        relevant = [i for i in ranked if table_scores[i] > 0]
+        others = [i for i in ranked if table_scores[i] <= 0]
+
+        def line_tokens(table_index, index):
+            return self.count_tokens(tables[table_index]["lines"][index]["text"]) + 1
+
+        selected = {}
+        used = self.count_tokens(preamble) + 2
+
+        def add_tables(indexes):
+            nonlocal used
+            for table_index in indexes:
+                cost = self.count_tokens(tables[table_index]["header"]) + 2
+                cost += sum(line_tokens(table_index, index) for index in required[table_index])
+                if used + cost <= max_tokens:
+                    selected[table_index] = set(required[table_index])
+                    used += cost
+
+        def add_columns(indexes):
+            nonlocal used
+            for table_index in indexes:
+                if table_index not in selected:
+                    continue
+                for index in optional[table_index]:
+                    cost = line_tokens(table_index, index)
+                    if used + cost <= max_tokens:
+                        selected[table_index].add(index)
+                        used += cost
+
+        add_tables(relevant)
+        add_columns(relevant)
+        add_tables(others)
+        add_columns(others)
+
+        packed_schema = build(selected)
+        logging.info(
+            f"Packed schema: {len(selected)}/{len(tables)} tables, "
+            f"{self.count_tokens(packed_schema)} tokens (relevant tables: {[tables[i]['name'] for i in relevant]})"
+        )
+        return packed_schema
+
     def validate_prompt(self, prompt: str) -> Tuple[bool, str]:
         """
         Validate prompt trước khi gọi API